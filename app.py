@@ -3,9 +3,11 @@ Aplicación Flask principal - PlanBuyCook
 
 Inicializa la aplicación, registra blueprints y ejecuta el servidor.
 """
-from flask import Flask, render_template
+from flask import Flask, abort, g, render_template, request, session
 from config import Config
-from models import db
+from models import db, Household
+import tenancy
+import units
 
 
 def create_app(config_class=Config):
@@ -18,6 +20,26 @@ def create_app(config_class=Config):
     # Inicializar extensiones
     db.init_app(app)
     
+    # Cantidades en unidad base mostradas en la unidad más legible (1500 g -> 1,5 kg)
+    app.add_template_filter(units.format_quantity, 'qty')
+    app.jinja_env.globals['units_by_base'] = units.compatible_units_by_base()
+    
+    # Hogar de cada petición: cabecera X-Household-Id (clientes API / sync) o el elegido en la sesión
+    @app.before_request
+    def select_household():
+        header_id = request.headers.get('X-Household-Id', type=int)
+        household_id = header_id or session.get('household_id')
+        if household_id and db.session.get(Household, household_id) is None:
+            if header_id:
+                abort(404, description='Hogar inexistente')
+            session.pop('household_id', None)
+            household_id = None
+        g.household_id = household_id or tenancy.DEFAULT_HOUSEHOLD_ID
+    
+    @app.context_processor
+    def inject_household():
+        return {'current_household': db.session.get(Household, tenancy.current_household_id())}
+    
     # Registrar blueprints
     from routes import main_bp
     app.register_blueprint(main_bp)
@@ -27,9 +49,12 @@ def create_app(config_class=Config):
     def index():
         return render_template('index.html')
     
-    # Crear tablas si no existen
+    # Crear tablas si no existen y el hogar por defecto
     with app.app_context():
         db.create_all()
+        if db.session.get(Household, tenancy.DEFAULT_HOUSEHOLD_ID) is None:
+            db.session.add(Household(id=tenancy.DEFAULT_HOUSEHOLD_ID, name='Mi casa'))
+            db.session.commit()
     
     return app
 
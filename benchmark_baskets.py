@@ -0,0 +1,84 @@
+"""
+Benchmark del reparto de la lista de compra en cestas por tienda
+
+Ejecuta solo BasketService.split (sin base de datos) con listas y tiendas
+sintéticas y compara el coste total con dos referencias:
+- Cada item en su tienda más barata (ignora los envíos)
+- La mejor tienda única que tenga todos los items
+
+Uso:
+    python benchmark_baskets.py                         # Tamaños por defecto
+    python benchmark_baskets.py --items 100 5000 --stores 12 --budget 1.0
+"""
+import argparse
+import random
+import time
+from services import BasketService
+
+
+def synthetic_options(n_items, n_stores, coverage, rng):
+    """Precios por item y tienda; cada tienda vende una fracción del catálogo"""
+    stores = {
+        store_id: (rng.choice([0.0, 2.5, 4.9, 6.5]), rng.choice([0.0, 20.0, 40.0, 60.0]))
+        for store_id in range(1, n_stores + 1)
+    }
+    options = {}
+    for item in range(n_items):
+        base = rng.uniform(0.5, 15.0)
+        costs = {store_id: round(base * rng.uniform(0.8, 1.3), 2)
+                 for store_id in stores if rng.random() < coverage}
+        if not costs:
+            costs[rng.choice(list(stores))] = round(base, 2)
+        options[item] = costs
+    return options, stores
+
+
+def total_cost(assignment, options, stores):
+    """Coste con envíos; las cestas por debajo del mínimo se rellenan hasta él"""
+    subtotal = {}
+    for item, store_id in assignment.items():
+        subtotal[store_id] = subtotal.get(store_id, 0.0) + options[item][store_id]
+    return sum(amount + stores[s][0] + max(0.0, stores[s][1] - amount) for s, amount in subtotal.items())
+
+
+def cheapest_per_item(options):
+    return {item: min(costs, key=costs.get) for item, costs in options.items()}
+
+
+def best_single_store(options, stores):
+    """Mejor tienda que cubre toda la lista, o None si ninguna la cubre"""
+    full = [s for s in stores if all(s in costs for costs in options.values())]
+    if not full:
+        return None
+    return min((total_cost({item: s for item in options}, options, stores) for s in full))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--items', type=int, nargs='+', default=[50, 200, 1000, 5000])
+    parser.add_argument('--stores', type=int, default=8)
+    parser.add_argument('--coverage', type=float, default=0.7, help='Fracción del catálogo que vende cada tienda')
+    parser.add_argument('--budget', type=float, default=0.5)
+    args = parser.parse_args()
+    
+    print(f"{'items':>6} {'tiempo':>8} {'iter':>5} {'cestas':>6} {'total':>10} "
+          f"{'más barata':>11} {'una tienda':>11}")
+    for n_items in args.items:
+        rng = random.Random(n_items)
+        options, stores = synthetic_options(n_items, args.stores, args.coverage, rng)
+        
+        started = time.perf_counter()
+        result = BasketService.split(options, stores, time_budget=args.budget)
+        elapsed = time.perf_counter() - started
+        
+        baskets = len(set(result['assignment'].values()))
+        split_total = total_cost(result['assignment'], options, stores)
+        naive_total = total_cost(cheapest_per_item(options), options, stores)
+        single = best_single_store(options, stores)
+        single_text = f"{single:>11.2f}" if single is not None else f"{'-':>11}"
+        print(f"{n_items:>6} {elapsed:>7.3f}s {result['iterations']:>5} {baskets:>6} {split_total:>10.2f} "
+              f"{naive_total:>11.2f} {single_text}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark del planificador automático sobre catálogos sintéticos
+
+Ejecuta solo el núcleo PlannerService.optimize (sin base de datos) con
+catálogos generados al azar y mide el tiempo del voraz, las iteraciones de
+búsqueda local y lo que habría que comprar, comparado con un plan aleatorio
+que respeta las mismas restricciones.
+
+Uso:
+    python benchmark_planner.py                         # Tamaños por defecto
+    python benchmark_planner.py --dishes 20000 --ingredients 2000 --budget 1.0
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from services import PlannerService
+
+
+def synthetic_catalog(n_dishes, n_ingredients, per_dish, rng):
+    """Platos con per_dish ingredientes al azar y un stock parcial"""
+    dishes = {}
+    for dish_id in range(1, n_dishes + 1):
+        ingredient_ids = rng.sample(range(1, n_ingredients + 1), per_dish)
+        dishes[dish_id] = {
+            'meal_types': set(rng.sample(['breakfast', 'lunch', 'dinner'], rng.randint(0, 2))),
+            'requirements': {i: round(rng.uniform(10, 500), 1) for i in ingredient_ids},
+        }
+    stock = {i: rng.choice([0.0, rng.uniform(0, 2000)]) for i in range(1, n_ingredients + 1)}
+    return dishes, stock
+
+
+def week_slots(days):
+    start = date.today()
+    return [(start + timedelta(days=d), meal_type)
+            for d in range(days) for meal_type in ('breakfast', 'lunch', 'dinner')]
+
+
+def purchase_cost(assignments, dishes, stock):
+    """Nº de ingredientes a comprar y cantidad total para un plan"""
+    consumption = {}
+    for dish_id, _, _ in assignments.values():
+        for ingredient_id, quantity in dishes[dish_id]['requirements'].items():
+            consumption[ingredient_id] = consumption.get(ingredient_id, 0.0) + quantity
+    missing = {i: q - stock.get(i, 0.0) for i, q in consumption.items() if q > stock.get(i, 0.0)}
+    return len(missing), sum(missing.values())
+
+
+def random_plan(slots, dishes, rng):
+    assignments = {}
+    for slot in slots:
+        pool = [d for d, e in dishes.items() if not e['meal_types'] or slot[1] in e['meal_types']]
+        assignments[slot] = (rng.choice(pool), 'cook', None)
+    return assignments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--dishes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--ingredients', type=int, default=1000)
+    parser.add_argument('--per-dish', type=int, default=8)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--budget', type=float, default=0.5)
+    args = parser.parse_args()
+    
+    slots = week_slots(args.days)
+    print(f"{'platos':>8} {'greedy+ls':>10} {'iter':>7} {'compras':>8} {'cantidad':>10} "
+          f"{'aleatorio':>10} {'cantidad':>10}")
+    for n_dishes in args.dishes:
+        rng = random.Random(n_dishes)
+        dishes, stock = synthetic_catalog(n_dishes, args.ingredients, args.per_dish, rng)
+        
+        started = time.perf_counter()
+        result = PlannerService.optimize(slots, dishes, stock, time_budget=args.budget)
+        elapsed = time.perf_counter() - started
+        
+        items, quantity = purchase_cost(result['assignments'], dishes, stock)
+        random_items, random_quantity = purchase_cost(random_plan(slots, dishes, rng), dishes, stock)
+        print(f"{n_dishes:>8} {elapsed:>9.2f}s {result['iterations']:>7} {items:>8} {quantity:>10.0f} "
+              f"{random_items:>10} {random_quantity:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
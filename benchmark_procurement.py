@@ -0,0 +1,146 @@
+"""
+Benchmark de las compras centrales con muchos hogares
+
+Crea una base de datos de prueba con N hogares, cada uno con su catálogo,
+stock y una semana de comidas planificadas, y mide
+ProcurementService.generate (faltantes de todos los hogares en una
+consulta agrupada) y ProcurementService.receive (reparto por lotes).
+
+¡Usa una base de datos desechable! Se borra y se vuelve a crear.
+
+Uso:
+    python benchmark_procurement.py                          # SQLite temporal
+    python benchmark_procurement.py --households 100 1000 5000 --ingredients 40
+    python benchmark_procurement.py --database-url mysql+pymysql://root:@localhost/planbuycook_bench
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from config import Config
+from app import create_app
+from models import (
+    db, Household, Ingredient, PantryStock, Store, ProductPack, Dish, DishIngredient, DishFlatIngredient, Day,
+    Meal, MealDish
+)
+from services import ProcurementService
+
+
+STORES = ['Makro', 'Mercadona', 'Mercado central']
+
+
+def seed(n_households, n_ingredients, n_dishes, days, rng):
+    """Hogares con catálogo propio (mismos nombres), stock bajo y comidas de `days` días"""
+    conn = db.session.connection()
+    now = datetime.utcnow()
+    start = date.today() + timedelta(days=1)
+    ids = {'ingredients': 0, 'stores': 0, 'dishes': 0, 'days': 0, 'meals': 0}
+    
+    def next_id(table):
+        ids[table] += 1
+        return ids[table]
+    
+    conn.execute(Household.__table__.insert(), [
+        {'id': h, 'name': f'Hogar {h}', 'created_at': now} for h in range(2, n_households + 1)
+    ])
+    ingredients, stock, stores, packs, dishes, recipe = [], [], [], [], [], []
+    days_rows, meals, meal_dishes = [], [], []
+    for household_id in range(1, n_households + 1):
+        ingredient_ids = []
+        for i in range(n_ingredients):
+            ingredient_id = next_id('ingredients')
+            ingredient_ids.append(ingredient_id)
+            ingredients.append({'id': ingredient_id, 'household_id': household_id, 'name': f'Ingrediente {i}',
+                                'unit': 'g', 'created_at': now})
+            stock.append({'household_id': household_id, 'ingredient_id': ingredient_id,
+                          'stock_actual': rng.uniform(0, 500), 'stock_planificado': 0.0, 'last_updated': now})
+        store_ids = []
+        for name in STORES:
+            store_id = next_id('stores')
+            store_ids.append(store_id)
+            stores.append({'id': store_id, 'household_id': household_id, 'name': name,
+                           'delivery_fee': 0.0, 'min_order': 0.0})
+        for ingredient_id in ingredient_ids:
+            packs.append({'household_id': household_id, 'ingredient_id': ingredient_id, 'name': 'Paquete',
+                          'pack_size': 1000.0, 'price': rng.uniform(1, 5), 'store_id': rng.choice(store_ids),
+                          'created_at': now})
+        dish_ids = []
+        for _ in range(n_dishes):
+            dish_id = next_id('dishes')
+            dish_ids.append(dish_id)
+            dishes.append({'id': dish_id, 'household_id': household_id, 'name': f'Plato {dish_id}', 'created_at': now})
+            for ingredient_id in rng.sample(ingredient_ids, 4):
+                recipe.append({'household_id': household_id, 'dish_id': dish_id, 'ingredient_id': ingredient_id,
+                               'quantity': rng.uniform(50, 300)})
+        for d in range(days):
+            day_id = next_id('days')
+            days_rows.append({'id': day_id, 'household_id': household_id,
+                              'date': start + timedelta(days=d), 'created_at': now})
+            for meal_type in ('lunch', 'dinner'):
+                meal_id = next_id('meals')
+                meals.append({'id': meal_id, 'household_id': household_id, 'day_id': day_id,
+                              'meal_type': meal_type, 'special_type': None, 'confirmed': False, 'created_at': now})
+                meal_dishes.append({'household_id': household_id, 'meal_id': meal_id,
+                                    'dish_id': rng.choice(dish_ids), 'portions': rng.randint(1, 4),
+                                    'order': 0, 'created_at': now})
+    # Sin sub-recetas: la receta aplanada es la propia receta
+    for model, rows in ((Ingredient, ingredients), (PantryStock, stock), (Store, stores), (ProductPack, packs),
+                        (Dish, dishes), (DishIngredient, recipe), (DishFlatIngredient, recipe), (Day, days_rows),
+                        (Meal, meals), (MealDish, meal_dishes)):
+        conn.execute(model.__table__.insert(), rows)
+    db.session.commit()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database-url', help='Base de datos desechable (por defecto SQLite temporal)')
+    parser.add_argument('--households', type=int, nargs='+', default=[100, 1000, 3000])
+    parser.add_argument('--ingredients', type=int, default=30)
+    parser.add_argument('--dishes', type=int, default=10)
+    parser.add_argument('--days', type=int, default=7)
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='pbc_procurement_')
+    
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        SQLALCHEMY_ECHO = False
+    
+    app = create_app(BenchConfig)
+    delivery = date.today() + timedelta(days=1)
+    
+    print(f"{'hogares':>8} {'asignac.':>9} {'líneas':>7} {'pedidos':>8} {'generar':>8} {'recibir':>8}")
+    with app.app_context():
+        for n_households in args.households:
+            db.session.expunge_all()
+            db.drop_all()
+            db.create_all()
+            db.session.add(Household(id=1, name='Mi casa'))
+            db.session.commit()
+            seed(n_households, args.ingredients, args.dishes, args.days, random.Random(n_households))
+            
+            generate_time, orders = timed(ProcurementService.generate, delivery)
+            lines = sum(len(order.lines) for order in orders)
+            order_ids = [order.id for order in orders]
+            receive_time, allocations = 0.0, 0
+            for order_id in order_ids:
+                elapsed, result = timed(ProcurementService.receive, order_id)
+                receive_time += elapsed
+                allocations += result['allocations']
+            print(f"{n_households:>8} {allocations:>9} {lines:>7} {len(orders):>8} "
+                  f"{generate_time:>7.2f}s {receive_time:>7.2f}s")
+    
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Benchmark del snapshot columnar frente a un volcado SQL
+
+Crea una base de datos de prueba con un catálogo e historial de comidas
+sintéticos y mide, para cada tamaño, volcado y restauración con:
+- snapshot.py (fichero columnar comprimido, inserts multi-fila)
+- Volcado SQL: mysqldump + mysql si la URL es MySQL/MariaDB y están en el
+  PATH; con SQLite, iterdump() + executescript (un INSERT por fila)
+
+¡Usa una base de datos desechable! Se borra y se vuelve a crear.
+
+Uso:
+    python benchmark_snapshot.py                                  # SQLite temporal
+    python benchmark_snapshot.py --days 365 1825 --dishes 2000
+    python benchmark_snapshot.py --database-url mysql+pymysql://root:@localhost/planbuycook_bench
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy.engine import make_url
+from config import Config
+from app import create_app
+from models import db, Day, Meal, MealDish, SyncChange
+from services import ImportService
+import snapshot
+
+
+def seed(n_dishes, n_ingredients, days, rng):
+    """Catálogo (vía ImportService) y días x 3 comidas con 1-2 platos cada una"""
+    lines = ['dish,ingredient,quantity,unit']
+    for dish in range(n_dishes):
+        for ingredient in rng.sample(range(n_ingredients), 8):
+            lines.append(f'Plato {dish},Ingrediente {ingredient},{rng.randint(1, 500)},g')
+    ImportService.import_rows(ImportService.read_rows(io.StringIO('\n'.join(lines)), 'csv'), 'recipes')
+    
+    conn = db.session.connection()
+    start = date.today() - timedelta(days=days)
+    now = datetime.utcnow()
+    conn.execute(Day.__table__.insert(), [
+        {'id': d + 1, 'date': start + timedelta(days=d), 'created_at': now} for d in range(days)
+    ])
+    meals, meal_dishes = [], []
+    for d in range(days):
+        for offset, meal_type in enumerate(Meal.MEAL_TYPES):
+            meal_id = d * 3 + offset + 1
+            meals.append({'id': meal_id, 'day_id': d + 1, 'meal_type': meal_type, 'special_type': None,
+                          'confirmed': True, 'confirmed_at': now, 'created_at': now})
+            for order in range(rng.randint(1, 2)):
+                meal_dishes.append({'meal_id': meal_id, 'dish_id': rng.randint(1, n_dishes),
+                                    'portions': rng.randint(1, 4), 'order': order, 'created_at': now})
+    conn.execute(Meal.__table__.insert(), meals)
+    conn.execute(MealDish.__table__.insert(), meal_dishes)
+    conn.execute(SyncChange.__table__.insert(), [
+        {'table_name': 'meals', 'row_id': meal['id'], 'operation': 'upsert', 'changed_at': now} for meal in meals
+    ])
+    db.session.commit()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def sql_dump_sqlite(database, path):
+    source = sqlite3.connect(database)
+    with open(path, 'w') as stream:
+        for statement in source.iterdump():
+            stream.write(statement + '\n')
+    source.close()
+
+
+def sql_restore_sqlite(path, database):
+    target = sqlite3.connect(database)
+    with open(path) as stream:
+        target.executescript(stream.read())
+    target.close()
+
+
+def mysql_arguments(url):
+    arguments = [f'--host={url.host or "localhost"}', f'--port={url.port or 3306}', f'--user={url.username}']
+    if url.password:
+        arguments.append(f'--password={url.password}')
+    return arguments
+
+
+def sql_dump_mysql(url, path):
+    with open(path, 'w') as stream:
+        subprocess.run(['mysqldump', '--single-transaction', *mysql_arguments(url), url.database],
+                       stdout=stream, check=True)
+
+
+def sql_restore_mysql(path, url):
+    with open(path) as stream:
+        subprocess.run(['mysql', *mysql_arguments(url), url.database], stdin=stream, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--database-url', help='Base de datos desechable (por defecto SQLite temporal)')
+    parser.add_argument('--days', type=int, nargs='+', default=[365, 1825])
+    parser.add_argument('--dishes', type=int, default=1000)
+    parser.add_argument('--ingredients', type=int, default=500)
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='pbc_snapshot_')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    url = make_url(database_url)
+    is_sqlite = url.get_backend_name() == 'sqlite'
+    has_mysql_tools = shutil.which('mysqldump') and shutil.which('mysql')
+    
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_ECHO = False
+    
+    app = create_app(BenchConfig)
+    snapshot_path = os.path.join(workdir, 'bench.pbcs')
+    sql_path = os.path.join(workdir, 'bench.sql')
+    
+    print(f"{'días':>6} {'filas':>9} {'snap MB':>8} {'volcado':>8} {'restaura':>9} "
+          f"{'sql MB':>8} {'volcado':>8} {'restaura':>9}")
+    with app.app_context():
+        for days in args.days:
+            db.drop_all()
+            db.create_all()
+            seed(args.dishes, args.ingredients, days, random.Random(days))
+            
+            dump_time = timed(snapshot.dump, snapshot_path)
+            with snapshot.Snapshot(snapshot_path) as snap:
+                rows = sum(snap.tables.values())
+            restore_time = timed(snapshot.restore, snapshot_path)
+            snapshot_size = os.path.getsize(snapshot_path) / 1e6
+            
+            sql_dump_time = sql_restore_time = sql_size = None
+            if is_sqlite:
+                db.session.remove()
+                sql_dump_time = timed(sql_dump_sqlite, url.database, sql_path)
+                restored = os.path.join(workdir, f'restored_{days}.db')
+                sql_restore_time = timed(sql_restore_sqlite, sql_path, restored)
+            elif has_mysql_tools:
+                db.session.remove()
+                sql_dump_time = timed(sql_dump_mysql, url, sql_path)
+                db.drop_all()
+                sql_restore_time = timed(sql_restore_mysql, sql_path, url)
+            if sql_dump_time is not None:
+                sql_size = os.path.getsize(sql_path) / 1e6
+            
+            sql_columns = (f"{sql_size:>8.2f} {sql_dump_time:>7.2f}s {sql_restore_time:>8.2f}s"
+                           if sql_dump_time is not None else f"{'(sin mysqldump)':>27}")
+            print(f"{days:>6} {rows:>9} {snapshot_size:>8.2f} {dump_time:>7.2f}s {restore_time:>8.2f}s {sql_columns}")
+    
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,3 +26,6 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = os.getenv('FLASK_ENV') == 'development'
+    
+    # Segundos máximos para repartir una lista de compra en cestas por tienda
+    BASKET_TIME_BUDGET = float(os.getenv('BASKET_TIME_BUDGET', '0.5'))
@@ -0,0 +1,193 @@
+"""
+Exportación de datos en streaming (CSV y NDJSON)
+
+Cada exportación es un select Core que se recorre con un cursor de servidor
+(yield_per): el driver trae las filas por lotes de BATCH_SIZE y nunca se
+materializa el resultado completo. Las filas se serializan en un generador
+que entrega trozos de unos CHUNK_SIZE bytes, de modo que la memoria del
+worker no depende del rango exportado.
+
+Contiene:
+- shopping_list: Items de una lista de compra
+- pantry: Foto del almacén (stock real y planificado)
+- meal_plan: Comidas planificadas en un rango de fechas
+- consumption: Ingredientes consumidos por las comidas confirmadas
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from sqlalchemy import select
+from models import (
+    db, Day, Meal, MealDish, Dish, DishFlatIngredient, Ingredient, PantryStock,
+    Store, ShoppingItem
+)
+
+
+BATCH_SIZE = 1000  # Filas por viaje al servidor
+CHUNK_SIZE = 64 * 1024  # Bytes por trozo de la respuesta
+
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Export:
+    """Definición de una exportación: nombre de fichero, columnas y consulta"""
+    
+    __slots__ = ('filename', 'columns', 'stmt')
+    
+    def __init__(self, filename, columns, stmt):
+        self.filename = filename
+        self.columns = columns
+        self.stmt = stmt
+
+
+def shopping_list(list_id):
+    """Items de una lista de compra, en orden de recorrido (tienda y pasillo)"""
+    stmt = (
+        select(
+            Ingredient.name, Ingredient.unit, ShoppingItem.quantity_needed,
+            ShoppingItem.quantity_available, ShoppingItem.quantity_to_buy,
+            Store.name, ShoppingItem.estimated_cost, ShoppingItem.purchased, ShoppingItem.quantity_purchased
+        )
+        .join(Ingredient, Ingredient.id == ShoppingItem.ingredient_id)
+        .outerjoin(Store, Store.id == ShoppingItem.store_id)
+        .where(ShoppingItem.shopping_list_id == list_id)
+        .order_by(ShoppingItem.store_id, ShoppingItem.sort_key)
+    )
+    columns = ['ingredient', 'unit', 'quantity_needed', 'quantity_available',
+               'quantity_to_buy', 'store', 'estimated_cost', 'purchased', 'quantity_purchased']
+    return Export(f'lista_compra_{list_id}', columns, stmt)
+
+
+def pantry():
+    """Foto del almacén: todos los ingredientes con su stock (vacío si no tienen fila de stock)"""
+    stmt = (
+        select(
+            Ingredient.id, Ingredient.name, Ingredient.unit,
+            PantryStock.stock_actual, PantryStock.stock_planificado, PantryStock.last_updated
+        )
+        .outerjoin(PantryStock, PantryStock.ingredient_id == Ingredient.id)
+        .order_by(Ingredient.name)
+    )
+    columns = ['ingredient_id', 'ingredient', 'unit', 'stock_actual', 'stock_planificado', 'last_updated']
+    return Export(f'almacen_{date.today().isoformat()}', columns, stmt)
+
+
+def _date_range(stmt, start_date, end_date):
+    if start_date:
+        stmt = stmt.where(Day.date >= start_date)
+    if end_date:
+        stmt = stmt.where(Day.date <= end_date)
+    return stmt
+
+
+def _range_name(prefix, start_date, end_date):
+    parts = [prefix] + [d.isoformat() for d in (start_date, end_date) if d]
+    return '_'.join(parts)
+
+
+def meal_plan(start_date=None, end_date=None):
+    """
+    Comidas planificadas en un rango: una fila por plato (o por comida
+    especial / sin asignar)
+    """
+    stmt = (
+        select(
+            Day.date, Meal.meal_type, Meal.special_type, Meal.confirmed, Meal.diners,
+            Dish.name, MealDish.portions, MealDish.batch_id, MealDish.percentage
+        )
+        .join(Meal, Meal.day_id == Day.id)
+        .outerjoin(MealDish, MealDish.meal_id == Meal.id)
+        .outerjoin(Dish, Dish.id == MealDish.dish_id)
+        .order_by(Day.date, Meal.id, MealDish.order, MealDish.id)
+    )
+    stmt = _date_range(stmt, start_date, end_date)
+    columns = ['date', 'meal_type', 'special_type', 'confirmed', 'diners', 'dish',
+               'portions', 'batch_id', 'percentage']
+    return Export(_range_name('plan', start_date, end_date), columns, stmt)
+
+
+def consumption(start_date=None, end_date=None):
+    """
+    Historial de consumo: ingredientes de las comidas confirmadas, con la
+    misma regla que confirm_meal (receta aplanada × MealDish.scale_expression)
+    """
+    stmt = (
+        select(
+            Day.date, Meal.meal_type, Dish.name, Ingredient.name, Ingredient.unit,
+            (DishFlatIngredient.quantity * MealDish.scale_expression()), Meal.confirmed_at
+        )
+        .join(Meal, Meal.day_id == Day.id)
+        .join(MealDish, MealDish.meal_id == Meal.id)
+        .join(Dish, Dish.id == MealDish.dish_id)
+        .join(DishFlatIngredient, DishFlatIngredient.dish_id == MealDish.dish_id)
+        .join(Ingredient, Ingredient.id == DishFlatIngredient.ingredient_id)
+        .where(Meal.confirmed.is_(True), Meal.special_type.is_(None))
+        .order_by(Day.date, Meal.id, MealDish.id, DishFlatIngredient.id)
+    )
+    stmt = _date_range(stmt, start_date, end_date)
+    columns = ['date', 'meal_type', 'dish', 'ingredient', 'unit', 'quantity', 'confirmed_at']
+    return Export(_range_name('consumo', start_date, end_date), columns, stmt)
+
+
+def _rows(stmt):
+    """Recorre el resultado con cursor de servidor, lote a lote"""
+    result = db.session.execute(stmt, execution_options={'yield_per': BATCH_SIZE})
+    try:
+        for partition in result.partitions():
+            yield from partition
+    finally:
+        result.close()
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Tipo no serializable: {type(value).__name__}')
+
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(value.isoformat() if isinstance(value, (date, datetime)) else value
+                        for value in row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(columns, rows):
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines, size = [], 0
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream(export, fmt):
+    """
+    Generador con el contenido de una exportación
+    
+    Args:
+        export: Export a serializar
+        fmt: 'csv' o 'ndjson'
+    
+    Returns:
+        generator: Trozos de texto listos para enviar
+    """
+    if fmt not in MIMETYPES:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    serializer = _csv_chunks if fmt == 'csv' else _ndjson_chunks
+    return serializer(export.columns, _rows(export.stmt))
@@ -0,0 +1,51 @@
+"""
+Importación masiva de recetas y stock inicial desde la línea de comandos
+
+Lee el fichero en streaming y lo importa en una única transacción con
+ImportService (ver formatos en su docstring). Los errores por fila se
+muestran con su número de línea sin abortar el resto.
+
+Uso:
+    python import_data.py recipes recetas.csv
+    python import_data.py stock almacen.ndjson --dry-run
+    python import_data.py recipes recetas.json --format json
+"""
+import argparse
+import time
+from app import create_app
+from services import ImportService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('kind', choices=sorted(ImportService.REQUIRED))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=ImportService.FORMATS,
+                        help='Por defecto se deduce de la extensión')
+    parser.add_argument('--dry-run', action='store_true', help='Valida sin guardar')
+    args = parser.parse_args()
+    
+    fmt = args.format or args.path.rsplit('.', 1)[-1].lower()
+    fmt = {'jsonl': 'ndjson'}.get(fmt, fmt)
+    if fmt not in ImportService.FORMATS:
+        parser.error(f"No se reconoce el formato de '{args.path}': usa --format")
+    
+    app = create_app()
+    with app.app_context(), open(args.path, encoding='utf-8-sig', newline='') as stream:
+        started = time.perf_counter()
+        result = ImportService.import_rows(ImportService.read_rows(stream, fmt), args.kind, dry_run=args.dry_run)
+        elapsed = time.perf_counter() - started
+    
+    for error in result['errors']:
+        print(f"⚠️  Línea {error['line']}: {error['error']}")
+    if result['error_count'] > len(result['errors']):
+        print(f"   ... y {result['error_count'] - len(result['errors'])} errores más")
+    
+    action = 'validadas (sin guardar)' if args.dry_run else 'importadas'
+    print(f"\n✅ {result['imported']} de {result['rows']} filas {action} en {elapsed:.1f}s")
+    print(f"   Ingredientes nuevos: {result['ingredients_created']}, platos nuevos: {result['dishes_created']}, "
+          f"líneas de receta: {result['dish_ingredients_created']}, stock actualizado: {result['stock_updated']}")
+
+
+if __name__ == '__main__':
+    main()
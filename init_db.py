@@ -107,9 +107,11 @@ def load_sample_dishes():
     """Carga platos de ejemplo con sus ingredientes"""
     print("\n   → Creando platos...")
     
-    # Obtener ingredientes por nombre para facilitar la asignación
+    # Ingredientes por nombre (una sola consulta) para facilitar la asignación
+    ingredient_ids = dict(db.session.query(Ingredient.name, Ingredient.id).all())
+    
     def get_ing_id(name):
-        return Ingredient.query.filter_by(name=name).first().id
+        return ingredient_ids[name]
     
     dishes_data = [
         {
@@ -0,0 +1,53 @@
+"""
+Script de migración para añadir caducidad a los batches
+
+Añade:
+- dishes.shelf_life_days (vida útil en días, NULL = no caduca)
+- dish_batches.expires_at (fecha de caducidad, NULL = no caduca)
+- Índice dish_batches(dish_id, expires_at)
+- Tabla batch_waste (la crea db.create_all())
+"""
+from app import create_app
+from models import db, DishBatch
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo caducidad de batches...")
+        
+        with db.engine.begin() as conn:
+            if not column_exists(conn, 'dishes', 'shelf_life_days'):
+                print("   Añadiendo columna dishes.shelf_life_days...")
+                conn.execute(db.text("""
+                    ALTER TABLE dishes 
+                    ADD COLUMN shelf_life_days INT NULL,
+                    ADD CONSTRAINT check_shelf_life_positive 
+                        CHECK (shelf_life_days IS NULL OR shelf_life_days > 0)
+                """))
+            
+            if not column_exists(conn, 'dish_batches', 'expires_at'):
+                print("   Añadiendo columna dish_batches.expires_at...")
+                conn.execute(db.text("""
+                    ALTER TABLE dish_batches ADD COLUMN expires_at DATETIME NULL
+                """))
+            
+            for index in DishBatch.__table__.indexes:
+                index.create(bind=conn, checkfirst=True)
+        
+        print("\n✅ Migración completada")
+        print("Configura la vida útil en cada plato y programa sweep_expired_batches.py")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,34 @@
+"""
+Script de migración para añadir los índices de paginación de catálogos
+
+db.create_all() no crea índices en tablas que ya existen. Este script crea
+los que faltan para que la paginación por keyset, los filtros y las claves
+de orden de /dishes, /ingredients, /pantry y /shopping no recorran la tabla:
+- dishes(name), dishes(created_at)
+- ingredients(created_at)  (ingredients.name ya es UNIQUE)
+- pantry_stock(stock_planificado)
+- dish_batches(dish_id, percentage_remaining)
+- shopping_lists(completed, created_at), shopping_lists(created_at), shopping_lists(name)
+"""
+from app import create_app
+from models import db, Dish, Ingredient, PantryStock, DishBatch, ShoppingList
+
+
+def migrate():
+    app = create_app()
+
+    with app.app_context():
+        print("🔧 Añadiendo índices de catálogo...")
+
+        tables = [Dish, Ingredient, PantryStock, DishBatch, ShoppingList]
+        with db.engine.begin() as conn:
+            for model in tables:
+                for index in model.__table__.indexes:
+                    print(f"   {model.__tablename__}: {index.name}")
+                    index.create(bind=conn, checkfirst=True)
+
+        print("\n✅ Migración completada")
+
+
+if __name__ == '__main__':
+    migrate()
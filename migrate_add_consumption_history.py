@@ -0,0 +1,37 @@
+"""
+Script de migración para el historial de consumo
+
+Crea consumption_daily (consumo real por día e ingrediente) y la rellena
+desde las comidas ya confirmadas de cada hogar. A partir de aquí se
+mantiene al confirmar y desconfirmar comidas.
+"""
+from sqlalchemy import select
+from app import create_app
+from models import db, Household, ConsumptionDaily
+from services import ConsumptionService
+import tenancy
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo historial de consumo...")
+        
+        with db.engine.begin() as conn:
+            ConsumptionDaily.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla consumption_daily")
+        
+        households = db.session.execute(select(Household.id, Household.name)).all()
+        for household_id, name in households:
+            with tenancy.use(household_id):
+                rows = ConsumptionService.rebuild(household_id=household_id)
+                db.session.commit()
+            print(f"   ✓ {name}: {rows} días-ingrediente")
+        
+        print("\n✅ Migración completada")
+        print("El almacén muestra el stock objetivo sugerido de los ingredientes con consumo")
+
+
+if __name__ == '__main__':
+    migrate()
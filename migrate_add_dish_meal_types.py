@@ -0,0 +1,35 @@
+"""
+Script de migración para añadir los tipos de comida de cada plato
+
+Añade dishes.meal_types: lista separada por comas (breakfast,lunch,dinner)
+de las comidas para las que sirve el plato. NULL = cualquier comida.
+Se usa para filtrar la consulta de platos cocinables por tipo de comida.
+"""
+from app import create_app
+from models import db
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo tipos de comida a dishes...")
+        
+        with db.engine.begin() as conn:
+            result = conn.execute(db.text("""
+                SELECT COUNT(*) FROM information_schema.COLUMNS 
+                WHERE TABLE_SCHEMA = DATABASE()
+                AND TABLE_NAME = 'dishes' AND COLUMN_NAME = 'meal_types'
+            """))
+            
+            if result.scalar() == 0:
+                conn.execute(db.text("""
+                    ALTER TABLE dishes ADD COLUMN meal_types VARCHAR(50) NULL
+                """))
+                print("✅ Columna añadida correctamente")
+            else:
+                print("ℹ️  La columna ya existe, no se requiere migración")
+
+
+if __name__ == '__main__':
+    migrate()
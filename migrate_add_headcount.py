@@ -0,0 +1,50 @@
+"""
+Script de migración para escalar las recetas por comensales
+
+Añade:
+- dishes.base_yield (raciones que salen de la receta, 1 por defecto: las
+  cantidades existentes se siguen leyendo como "por porción")
+- meals.diners (comensales, NULL = se usan las porciones tal cual)
+"""
+from app import create_app
+from models import db
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo comensales y rendimiento de recetas...")
+        
+        with db.engine.begin() as conn:
+            if not column_exists(conn, 'dishes', 'base_yield'):
+                print("   Añadiendo columna dishes.base_yield...")
+                conn.execute(db.text("""
+                    ALTER TABLE dishes 
+                    ADD COLUMN base_yield INT NOT NULL DEFAULT 1,
+                    ADD CONSTRAINT check_base_yield_positive CHECK (base_yield > 0)
+                """))
+            
+            if not column_exists(conn, 'meals', 'diners'):
+                print("   Añadiendo columna meals.diners...")
+                conn.execute(db.text("""
+                    ALTER TABLE meals 
+                    ADD COLUMN diners INT NULL,
+                    ADD CONSTRAINT check_diners_positive CHECK (diners IS NULL OR diners > 0)
+                """))
+        
+        print("\n✅ Migración completada")
+        print("Indica en cada plato cuántas raciones salen de la receta")
+
+
+if __name__ == '__main__':
+    migrate()
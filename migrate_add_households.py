@@ -0,0 +1,108 @@
+"""
+Script de migración para varios hogares (multi-hogar)
+
+Crea la tabla households con el hogar por defecto (id 1) y añade
+household_id a todas las tablas de datos, asignando las filas existentes a
+ese hogar. Después cambia las claves únicas e índices de una columna por
+sus equivalentes con household_id delante:
+- ingredients: UNIQUE(name) -> UNIQUE(household_id, name)
+- days: UNIQUE(date) -> UNIQUE(household_id, date)
+- stores: UNIQUE(name) -> UNIQUE(household_id, name)
+- dishes, ingredients, pantry_stock, shopping_lists: índices de catálogo
+- sync_changes: (household_id, id) para leer los cambios de un hogar
+"""
+from app import create_app
+from models import db, Household, TenantMixin
+import tenancy
+
+
+# Índices de una columna sustituidos por los compuestos (tabla, índice)
+OLD_INDEXES = [
+    ('ingredients', 'name'),
+    ('days', 'date'),
+    ('stores', 'name'),
+    ('dishes', 'ix_dishes_name'),
+    ('dishes', 'ix_dishes_created_at'),
+    ('ingredients', 'ix_ingredients_created_at'),
+    ('pantry_stock', 'ix_pantry_stock_stock_planificado'),
+    ('shopping_lists', 'ix_shopping_lists_completed_created'),
+    ('shopping_lists', 'ix_shopping_lists_created'),
+    ('shopping_lists', 'ix_shopping_lists_name'),
+]
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def index_exists(conn, table, index):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND INDEX_NAME = :index
+    """), {'table': table, 'index': index})
+    return result.scalar() > 0
+
+
+def add_household_reference(conn, table):
+    if column_exists(conn, table, 'household_id'):
+        print(f"   ℹ️  {table}.household_id ya existe")
+        return
+    conn.execute(db.text(
+        f"ALTER TABLE {table} ADD COLUMN household_id INT NOT NULL DEFAULT {tenancy.DEFAULT_HOUSEHOLD_ID}"
+    ))
+    conn.execute(db.text(f"ALTER TABLE {table} ALTER COLUMN household_id DROP DEFAULT"))
+    conn.execute(db.text(f"""
+        ALTER TABLE {table} ADD CONSTRAINT fk_{table}_household
+        FOREIGN KEY (household_id) REFERENCES households(id)
+    """))
+    print(f"   ✓ {table}.household_id")
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo hogares...")
+        
+        tenant_tables = [
+            mapper.local_table for mapper in db.Model.registry.mappers
+            if issubclass(mapper.class_, TenantMixin)
+        ]
+        
+        with db.engine.begin() as conn:
+            Household.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla households")
+            
+            for table in tenant_tables:
+                add_household_reference(conn, table.name)
+            
+            for table, index in OLD_INDEXES:
+                if index_exists(conn, table, index):
+                    conn.execute(db.text(f"DROP INDEX `{index}` ON {table}"))
+                    print(f"   ✓ Eliminado {table}.{index}")
+            
+            for table in tenant_tables:
+                for constraint in table.constraints:
+                    if isinstance(constraint, db.UniqueConstraint) and constraint.name \
+                            and not index_exists(conn, table.name, constraint.name):
+                        columns = ', '.join(column.name for column in constraint.columns)
+                        conn.execute(db.text(
+                            f"ALTER TABLE {table.name} ADD CONSTRAINT {constraint.name} UNIQUE ({columns})"
+                        ))
+                        print(f"   ✓ {table.name}: {constraint.name}")
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
+                    print(f"   ✓ {table.name}: {index.name}")
+        
+        print("\n✅ Migración completada")
+        print("   Los datos existentes pertenecen al hogar 'Mi casa'; crea más en /households")
+
+
+if __name__ == '__main__':
+    migrate()
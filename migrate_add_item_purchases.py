@@ -0,0 +1,58 @@
+"""
+Script de migración para la compra por items
+
+Añade:
+- shopping_items.quantity_purchased y purchased_at (lo que se compró y cuándo)
+- shopping_lists.pending_items: contador de items sin comprar, inicializado
+  desde los items existentes
+"""
+from app import create_app
+from models import db
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo compra por items...")
+        
+        with db.engine.begin() as conn:
+            if not column_exists(conn, 'shopping_items', 'quantity_purchased'):
+                print("   Añadiendo columnas quantity_purchased y purchased_at...")
+                conn.execute(db.text("""
+                    ALTER TABLE shopping_items 
+                    ADD COLUMN quantity_purchased FLOAT NULL,
+                    ADD COLUMN purchased_at DATETIME NULL
+                """))
+            
+            if not column_exists(conn, 'shopping_lists', 'pending_items'):
+                print("   Añadiendo contador shopping_lists.pending_items...")
+                conn.execute(db.text("""
+                    ALTER TABLE shopping_lists 
+                    ADD COLUMN pending_items INT NOT NULL DEFAULT 0,
+                    ADD CONSTRAINT check_pending_items_non_negative CHECK (pending_items >= 0)
+                """))
+                result = conn.execute(db.text("""
+                    UPDATE shopping_lists SET pending_items = (
+                        SELECT COUNT(*) FROM shopping_items
+                        WHERE shopping_items.shopping_list_id = shopping_lists.id
+                        AND shopping_items.purchased = FALSE
+                    )
+                """))
+                print(f"   ✓ {result.rowcount} listas con su contador")
+        
+        print("\n✅ Migración completada")
+        print("Marca los productos como comprados uno a uno desde el detalle de la lista")
+
+
+if __name__ == '__main__':
+    migrate()
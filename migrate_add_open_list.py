@@ -0,0 +1,50 @@
+"""
+Script de migración para la lista de compra abierta
+
+Añade a shopping_lists:
+- is_open: la lista se actualiza con cada cambio de stock
+- open_flag: columna generada persistente (1 en la lista abierta, NULL en
+  las demás) con clave única (household_id, open_flag), así cada hogar
+  tiene como mucho una lista abierta
+"""
+from app import create_app
+from models import db
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo lista de compra abierta...")
+        
+        with db.engine.begin() as conn:
+            if not column_exists(conn, 'shopping_lists', 'is_open'):
+                print("   Añadiendo columna shopping_lists.is_open...")
+                conn.execute(db.text("""
+                    ALTER TABLE shopping_lists 
+                    ADD COLUMN is_open BOOLEAN NOT NULL DEFAULT FALSE
+                """))
+            
+            if not column_exists(conn, 'shopping_lists', 'open_flag'):
+                print("   Añadiendo columna generada open_flag...")
+                conn.execute(db.text("""
+                    ALTER TABLE shopping_lists 
+                    ADD COLUMN open_flag INT AS (CASE WHEN is_open THEN 1 END) PERSISTENT,
+                    ADD CONSTRAINT unique_household_open_list UNIQUE (household_id, open_flag)
+                """))
+        
+        print("\n✅ Migración completada")
+        print("Abre una lista desde Listas de Compra → Lista Abierta")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,63 @@
+"""
+Script de migración para stock por lotes con caducidad
+
+Añade:
+- ingredients.shelf_life_days (caducidad por defecto de los lotes)
+- Tabla pantry_lots con sus índices (consumo FEFO por ingrediente y
+  "caduca en los próximos N días" por hogar)
+
+El stock_actual existente pasa a un lote 'opening' sin caducidad por
+ingrediente, así la suma de los lotes coincide con el agregado.
+"""
+from datetime import datetime
+from sqlalchemy import select, literal
+from app import create_app
+from models import db, PantryStock, PantryLot
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo lotes de stock...")
+        
+        with db.engine.begin() as conn:
+            if not column_exists(conn, 'ingredients', 'shelf_life_days'):
+                print("   Añadiendo columna ingredients.shelf_life_days...")
+                conn.execute(db.text("""
+                    ALTER TABLE ingredients 
+                    ADD COLUMN shelf_life_days INT NULL,
+                    ADD CONSTRAINT check_ingredient_shelf_life_positive
+                        CHECK (shelf_life_days IS NULL OR shelf_life_days > 0)
+                """))
+            
+            PantryLot.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla pantry_lots")
+            
+            has_lots = conn.execute(select(PantryLot.id).limit(1)).first() is not None
+            if not has_lots:
+                lots = PantryLot.__table__
+                stock = PantryStock.__table__
+                result = conn.execute(lots.insert().from_select(
+                    ['household_id', 'ingredient_id', 'quantity', 'quantity_remaining', 'source', 'received_at'],
+                    select(stock.c.household_id, stock.c.ingredient_id, stock.c.stock_actual, stock.c.stock_actual,
+                           literal('opening'), literal(datetime.utcnow()))
+                    .where(stock.c.stock_actual > 0)
+                ))
+                print(f"   ✓ {result.rowcount} lotes iniciales desde stock_actual")
+        
+        print("\n✅ Migración completada")
+        print("Indica la caducidad de cada ingrediente para que las compras creen lotes con fecha")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,60 @@
+"""
+Script de migración para básicos con stock objetivo y punto de pedido
+
+Añade a pantry_stock:
+- par_level, reorder_point (NULL = no es básico)
+- reorder_margin: columna generada persistente (stock_planificado -
+  COALESCE(reorder_point, 0)) con índice (household_id, reorder_margin),
+  para que la lista de compra lea faltas del plan y básicos bajo mínimos
+  en un único rango
+"""
+from app import create_app
+from models import db, PantryStock
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo stock objetivo y punto de pedido...")
+        
+        with db.engine.begin() as conn:
+            if not column_exists(conn, 'pantry_stock', 'par_level'):
+                print("   Añadiendo columnas par_level y reorder_point...")
+                conn.execute(db.text("""
+                    ALTER TABLE pantry_stock 
+                    ADD COLUMN par_level FLOAT NULL,
+                    ADD COLUMN reorder_point FLOAT NULL,
+                    ADD CONSTRAINT check_reorder_point_non_negative
+                        CHECK (reorder_point IS NULL OR reorder_point >= 0),
+                    ADD CONSTRAINT check_par_level_above_reorder
+                        CHECK (par_level IS NULL OR reorder_point IS NULL OR par_level >= reorder_point)
+                """))
+            
+            if not column_exists(conn, 'pantry_stock', 'reorder_margin'):
+                print("   Añadiendo columna generada reorder_margin...")
+                conn.execute(db.text("""
+                    ALTER TABLE pantry_stock 
+                    ADD COLUMN reorder_margin FLOAT
+                        AS (stock_planificado - COALESCE(reorder_point, 0)) PERSISTENT
+                """))
+            
+            for index in PantryStock.__table__.indexes:
+                index.create(bind=conn, checkfirst=True)
+            print("   ✓ Índice ix_pantry_stock_household_reorder_margin")
+        
+        print("\n✅ Migración completada")
+        print("Marca los básicos desde el formulario de cada ingrediente (stock objetivo y punto de pedido)")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,28 @@
+"""
+Script de migración para las compras centrales consolidadas
+
+Crea las tablas procurement_orders, procurement_lines y
+procurement_allocations (pedido por proveedor y día, líneas por
+ingrediente y desglose por hogar).
+"""
+from app import create_app
+from models import db, ProcurementOrder, ProcurementLine, ProcurementAllocation
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo compras centrales...")
+        
+        with db.engine.begin() as conn:
+            for model in (ProcurementOrder, ProcurementLine, ProcurementAllocation):
+                model.__table__.create(bind=conn, checkfirst=True)
+                print(f"   ✓ Tabla {model.__tablename__}")
+        
+        print("\n✅ Migración completada")
+        print("   Genera los pedidos consolidados en /procurement")
+
+
+if __name__ == '__main__':
+    migrate()
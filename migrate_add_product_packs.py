@@ -0,0 +1,45 @@
+"""
+Script de migración para los formatos de compra de ingredientes
+
+Crea la tabla product_packs y añade a shopping_items el plan de formatos
+elegido (pack_plan, JSON) y su coste estimado (estimated_cost).
+"""
+from app import create_app
+from models import db, ProductPack
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo formatos de compra...")
+        
+        with db.engine.begin() as conn:
+            ProductPack.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla product_packs")
+            
+            columns = [
+                ('pack_plan', 'TEXT NULL'),
+                ('estimated_cost', 'FLOAT NULL'),
+            ]
+            for column, definition in columns:
+                if column_exists(conn, 'shopping_items', column):
+                    print(f"   ℹ️  shopping_items.{column} ya existe")
+                else:
+                    conn.execute(db.text(f"ALTER TABLE shopping_items ADD COLUMN {column} {definition}"))
+                    print(f"   ✓ shopping_items.{column}")
+        
+        print("\n✅ Migración completada")
+
+
+if __name__ == '__main__':
+    migrate()
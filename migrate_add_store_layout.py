@@ -0,0 +1,58 @@
+"""
+Script de migración para el orden de recorrido de las tiendas
+
+Añade:
+- ingredients.aisle (pasillo o sección de la tienda)
+- store_aisles (orden de pasillos de cada tienda; store_id NULL = por defecto)
+- shopping_items.sort_key con el índice (shopping_list_id, store_id, sort_key)
+
+y calcula la clave de los items de las listas sin completar. Las listas
+completadas se quedan sin clave y se leen en el orden en que se crearon.
+"""
+from sqlalchemy import select
+from app import create_app
+from models import db, Household, StoreAisle, ShoppingItem
+import store_layout
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo orden de pasillos...")
+        
+        with db.engine.begin() as conn:
+            if not column_exists(conn, 'ingredients', 'aisle'):
+                print("   Añadiendo columna ingredients.aisle...")
+                conn.execute(db.text("ALTER TABLE ingredients ADD COLUMN aisle VARCHAR(50) NULL"))
+            
+            StoreAisle.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla store_aisles")
+            
+            if not column_exists(conn, 'shopping_items', 'sort_key'):
+                print("   Añadiendo columna shopping_items.sort_key...")
+                conn.execute(db.text("ALTER TABLE shopping_items ADD COLUMN sort_key VARCHAR(60) NULL"))
+            for index in ShoppingItem.__table__.indexes:
+                if index.name == 'ix_shopping_items_list_store_sort':
+                    index.create(bind=conn, checkfirst=True)
+                    print(f"   ✓ Índice {index.name}")
+            
+            for household_id, name in conn.execute(select(Household.id, Household.name)).all():
+                items = store_layout.refresh(conn, household_id=household_id)
+                print(f"   ✓ {name}: {len(items)} items ordenados")
+        
+        print("\n✅ Migración completada")
+        print("Asigna pasillos a los ingredientes y ordénalos por tienda en /stores")
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,68 @@
+"""
+Script de migración para las tiendas y las cestas de compra
+
+Crea la tabla stores, convierte el texto libre product_packs.store en una
+referencia product_packs.store_id (una tienda por nombre distinto) y añade
+shopping_items.store_id para guardar la cesta de cada item.
+"""
+from app import create_app
+from models import db, Store
+
+
+def column_exists(conn, table, column):
+    result = conn.execute(db.text("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS 
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME = :table AND COLUMN_NAME = :column
+    """), {'table': table, 'column': column})
+    return result.scalar() > 0
+
+
+def add_store_reference(conn, table):
+    if column_exists(conn, table, 'store_id'):
+        print(f"   ℹ️  {table}.store_id ya existe")
+        return
+    conn.execute(db.text(f"ALTER TABLE {table} ADD COLUMN store_id INT NULL"))
+    conn.execute(db.text(f"CREATE INDEX ix_{table}_store_id ON {table} (store_id)"))
+    conn.execute(db.text(f"""
+        ALTER TABLE {table} ADD CONSTRAINT fk_{table}_store
+        FOREIGN KEY (store_id) REFERENCES stores(id) ON DELETE SET NULL
+    """))
+    print(f"   ✓ {table}.store_id")
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo tiendas...")
+        
+        with db.engine.begin() as conn:
+            Store.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla stores")
+            
+            add_store_reference(conn, 'product_packs')
+            add_store_reference(conn, 'shopping_items')
+            
+            if column_exists(conn, 'product_packs', 'store'):
+                names = conn.execute(db.text("""
+                    SELECT DISTINCT TRIM(store) FROM product_packs
+                    WHERE store IS NOT NULL AND TRIM(store) <> ''
+                """)).scalars().all()
+                for name in names:
+                    conn.execute(db.text("INSERT IGNORE INTO stores (name, delivery_fee, min_order) VALUES (:name, 0, 0)"),
+                                 {'name': name})
+                conn.execute(db.text("""
+                    UPDATE product_packs p JOIN stores s ON s.name = TRIM(p.store)
+                    SET p.store_id = s.id
+                    WHERE p.store_id IS NULL
+                """))
+                conn.execute(db.text("ALTER TABLE product_packs DROP COLUMN store"))
+                print(f"   ✓ {len(names)} tiendas creadas desde product_packs.store")
+        
+        print("\n✅ Migración completada")
+        print("   Configura los gastos de envío y pedidos mínimos en /stores")
+
+
+if __name__ == '__main__':
+    migrate()
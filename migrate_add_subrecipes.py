@@ -0,0 +1,39 @@
+"""
+Script de migración para sub-recetas (platos como componentes)
+
+Crea:
+- dish_components (plato -> componente, en raciones del componente)
+- dish_flat_ingredients (receta aplanada de cada plato)
+
+y rellena la receta aplanada de todos los platos de cada hogar. Sin
+componentes coincide con la receta propia, así que las necesidades de
+stock y compra no cambian.
+"""
+from sqlalchemy import select
+from app import create_app
+from models import db, Household, DishComponent, DishFlatIngredient
+import recipes
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Añadiendo sub-recetas...")
+        
+        with db.engine.begin() as conn:
+            DishComponent.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla dish_components")
+            DishFlatIngredient.__table__.create(bind=conn, checkfirst=True)
+            print("   ✓ Tabla dish_flat_ingredients")
+            
+            for household_id, name in conn.execute(select(Household.id, Household.name)):
+                dishes = recipes.refresh(conn, household_id=household_id)
+                print(f"   ✓ {name}: {len(dishes)} recetas aplanadas")
+        
+        print("\n✅ Migración completada")
+        print("Añade componentes desde el formulario de cada plato")
+
+
+if __name__ == '__main__':
+    migrate()
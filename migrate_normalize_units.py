@@ -0,0 +1,56 @@
+"""
+Script de migración para normalizar las unidades de los ingredientes
+
+Pasa cada ingrediente a la unidad base de su dimensión (kg -> g, l -> ml,
+cucharadas -> ml, docenas -> unidades) y reescala en la misma transacción
+sus cantidades en recetas, almacén y listas de compra.
+
+Las unidades que no están en el registro (units.py) se dejan como están y
+se listan para revisarlas a mano, igual que los nombres que parecen el
+mismo ingrediente escrito de dos formas.
+"""
+from app import create_app
+from models import db, Ingredient
+from services import UnitService
+from search_index import normalize
+import units
+
+
+def migrate():
+    app = create_app()
+    
+    with app.app_context():
+        print("🔧 Normalizando unidades de ingredientes...")
+        
+        converted = 0
+        unknown = []
+        for ingredient in Ingredient.query.order_by(Ingredient.id).all():
+            base = units.base_unit(ingredient.unit)
+            if units.canonical(ingredient.unit) is None:
+                unknown.append(ingredient)
+            elif ingredient.unit != base:
+                old_unit = ingredient.unit
+                factor = UnitService.change_unit(ingredient, base, auto_commit=False)
+                print(f"   {ingredient.name}: {old_unit} -> {base} (x{factor:g})")
+                converted += 1
+        
+        db.session.commit()
+        print(f"✅ {converted} ingredientes convertidos a unidad base")
+        
+        if unknown:
+            print("\n⚠️  Unidades desconocidas (revisar a mano):")
+            for ingredient in unknown:
+                print(f"   {ingredient.name}: '{ingredient.unit}'")
+        
+        by_name = {}
+        for ingredient in Ingredient.query.order_by(Ingredient.id).all():
+            by_name.setdefault(normalize(ingredient.name), []).append(ingredient)
+        duplicates = [group for group in by_name.values() if len(group) > 1]
+        if duplicates:
+            print("\n⚠️  Posibles ingredientes duplicados:")
+            for group in duplicates:
+                print("   " + ", ".join(f"{i.name} ({i.unit})" for i in group))
+
+
+if __name__ == '__main__':
+    migrate()
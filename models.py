@@ -2,46 +2,111 @@
 Modelos de base de datos para PlanBuyCook
 
 Define las entidades principales:
+- Household: Hogar (tenant); el resto de tablas llevan household_id
 - Day: Días del calendario
 - Meal: Comidas (desayuno, almuerzo, cena)
 - Dish: Platos disponibles
 - Ingredient: Ingredientes base
 - DishIngredient: Relación entre platos e ingredientes con cantidades
+- DishComponent: Plato usado como componente (sub-receta) de otro plato
+- DishFlatIngredient: Receta aplanada (ingredientes crudos) de cada plato
 - PantryStock: Stock actual del almacén
+- PantryLot: Lote de stock (compra o alta manual) con su caducidad
+- Store: Tienda o proveedor (gastos de envío, pedido mínimo)
+- ProductPack: Formato de compra de un ingrediente (tamaño, precio, tienda)
 - ShoppingList: Lista de compra generada
 - ShoppingItem: Items individuales de la lista de compra
+- DishBatch: Batch de un plato preparado (con caducidad)
+- BatchWaste: Registro de porciones de batch caducadas
+- ProcurementOrder / ProcurementLine / ProcurementAllocation: Compras centrales
+  consolidadas entre hogares y su reparto (sin household_id)
+- SyncChange: Registro de cambios para sincronización incremental
+
+Multi-hogar: los modelos con TenantMixin se rellenan con el hogar activo
+(tenancy.current_household_id) y todas las consultas ORM se filtran por él.
+Las restricciones únicas y los índices de listados empiezan por
+household_id, así el coste de cada consulta depende del tamaño del hogar.
 """
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, case, event, and_, or_
+from sqlalchemy.orm import Session, declared_attr, with_loader_criteria
+from tenancy import current_household_id, is_unscoped
 
 db = SQLAlchemy()
 
 
-class Ingredient(db.Model):
+class Household(db.Model):
+    """
+    Hogar o sitio: unidad de aislamiento de datos (tenant)
+    """
+    __tablename__ = 'households'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Household {self.name}>'
+
+
+class TenantMixin:
+    """Modelo particionado por hogar: household_id toma el hogar activo al insertar"""
+    
+    @declared_attr
+    def household_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('households.id'), nullable=False,
+                         default=current_household_id)
+
+
+class Ingredient(TenantMixin, db.Model):
     """
     Ingrediente base con unidad de medida
     """
     __tablename__ = 'ingredients'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False, unique=True)
+    name = db.Column(db.String(100), nullable=False)
     unit = db.Column(db.String(20), nullable=False)  # g, kg, ml, l, unidades, etc.
+    shelf_life_days = db.Column(db.Integer, nullable=True)  # Caducidad por defecto de un lote (NULL = no caduca)
+    aisle = db.Column(db.String(50), nullable=True)  # Pasillo o sección de la tienda (Lácteos, Fruta...)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relaciones
     pantry_stock = db.relationship('PantryStock', backref='ingredient', uselist=False, cascade='all, delete-orphan')
+    lots = db.relationship('PantryLot', backref='ingredient', cascade='all, delete-orphan')
     dish_ingredients = db.relationship('DishIngredient', backref='ingredient', cascade='all, delete-orphan')
+    flat_dish_ingredients = db.relationship('DishFlatIngredient', backref='ingredient', cascade='all, delete-orphan')
+    consumption = db.relationship('ConsumptionDaily', backref='ingredient', cascade='all, delete-orphan')
+    packs = db.relationship('ProductPack', backref='ingredient', cascade='all, delete-orphan',
+                            order_by='ProductPack.pack_size')
+    
+    __table_args__ = (
+        db.UniqueConstraint('household_id', 'name', name='unique_household_ingredient'),
+        CheckConstraint('shelf_life_days IS NULL OR shelf_life_days > 0', name='check_ingredient_shelf_life_positive'),
+        db.Index('ix_ingredients_household_created', 'household_id', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<Ingredient {self.name} ({self.unit})>'
 
 
-class PantryStock(db.Model):
+class PantryStock(TenantMixin, db.Model):
     """
     Stock de ingredientes con doble contador:
     - stock_actual: Lo que realmente tienes físicamente
     - stock_planificado: actual - lo planificado (puede ser negativo = hay que comprar)
+    
+    stock_actual es el agregado de los lotes (PantryLot) que se mantiene en
+    cada movimiento, para leer el almacén sin sumar lotes.
+    
+    Básicos: con punto de pedido (reorder_point), la lista de compra repone
+    hasta el stock objetivo (par_level) cuando el planificado baja del punto
+    de pedido, aunque no haya comidas planificadas. reorder_margin es una
+    columna generada (planificado - punto de pedido, o solo el planificado)
+    y su índice da en un único rango lo que hay que comprar: faltas del plan
+    y básicos bajo mínimos.
     """
     __tablename__ = 'pantry_stock'
     
@@ -49,8 +114,21 @@ class PantryStock(db.Model):
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'), nullable=False, unique=True)
     stock_actual = db.Column(db.Float, nullable=False, default=0.0)  # Stock real físico
     stock_planificado = db.Column(db.Float, nullable=False, default=0.0)  # Descontando planificación
+    par_level = db.Column(db.Float, nullable=True)  # Stock objetivo al reponer (NULL = no es básico)
+    reorder_point = db.Column(db.Float, nullable=True)  # Reponer al bajar de aquí
+    reorder_margin = db.Column(db.Float, db.Computed(
+        'stock_planificado - COALESCE(reorder_point, 0)', persisted=True))  # < 0 = hay que comprar
     last_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        CheckConstraint('reorder_point IS NULL OR reorder_point >= 0', name='check_reorder_point_non_negative'),
+        CheckConstraint('par_level IS NULL OR reorder_point IS NULL OR par_level >= reorder_point',
+                        name='check_par_level_above_reorder'),
+        db.Index('ix_pantry_stock_household_planificado', 'household_id', 'stock_planificado'),
+        # Lo que hay que comprar (plan y básicos) en un único rango
+        db.Index('ix_pantry_stock_household_reorder_margin', 'household_id', 'reorder_margin'),
+    )
+    
     # Mantenemos quantity para compatibilidad (deprecated)
     @property
     def quantity(self):
@@ -61,7 +139,150 @@ class PantryStock(db.Model):
         return f'<PantryStock {self.ingredient.name}: actual={self.stock_actual}, planificado={self.stock_planificado} {self.ingredient.unit}>'
 
 
-class Dish(db.Model):
+class PantryLot(TenantMixin, db.Model):
+    """
+    Lote de stock de un ingrediente: lo que entró de una vez (una compra, un
+    alta manual, una entrega central) y su caducidad
+    
+    Los consumos (confirmar comidas, restar stock) vacían los lotes en orden
+    FEFO: primero el que caduca antes, los que no caducan al final. Los
+    lotes vacíos se conservan con quantity_remaining = 0.
+    """
+    __tablename__ = 'pantry_lots'
+    
+    SOURCES = ['opening', 'manual', 'shopping', 'import', 'procurement', 'return']
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)  # Cantidad que entró
+    quantity_remaining = db.Column(db.Float, nullable=False)  # Lo que queda
+    expires_at = db.Column(db.Date, nullable=True)  # NULL = no caduca
+    source = db.Column(db.String(20), nullable=False, default='manual')
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        CheckConstraint('quantity_remaining >= 0', name='check_lot_remaining_non_negative'),
+        # Consumo FEFO de un ingrediente
+        db.Index('ix_pantry_lots_ingredient_expires', 'ingredient_id', 'expires_at'),
+        # "Caduca en los próximos N días"
+        db.Index('ix_pantry_lots_household_expires', 'household_id', 'expires_at'),
+    )
+    
+    @classmethod
+    def fefo_order(cls):
+        """Orden de consumo: caducidad más próxima primero, sin caducidad al final"""
+        return (cls.expires_at.is_(None), cls.expires_at, cls.received_at, cls.id)
+    
+    def __repr__(self):
+        return f'<PantryLot {self.ingredient_id}: {self.quantity_remaining}/{self.quantity} caduca {self.expires_at}>'
+
+
+class ConsumptionDaily(TenantMixin, db.Model):
+    """
+    Consumo real de un ingrediente en un día (resumen de las comidas confirmadas)
+    
+    Se recalcula el día de una comida al confirmarla o desconfirmarla, y se
+    puede reconstruir en bloque desde las comidas confirmadas. La previsión
+    de consumo (ForecastService) lee solo esta tabla, nunca el historial de
+    comidas.
+    """
+    __tablename__ = 'consumption_daily'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)  # Fecha del día de la comida
+    quantity = db.Column(db.Float, nullable=False)  # En la unidad base del ingrediente
+    
+    __table_args__ = (
+        db.UniqueConstraint('ingredient_id', 'date', name='unique_consumption_ingredient_date'),
+        # Ventana de previsión de un hogar
+        db.Index('ix_consumption_daily_household_date', 'household_id', 'date'),
+    )
+    
+    def __repr__(self):
+        return f'<ConsumptionDaily {self.ingredient_id} {self.date}: {self.quantity}>'
+
+
+class Store(TenantMixin, db.Model):
+    """
+    Tienda o proveedor donde se compra
+    
+    delivery_fee se paga una vez por cesta; min_order es el importe mínimo
+    de la cesta para poder hacer el pedido (0 = sin mínimo).
+    """
+    __tablename__ = 'stores'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    delivery_fee = db.Column(db.Float, nullable=False, default=0.0)
+    min_order = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relaciones
+    packs = db.relationship('ProductPack', backref='store')
+    aisles = db.relationship('StoreAisle', backref='store', cascade='all, delete-orphan',
+                             order_by='StoreAisle.position')
+    
+    __table_args__ = (
+        db.UniqueConstraint('household_id', 'name', name='unique_household_store'),
+        CheckConstraint('delivery_fee >= 0', name='check_delivery_fee_non_negative'),
+        CheckConstraint('min_order >= 0', name='check_min_order_non_negative'),
+    )
+    
+    def __repr__(self):
+        return f'<Store {self.name}>'
+
+
+class StoreAisle(TenantMixin, db.Model):
+    """
+    Posición de un pasillo en el recorrido de una tienda
+    
+    store_id NULL es el orden por defecto del hogar (items sin tienda y
+    pasillos que la tienda no tiene en su orden). Ver store_layout.py.
+    """
+    __tablename__ = 'store_aisles'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id', ondelete='CASCADE'), nullable=True)
+    aisle = db.Column(db.String(50), nullable=False)
+    position = db.Column(db.Integer, nullable=False)  # 0 = primero del recorrido
+    
+    __table_args__ = (
+        db.UniqueConstraint('household_id', 'store_id', 'aisle', name='unique_store_aisle'),
+        CheckConstraint('position >= 0', name='check_aisle_position_non_negative'),
+    )
+    
+    def __repr__(self):
+        return f'<StoreAisle {self.store_id} {self.position}: {self.aisle}>'
+
+
+class ProductPack(TenantMixin, db.Model):
+    """
+    Formato en el que se vende un ingrediente: "Harina 1 kg" a 0,89 €
+    
+    pack_size está en la unidad base del ingrediente (g, ml, unidades),
+    igual que el resto de cantidades.
+    """
+    __tablename__ = 'product_packs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    pack_size = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id', ondelete='SET NULL'), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        CheckConstraint('pack_size > 0', name='check_pack_size_positive'),
+        CheckConstraint('price >= 0', name='check_pack_price_non_negative'),
+    )
+    
+    def __repr__(self):
+        return f'<ProductPack {self.name}: {self.pack_size} {self.ingredient.unit} {self.price}>'
+
+
+class Dish(TenantMixin, db.Model):
     """
     Plato con nombre, descripción e ingredientes asociados
     """
@@ -70,26 +291,58 @@ class Dish(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
+    shelf_life_days = db.Column(db.Integer, nullable=True)  # Días que aguanta un batch (NULL = no caduca)
+    meal_types = db.Column(db.String(50), nullable=True)  # 'breakfast,lunch' (NULL = cualquier comida)
+    base_yield = db.Column(db.Integer, nullable=False, default=1)  # Raciones que salen de la receta
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relaciones
     ingredients = db.relationship('DishIngredient', backref='dish', cascade='all, delete-orphan')
+    components = db.relationship('DishComponent', foreign_keys='DishComponent.dish_id', backref='dish',
+                                 cascade='all, delete-orphan')
+    used_in = db.relationship('DishComponent', foreign_keys='DishComponent.component_id',
+                              back_populates='component')
+    flat_ingredients = db.relationship('DishFlatIngredient', backref='dish', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        CheckConstraint('shelf_life_days IS NULL OR shelf_life_days > 0', name='check_shelf_life_positive'),
+        CheckConstraint('base_yield > 0', name='check_base_yield_positive'),
+        db.Index('ix_dishes_household_name', 'household_id', 'name'),
+        db.Index('ix_dishes_household_created', 'household_id', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<Dish {self.name}>'
     
+    @property
+    def meal_type_list(self):
+        """Tipos de comida para los que sirve el plato (vacío = todos)"""
+        return [t for t in (self.meal_types or '').split(',') if t]
+    
+    @classmethod
+    def meal_type_filter(cls, meal_type):
+        """Condición SQL: el plato sirve para meal_type (o no tiene restricción)"""
+        return or_(cls.meal_types.is_(None), cls.meal_types == '',
+                   cls.meal_types.like(f'%{meal_type}%'))
+    
+    def batch_expiry(self, preparation_date):
+        """Fecha de caducidad de un batch preparado en preparation_date (None si no caduca)"""
+        if not self.shelf_life_days:
+            return None
+        return preparation_date + timedelta(days=self.shelf_life_days)
+    
     def get_total_ingredients(self):
-        """Retorna diccionario con ingredientes y cantidades necesarias"""
+        """Retorna diccionario con ingredientes crudos (componentes incluidos) y cantidades"""
         return {
-            di.ingredient_id: {
-                'ingredient': di.ingredient,
-                'quantity': di.quantity
+            fi.ingredient_id: {
+                'ingredient': fi.ingredient,
+                'quantity': fi.quantity
             }
-            for di in self.ingredients
+            for fi in self.flat_ingredients
         }
 
 
-class DishIngredient(db.Model):
+class DishIngredient(TenantMixin, db.Model):
     """
     Relación entre plato e ingrediente con cantidad específica
     """
@@ -109,19 +362,73 @@ class DishIngredient(db.Model):
         return f'<DishIngredient {self.dish.name}: {self.quantity} {self.ingredient.unit} of {self.ingredient.name}>'
 
 
-class Day(db.Model):
+class DishComponent(TenantMixin, db.Model):
+    """
+    Plato usado como componente de otro (salsa, masa, caldo...)
+    
+    quantity son raciones del componente: el plato incluye
+    quantity / component.base_yield veces la receta del componente.
+    Los componentes forman un grafo acíclico (ver recipes.py).
+    """
+    __tablename__ = 'dish_components'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('dishes.id'), nullable=False)
+    component_id = db.Column(db.Integer, db.ForeignKey('dishes.id'), nullable=False, index=True)
+    quantity = db.Column(db.Float, nullable=False, default=1.0)
+    
+    component = db.relationship('Dish', foreign_keys=[component_id], back_populates='used_in')
+    
+    __table_args__ = (
+        db.UniqueConstraint('dish_id', 'component_id', name='unique_dish_component'),
+        CheckConstraint('quantity > 0', name='check_component_quantity_positive'),
+        CheckConstraint('dish_id <> component_id', name='check_component_not_self'),
+    )
+    
+    def __repr__(self):
+        return f'<DishComponent {self.dish.name}: {self.quantity} x {self.component.name}>'
+
+
+class DishFlatIngredient(TenantMixin, db.Model):
+    """
+    Receta aplanada: ingredientes crudos de un plato, componentes incluidos
+    
+    Es una tabla derivada (memo) de DishIngredient + DishComponent que
+    mantiene recipes.py; nunca se edita a mano. Las necesidades de stock y
+    compra la leen con un único join, sin recorrer sub-recetas.
+    """
+    __tablename__ = 'dish_flat_ingredients'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('dishes.id'), nullable=False)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'), nullable=False, index=True)
+    quantity = db.Column(db.Float, nullable=False)  # Cantidad en la unidad del ingrediente
+    
+    __table_args__ = (
+        db.UniqueConstraint('dish_id', 'ingredient_id', name='unique_dish_flat_ingredient'),
+    )
+    
+    def __repr__(self):
+        return f'<DishFlatIngredient dish={self.dish_id} ingredient={self.ingredient_id}: {self.quantity}>'
+
+
+class Day(TenantMixin, db.Model):
     """
     Día del calendario con sus comidas
     """
     __tablename__ = 'days'
     
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False, unique=True)
+    date = db.Column(db.Date, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relaciones
     meals = db.relationship('Meal', backref='day', cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.UniqueConstraint('household_id', 'date', name='unique_household_day'),
+    )
+    
     def __repr__(self):
         return f'<Day {self.date}>'
     
@@ -130,7 +437,7 @@ class Day(db.Model):
         return next((m for m in self.meals if m.meal_type == meal_type), None)
 
 
-class DishBatch(db.Model):
+class DishBatch(TenantMixin, db.Model):
     """
     Batch de un plato preparado que se usará en múltiples días
     
@@ -146,6 +453,7 @@ class DishBatch(db.Model):
     preparation_date = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     percentage_remaining = db.Column(db.Float, nullable=False, default=100.0)
     ingredients_deducted = db.Column(db.Boolean, default=False, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=True)  # NULL = no caduca
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relaciones
@@ -155,12 +463,28 @@ class DishBatch(db.Model):
     __table_args__ = (
         CheckConstraint('percentage_remaining >= 0 AND percentage_remaining <= 100', 
                        name='check_percentage_valid'),
+        db.Index('ix_dish_batches_dish_remaining', 'dish_id', 'percentage_remaining'),
+        db.Index('ix_dish_batches_dish_expires', 'dish_id', 'expires_at'),
     )
     
+    @classmethod
+    def available_filter(cls, now=None):
+        """Condición SQL de batch disponible: queda algo y no ha caducado"""
+        now = now or datetime.utcnow()
+        return and_(
+            cls.percentage_remaining > 0,
+            or_(cls.expires_at.is_(None), cls.expires_at > now)
+        )
+    
+    @property
+    def is_expired(self):
+        """True si el batch ha pasado su fecha de caducidad"""
+        return self.expires_at is not None and self.expires_at <= datetime.utcnow()
+    
     @property
     def is_available(self):
-        """True si todavía queda algo del batch"""
-        return self.percentage_remaining > 0
+        """True si todavía queda algo del batch y no ha caducado"""
+        return self.percentage_remaining > 0 and not self.is_expired
     
     @property
     def display_info(self):
@@ -172,7 +496,30 @@ class DishBatch(db.Model):
         return f'<DishBatch {self.dish.name} {self.percentage_remaining}% restante>'
 
 
-class Meal(db.Model):
+class BatchWaste(TenantMixin, db.Model):
+    """
+    Desperdicio de un batch: porcentaje que quedaba cuando caducó
+    """
+    __tablename__ = 'batch_waste'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('dish_batches.id', ondelete='SET NULL'), nullable=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('dishes.id', ondelete='CASCADE'), nullable=False)
+    percentage_wasted = db.Column(db.Float, nullable=False)
+    expired_at = db.Column(db.DateTime, nullable=False)
+    recorded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    dish = db.relationship('Dish')
+    
+    __table_args__ = (
+        db.Index('ix_batch_waste_dish_recorded', 'dish_id', 'recorded_at'),
+    )
+    
+    def __repr__(self):
+        return f'<BatchWaste batch={self.batch_id} {self.percentage_wasted}%>'
+
+
+class Meal(TenantMixin, db.Model):
     """
     Comida específica: desayuno, almuerzo o cena
     
@@ -194,6 +541,7 @@ class Meal(db.Model):
     special_type = db.Column(db.String(20), nullable=True)  # order, eat_out
     confirmed = db.Column(db.Boolean, default=False, nullable=False)  # ¿Se ejecutó realmente?
     confirmed_at = db.Column(db.DateTime, nullable=True)  # Fecha de confirmación
+    diners = db.Column(db.Integer, nullable=True)  # Comensales (NULL = se usan las porciones tal cual)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relaciones
@@ -202,6 +550,7 @@ class Meal(db.Model):
     
     __table_args__ = (
         db.UniqueConstraint('day_id', 'meal_type', name='unique_day_meal'),
+        CheckConstraint('diners IS NULL OR diners > 0', name='check_diners_positive'),
     )
     
     def __repr__(self):
@@ -231,7 +580,7 @@ class Meal(db.Model):
         return 'Sin asignar'
 
 
-class MealDish(db.Model):
+class MealDish(TenantMixin, db.Model):
     """
     Relación N:M entre Meal y Dish
     
@@ -240,6 +589,10 @@ class MealDish(db.Model):
     2. Uso de batch: portions=1, batch_id=X, percentage=50 -> Usar 50% de un batch existente
     
     Regla: Si batch_id es NULL, usa portions. Si batch_id existe, usa percentage.
+    
+    Comensales: si la comida tiene diners, la receta (pensada para
+    dish.base_yield raciones) se escala por diners / base_yield, además de
+    por portions (raciones por comensal). Ver scale / scale_expression.
     """
     __tablename__ = 'meal_dishes'
     
@@ -271,6 +624,26 @@ class MealDish(db.Model):
         """True si usa batch con porcentaje"""
         return self.batch_id is not None
     
+    @property
+    def scale(self):
+        """Multiplicador de la receta: portions × diners / base_yield (o portions sin comensales)"""
+        if self.meal.diners and not self.is_batch_mode:
+            return self.portions * self.meal.diners / self.dish.base_yield
+        return float(self.portions)
+    
+    @staticmethod
+    def scale_expression():
+        """
+        Multiplicador de la receta en SQL, igual que scale
+        
+        La consulta debe incluir Meal y Dish (join por meal_id y dish_id).
+        """
+        return MealDish.portions * case(
+            (and_(Meal.diners.is_not(None), MealDish.batch_id.is_(None)),
+             Meal.diners * 1.0 / Dish.base_yield),
+            else_=1.0
+        )
+    
     @property
     def display_name(self):
         """Nombre para mostrar en UI"""
@@ -287,9 +660,17 @@ class MealDish(db.Model):
         return f'<MealDish {self.dish.name} x{self.portions}>'
 
 
-class ShoppingList(db.Model):
+class ShoppingList(TenantMixin, db.Model):
     """
     Lista de compra generada para un período
+    
+    Una lista abierta (is_open) no se genera de una vez: se mantiene al día
+    con cada cambio de stock (ver open_list.py). Como mucho una por hogar:
+    open_flag vale 1 solo en la abierta y tiene clave única con el hogar.
+    
+    pending_items es un contador mantenido de items sin comprar (se ajusta
+    al crear, borrar y comprar items); una lista normal se completa cuando
+    llega a 0, sin recorrer sus items.
     """
     __tablename__ = 'shopping_lists'
     
@@ -299,9 +680,21 @@ class ShoppingList(db.Model):
     end_date = db.Column(db.Date, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed = db.Column(db.Boolean, default=False)
+    is_open = db.Column(db.Boolean, default=False, nullable=False)  # Se actualiza con cada cambio de stock
+    open_flag = db.Column(db.Integer, db.Computed('CASE WHEN is_open THEN 1 END', persisted=True))
+    pending_items = db.Column(db.Integer, default=0, nullable=False)  # Items sin comprar
     
-    # Relaciones
-    items = db.relationship('ShoppingItem', backref='shopping_list', cascade='all, delete-orphan')
+    # Relaciones (items en orden de recorrido: tienda y sort_key, por índice)
+    items = db.relationship('ShoppingItem', backref='shopping_list', cascade='all, delete-orphan',
+                            order_by=lambda: (ShoppingItem.store_id, ShoppingItem.sort_key, ShoppingItem.id))
+    
+    __table_args__ = (
+        db.UniqueConstraint('household_id', 'open_flag', name='unique_household_open_list'),
+        CheckConstraint('pending_items >= 0', name='check_pending_items_non_negative'),
+        db.Index('ix_shopping_lists_household_completed_created', 'household_id', 'completed', 'created_at'),
+        db.Index('ix_shopping_lists_household_created', 'household_id', 'created_at'),
+        db.Index('ix_shopping_lists_household_name', 'household_id', 'name'),
+    )
     
     def __repr__(self):
         return f'<ShoppingList {self.name}>'
@@ -310,11 +703,46 @@ class ShoppingList(db.Model):
     def total_items(self):
         """Total de items en la lista"""
         return len(self.items)
+    
+    @property
+    def baskets(self):
+        """
+        Items agrupados por tienda, con subtotal y gastos de envío
+        
+        Returns:
+            list: [{'store', 'items', 'subtotal', 'delivery_fee'}], la cesta sin tienda al final
+        """
+        groups = {}
+        for item in self.items:
+            groups.setdefault(item.store_id, []).append(item)
+        baskets = []
+        for store_id, items in sorted(groups.items(), key=lambda g: (g[0] is None, g[0] or 0)):
+            store = items[0].store
+            baskets.append({
+                'store': store,
+                'items': items,  # Ya vienen en orden de recorrido
+                'subtotal': sum(i.estimated_cost or 0.0 for i in items),
+                'delivery_fee': store.delivery_fee if store else 0.0,
+            })
+        return baskets
+    
+    @property
+    def estimated_cost(self):
+        """Coste estimado (formatos + envíos) o None si ningún item tiene formatos"""
+        costs = [item.estimated_cost for item in self.items if item.estimated_cost is not None]
+        if not costs:
+            return None
+        fees = {item.store_id: item.store.delivery_fee for item in self.items if item.store}
+        return sum(costs) + sum(fees.values())
 
 
-class ShoppingItem(db.Model):
+class ShoppingItem(TenantMixin, db.Model):
     """
     Item individual en una lista de compra
+    
+    sort_key es la posición del pasillo del ingrediente en el recorrido de
+    la tienda del item seguida del nombre, precalculada (store_layout.py)
+    para ordenar la lista con el índice en lugar de en la plantilla.
     """
     __tablename__ = 'shopping_items'
     
@@ -325,14 +753,202 @@ class ShoppingItem(db.Model):
     quantity_available = db.Column(db.Float, nullable=False, default=0.0)
     quantity_to_buy = db.Column(db.Float, nullable=False)
     purchased = db.Column(db.Boolean, default=False)
+    quantity_purchased = db.Column(db.Float, nullable=True)  # Lo que se compró de verdad
+    purchased_at = db.Column(db.DateTime, nullable=True)
+    pack_plan = db.Column(db.Text, nullable=True)  # JSON: [{'pack_id', 'name', 'pack_size', 'count', 'price'}]
+    estimated_cost = db.Column(db.Float, nullable=True)  # Coste del plan de formatos
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id', ondelete='SET NULL'), nullable=True)  # Cesta
+    sort_key = db.Column(db.String(60), nullable=True)  # Orden de recorrido en la tienda
     
     # Relación
     ingredient = db.relationship('Ingredient')
+    store = db.relationship('Store')
     
     __table_args__ = (
         CheckConstraint('quantity_needed > 0', name='check_quantity_needed_positive'),
         CheckConstraint('quantity_to_buy >= 0', name='check_quantity_to_buy_positive'),
+        # Lista en orden de recorrido, cesta a cesta
+        db.Index('ix_shopping_items_list_store_sort', 'shopping_list_id', 'store_id', 'sort_key'),
     )
     
+    @property
+    def packs(self):
+        """Formatos elegidos para cubrir quantity_needed (vacío si no hay catálogo)"""
+        return json.loads(self.pack_plan) if self.pack_plan else []
+    
     def __repr__(self):
         return f'<ShoppingItem {self.ingredient.name}: {self.quantity_to_buy} {self.ingredient.unit}>'
+
+
+class ProcurementOrder(db.Model):
+    """
+    Pedido consolidado de compras centrales: uno por proveedor y día de entrega
+    
+    No pertenece a ningún hogar: suma los faltantes de todos ellos hasta
+    window_end y, al recibirlo, reparte lo entregado en el almacén de cada uno.
+    supplier es el nombre de la tienda (NULL = sin proveedor asignado).
+    
+    status: 'open' (pedido) o 'received' (repartido)
+    """
+    __tablename__ = 'procurement_orders'
+    
+    STATUSES = ('open', 'received')
+    
+    id = db.Column(db.Integer, primary_key=True)
+    delivery_date = db.Column(db.Date, nullable=False)
+    window_end = db.Column(db.Date, nullable=False)  # Consumo cubierto hasta esta fecha (incluida)
+    supplier = db.Column(db.String(100), nullable=True)
+    status = db.Column(db.String(10), nullable=False, default='open')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    received_at = db.Column(db.DateTime, nullable=True)
+    
+    lines = db.relationship('ProcurementLine', backref='order', cascade='all, delete-orphan',
+                            order_by='ProcurementLine.ingredient_name')
+    
+    __table_args__ = (
+        db.Index('ix_procurement_orders_delivery_supplier', 'delivery_date', 'supplier'),
+        db.Index('ix_procurement_orders_status', 'status'),
+    )
+    
+    @property
+    def total_needed(self):
+        return sum(line.quantity_needed for line in self.lines)
+    
+    def __repr__(self):
+        return f'<ProcurementOrder {self.delivery_date} {self.supplier or "-"} ({self.status})>'
+
+
+class ProcurementLine(db.Model):
+    """
+    Línea de un pedido consolidado: un ingrediente (por nombre y unidad base)
+    con la suma de los faltantes de los hogares
+    """
+    __tablename__ = 'procurement_lines'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('procurement_orders.id'), nullable=False, index=True)
+    ingredient_name = db.Column(db.String(100), nullable=False)
+    unit = db.Column(db.String(20), nullable=False)
+    quantity_needed = db.Column(db.Float, nullable=False)
+    quantity_delivered = db.Column(db.Float, nullable=True)  # NULL hasta la recepción
+    households = db.Column(db.Integer, nullable=False, default=0)  # Hogares con faltante
+    
+    allocations = db.relationship('ProcurementAllocation', backref='line', cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        CheckConstraint('quantity_needed > 0', name='check_procurement_needed_positive'),
+        CheckConstraint('quantity_delivered >= 0', name='check_procurement_delivered_non_negative'),
+    )
+    
+    def __repr__(self):
+        return f'<ProcurementLine {self.ingredient_name}: {self.quantity_needed} {self.unit}>'
+
+
+class ProcurementAllocation(db.Model):
+    """
+    Desglose de una línea por hogar: su faltante y lo que recibe de la entrega
+    """
+    __tablename__ = 'procurement_allocations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    line_id = db.Column(db.Integer, db.ForeignKey('procurement_lines.id'), nullable=False, index=True)
+    household_id = db.Column(db.Integer, db.ForeignKey('households.id'), nullable=False)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'), nullable=False, index=True)
+    quantity_needed = db.Column(db.Float, nullable=False)
+    quantity_allocated = db.Column(db.Float, nullable=True)  # NULL hasta la recepción
+    
+    household = db.relationship('Household')
+    
+    __table_args__ = (
+        db.Index('ix_procurement_allocations_household', 'household_id', 'line_id'),
+    )
+    
+    def __repr__(self):
+        return f'<ProcurementAllocation hogar {self.household_id}: {self.quantity_needed}>'
+
+
+
+class SyncChange(TenantMixin, db.Model):
+    """
+    Registro de cambios para sincronización incremental (delta-sync)
+    
+    Cada fila modificada o eliminada en las tablas sincronizables deja una
+    entrada. El id autoincremental es la versión monotónica que usan los
+    clientes offline como cursor: solo piden lo cambiado desde su versión.
+    
+    operation: 'upsert' (creada o modificada) o 'delete' (tombstone)
+    """
+    __tablename__ = 'sync_changes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_sync_changes_table_row', 'table_name', 'row_id'),
+        db.Index('ix_sync_changes_household_version', 'household_id', 'id'),
+    )
+    
+    # Tablas que se sincronizan con los clientes offline
+    TRACKED_TABLES = (
+        'days', 'meals', 'meal_dishes', 'dish_batches',
+        'pantry_stock', 'shopping_lists', 'shopping_items',
+    )
+    
+    def __repr__(self):
+        return f'<SyncChange v{self.id} {self.operation} {self.table_name}#{self.row_id}>'
+
+
+def record_sync_changes(connection, table_name, row_ids, operation='upsert', household_id=None):
+    """
+    Registra cambios hechos fuera del ORM (UPDATE/DELETE masivos)
+    
+    Los flush del ORM se registran solos; quien use sentencias Core sobre
+    tablas sincronizables debe llamar a esta función en la misma transacción.
+    household_id: hogar de las filas si no es el activo (procesos entre hogares)
+    """
+    household_id = household_id or current_household_id()
+    rows = [
+        {'table_name': table_name, 'row_id': row_id, 'operation': operation,
+         'changed_at': datetime.utcnow(), 'household_id': household_id}
+        for row_id in row_ids
+    ]
+    if rows:
+        connection.execute(SyncChange.__table__.insert(), rows)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_sync_changes(session, flush_context):
+    """Añade al changelog las filas sincronizables tocadas en cada flush"""
+    changes = {}
+    for obj in session.new:
+        changes[(obj.__tablename__, obj.id)] = ('upsert', obj)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            changes[(obj.__tablename__, obj.id)] = ('upsert', obj)
+    for obj in session.deleted:
+        changes[(obj.__tablename__, obj.id)] = ('delete', obj)
+    
+    now = datetime.utcnow()
+    rows = [
+        {'table_name': table_name, 'row_id': row_id, 'operation': operation,
+         'changed_at': now, 'household_id': obj.household_id}
+        for (table_name, row_id), (operation, obj) in changes.items()
+        if table_name in SyncChange.TRACKED_TABLES
+    ]
+    if rows:
+        session.connection().execute(SyncChange.__table__.insert(), rows)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _filter_by_household(execute_state):
+    """Restringe SELECT/UPDATE/DELETE ORM al hogar activo"""
+    if is_unscoped() or execute_state.is_column_load or execute_state.is_relationship_load:
+        return
+    if execute_state.is_select or execute_state.is_update or execute_state.is_delete:
+        household_id = current_household_id()
+        execute_state.statement = execute_state.statement.options(with_loader_criteria(
+            TenantMixin, lambda cls: cls.household_id == household_id, include_aliases=True
+        ))
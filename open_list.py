@@ -0,0 +1,77 @@
+"""
+Lista de compra abierta: se mantiene al día con cada cambio de stock
+
+Un hogar puede tener una lista abierta (ShoppingList.is_open). En lugar de
+generar listas nuevas, cada cambio de stock planificado (planificar o
+quitar platos, confirmar, comprar, básicos) lleva su diferencia a esa
+lista en la misma transacción: se crea, actualiza o borra el ShoppingItem
+pendiente de cada ingrediente tocado, y solo de esos.
+
+Mantenimiento:
+- Tras cada flush se anotan los ingredientes con cambios en PantryStock
+  (stock, stock objetivo o punto de pedido), por hogar.
+- Antes del commit (o cuando se llama a push()) se aplican a la lista
+  abierta de cada hogar (ShoppingListService.sync_open_list). Los items que
+  esto escribe no tocan el stock, así que el bucle termina en una vuelta.
+- Las escrituras Core sobre pantry_stock (importación, compras centrales)
+  llaman a mark() a mano.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import tenancy
+from models import db, PantryStock
+
+
+PENDING_KEY = 'open_list_pending'
+
+# Cambios de PantryStock que mueven la cantidad a comprar
+WATCHED = ('stock_actual', 'stock_planificado', 'par_level', 'reorder_point')
+
+
+def mark(session, household_id, ingredient_ids):
+    """Anota ingredientes cuyo stock ha cambiado fuera del ORM"""
+    pending = session.info.setdefault(PENDING_KEY, {})
+    pending.setdefault(household_id, set()).update(ingredient_ids)
+
+
+def _changed(obj):
+    state = db.inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in WATCHED)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_stock_changes(session, flush_context):
+    """Anota los ingredientes con cambios de stock en este flush"""
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, PantryStock) and (obj in session.new or _changed(obj)):
+            mark(session, obj.household_id, [obj.ingredient_id])
+
+
+def push(session):
+    """
+    Lleva los cambios de stock anotados a la lista abierta de cada hogar
+    
+    Se llama sola antes del commit; quien necesite leer la lista abierta al
+    día dentro de la transacción (contadores devueltos al cliente) la llama
+    antes.
+    """
+    # services importa este módulo
+    from services import ShoppingListService
+    while True:
+        session.flush()
+        pending = session.info.pop(PENDING_KEY, None)
+        if not pending:
+            return
+        for household_id, ingredient_ids in pending.items():
+            with tenancy.use(household_id):
+                ShoppingListService.sync_open_list(ingredient_ids)
+
+
+@event.listens_for(Session, 'before_commit')
+def _push_open_list_deltas(session):
+    push(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stock_changes(session):
+    session.info.pop(PENDING_KEY, None)
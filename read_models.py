@@ -0,0 +1,347 @@
+"""
+Modelos de lectura (read models) para las páginas de listado
+
+Las vistas de solo lectura no necesitan instancias ORM completas ni el
+identity map: cada fila se construye con un select Core y se guarda en
+objetos ligeros con __slots__. Así se evitan las cargas perezosas por fila
+(N+1) y se reduce la memoria por petición en catálogos grandes.
+
+Contiene:
+- PantryRow: Ingrediente + stock (un único outer join)
+- DishRow / DishIngredientRow / DishComponentRow: Plato con sus ingredientes y
+  componentes (una consulta por lote)
+- ShoppingListRow: Lista de compra con su número de items (agregado COUNT)
+- IngredientRow: Ingrediente del catálogo
+
+Los listados se paginan por keyset (cursor = último valor de orden + id):
+el coste de cada página depende de su tamaño, no del tamaño del catálogo.
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import select, func, and_, or_, exists
+from models import db, Ingredient, PantryStock, Dish, DishIngredient, DishComponent, DishBatch, ShoppingList, ShoppingItem
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class Page:
+    """Página de resultados con el cursor para pedir la siguiente"""
+    
+    __slots__ = ('rows', 'next_cursor')
+    
+    def __init__(self, rows, next_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+    
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+
+class PantryRow:
+    """Fila del almacén: ingrediente con su doble contador de stock"""
+    
+    __slots__ = ('ingredient_id', 'name', 'unit', 'stock_actual', 'stock_planificado', 'last_updated')
+    
+    def __init__(self, ingredient_id, name, unit, stock_actual, stock_planificado, last_updated):
+        self.ingredient_id = ingredient_id
+        self.name = name
+        self.unit = unit
+        self.stock_actual = stock_actual or 0.0
+        self.stock_planificado = stock_planificado or 0.0
+        self.last_updated = last_updated
+    
+    @property
+    def falta_comprar(self):
+        """Cantidad que falta comprar (stock planificado negativo)"""
+        return abs(self.stock_planificado) if self.stock_planificado < 0 else 0.0
+
+
+class DishIngredientRow:
+    """Ingrediente de un plato con su cantidad"""
+    
+    __slots__ = ('ingredient_id', 'name', 'unit', 'quantity')
+    
+    def __init__(self, ingredient_id, name, unit, quantity):
+        self.ingredient_id = ingredient_id
+        self.name = name
+        self.unit = unit
+        self.quantity = quantity
+
+
+class DishComponentRow:
+    """Sub-receta de un plato con sus raciones"""
+    
+    __slots__ = ('component_id', 'name', 'quantity')
+    
+    def __init__(self, component_id, name, quantity):
+        self.component_id = component_id
+        self.name = name
+        self.quantity = quantity
+
+
+class DishRow:
+    """Plato con la lista de sus ingredientes y componentes ya resuelta"""
+    
+    __slots__ = ('id', 'name', 'description', 'created_at', 'ingredients', 'components')
+    
+    def __init__(self, id, name, description, created_at):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.created_at = created_at
+        self.ingredients = []
+        self.components = []
+
+
+class IngredientRow:
+    """Ingrediente del catálogo"""
+    
+    __slots__ = ('id', 'name', 'unit', 'created_at')
+    
+    def __init__(self, id, name, unit, created_at):
+        self.id = id
+        self.name = name
+        self.unit = unit
+        self.created_at = created_at
+
+
+class ShoppingListRow:
+    """Lista de compra con el total de items precalculado"""
+    
+    __slots__ = ('id', 'name', 'start_date', 'end_date', 'created_at', 'completed', 'is_open', 'total_items')
+    
+    def __init__(self, id, name, start_date, end_date, created_at, completed, is_open, total_items):
+        self.id = id
+        self.name = name
+        self.start_date = start_date
+        self.end_date = end_date
+        self.created_at = created_at
+        self.completed = completed
+        self.is_open = is_open
+        self.total_items = total_items
+
+
+def _encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor, kind):
+    """Decodifica un cursor; devuelve None si es inválido (vuelve a la primera página)"""
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if kind == 'datetime':
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _page_size(per_page):
+    if not per_page or per_page < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(per_page, MAX_PAGE_SIZE)
+
+
+def _keyset_page(stmt, sort, id_col, cursor, per_page, build):
+    """
+    Aplica paginación por keyset a un select y construye la página
+    
+    Args:
+        stmt: Select base (con filtros, sin ORDER BY ni LIMIT)
+        sort: Tupla (columna, descendente, tipo) de la clave de orden
+        id_col: Columna id usada para desempatar
+        cursor: Cursor de la página anterior o None
+        per_page: Tamaño de página solicitado
+        build: Función fila -> objeto de lectura
+    """
+    sort_col, descending, kind = sort
+    per_page = _page_size(per_page)
+    
+    position = _decode_cursor(cursor, kind) if cursor else None
+    if position:
+        value, last_id = position
+        if descending:
+            stmt = stmt.where(or_(sort_col < value, and_(sort_col == value, id_col < last_id)))
+        else:
+            stmt = stmt.where(or_(sort_col > value, and_(sort_col == value, id_col > last_id)))
+    
+    if descending:
+        stmt = stmt.order_by(sort_col.desc(), id_col.desc())
+    else:
+        stmt = stmt.order_by(sort_col, id_col)
+    
+    # Se pide una fila extra para saber si hay página siguiente
+    raw = db.session.execute(stmt.limit(per_page + 1)).all()
+    next_cursor = None
+    if len(raw) > per_page:
+        raw = raw[:per_page]
+        last = raw[-1]._mapping
+        next_cursor = _encode_cursor(last['sort_key'], last['row_id'])
+    return Page([build(row) for row in raw], next_cursor)
+
+
+# Claves de orden admitidas por cada listado: nombre -> (columna, descendente, tipo)
+DISH_SORTS = {
+    'name': (Dish.name, False, 'str'),
+    'recent': (Dish.created_at, True, 'datetime'),
+}
+INGREDIENT_SORTS = {
+    'name': (Ingredient.name, False, 'str'),
+    'recent': (Ingredient.created_at, True, 'datetime'),
+}
+PANTRY_SORTS = {
+    'name': (Ingredient.name, False, 'str'),
+    'planificado': (PantryStock.stock_planificado, False, 'float'),
+}
+SHOPPING_SORTS = {
+    'recent': (ShoppingList.created_at, True, 'datetime'),
+    'name': (ShoppingList.name, False, 'str'),
+}
+
+
+def pantry_rows(q=None, below_zero=False, sort='name', cursor=None, per_page=None):
+    """
+    Página de filas del almacén, incluidos ingredientes sin stock registrado
+    
+    Args:
+        q: Prefijo del nombre del ingrediente
+        below_zero: Solo ingredientes con stock planificado negativo
+        sort: 'name' o 'planificado' (más negativo primero)
+        cursor: Cursor devuelto por la página anterior
+        per_page: Tamaño de página
+    
+    Returns:
+        Page: Filas PantryRow y cursor siguiente
+    """
+    sort_key = PANTRY_SORTS.get(sort, PANTRY_SORTS['name'])
+    stmt = select(
+        Ingredient.id, Ingredient.name, Ingredient.unit,
+        PantryStock.stock_actual, PantryStock.stock_planificado, PantryStock.last_updated,
+        sort_key[0].label('sort_key'), Ingredient.id.label('row_id')
+    )
+    # Ordenar o filtrar por stock exige fila de stock: join interno
+    if below_zero or sort_key[0] is PantryStock.stock_planificado:
+        stmt = stmt.join(PantryStock, PantryStock.ingredient_id == Ingredient.id)
+    else:
+        stmt = stmt.outerjoin(PantryStock, PantryStock.ingredient_id == Ingredient.id)
+    if q:
+        stmt = stmt.where(Ingredient.name.startswith(q, autoescape=True))
+    if below_zero:
+        stmt = stmt.where(PantryStock.stock_planificado < 0)
+    return _keyset_page(stmt, sort_key, Ingredient.id, cursor, per_page,
+                        lambda row: PantryRow(*row[:6]))
+
+
+def ingredient_rows(q=None, sort='name', cursor=None, per_page=None):
+    """
+    Página del catálogo de ingredientes
+    
+    Returns:
+        Page: Filas IngredientRow y cursor siguiente
+    """
+    sort_key = INGREDIENT_SORTS.get(sort, INGREDIENT_SORTS['name'])
+    stmt = select(
+        Ingredient.id, Ingredient.name, Ingredient.unit, Ingredient.created_at,
+        sort_key[0].label('sort_key'), Ingredient.id.label('row_id')
+    )
+    if q:
+        stmt = stmt.where(Ingredient.name.startswith(q, autoescape=True))
+    return _keyset_page(stmt, sort_key, Ingredient.id, cursor, per_page,
+                        lambda row: IngredientRow(*row[:4]))
+
+
+def dish_rows(q=None, has_batch=False, sort='name', cursor=None, per_page=None):
+    """
+    Página de platos con sus ingredientes (dos consultas por página)
+    
+    Args:
+        q: Prefijo del nombre del plato
+        has_batch: Solo platos con algún batch disponible (sin caducar)
+        sort: 'name' o 'recent'
+    
+    Returns:
+        Page: Filas DishRow y cursor siguiente
+    """
+    sort_key = DISH_SORTS.get(sort, DISH_SORTS['name'])
+    stmt = select(
+        Dish.id, Dish.name, Dish.description, Dish.created_at,
+        sort_key[0].label('sort_key'), Dish.id.label('row_id')
+    )
+    if q:
+        stmt = stmt.where(Dish.name.startswith(q, autoescape=True))
+    if has_batch:
+        stmt = stmt.where(exists().where(
+            DishBatch.dish_id == Dish.id,
+            DishBatch.available_filter()
+        ))
+    page = _keyset_page(stmt, sort_key, Dish.id, cursor, per_page,
+                        lambda row: DishRow(*row[:4]))
+    _attach_dish_ingredients(page.rows)
+    return page
+
+
+def _attach_dish_ingredients(dishes):
+    """Carga los ingredientes y componentes de un lote de platos (una consulta para cada uno)"""
+    by_id = {dish.id: dish for dish in dishes}
+    if not by_id:
+        return
+    
+    stmt = (
+        select(
+            DishIngredient.dish_id, Ingredient.id, Ingredient.name,
+            Ingredient.unit, DishIngredient.quantity
+        )
+        .join(Ingredient, Ingredient.id == DishIngredient.ingredient_id)
+        .where(DishIngredient.dish_id.in_(by_id.keys()))
+        .order_by(DishIngredient.id)
+    )
+    for dish_id, ingredient_id, name, unit, quantity in db.session.execute(stmt):
+        by_id[dish_id].ingredients.append(DishIngredientRow(ingredient_id, name, unit, quantity))
+    
+    stmt = (
+        select(DishComponent.dish_id, Dish.id, Dish.name, DishComponent.quantity)
+        .join(Dish, Dish.id == DishComponent.component_id)
+        .where(DishComponent.dish_id.in_(by_id.keys()))
+        .order_by(DishComponent.id)
+    )
+    for dish_id, component_id, name, quantity in db.session.execute(stmt):
+        by_id[dish_id].components.append(DishComponentRow(component_id, name, quantity))
+
+
+def shopping_list_rows(completed=None, sort='recent', cursor=None, per_page=None):
+    """
+    Página de listas de compra con su número de items
+    
+    El COUNT se hace con una subconsulta correlacionada sobre el índice de
+    shopping_list_id, así que solo se cuentan los items de la página.
+    
+    Args:
+        completed: True/False para filtrar por estado, None para todas
+        sort: 'recent' o 'name'
+    
+    Returns:
+        Page: Filas ShoppingListRow y cursor siguiente
+    """
+    sort_key = SHOPPING_SORTS.get(sort, SHOPPING_SORTS['recent'])
+    item_count = (
+        select(func.count(ShoppingItem.id))
+        .where(ShoppingItem.shopping_list_id == ShoppingList.id)
+        .correlate(ShoppingList)
+        .scalar_subquery()
+    )
+    stmt = select(
+        ShoppingList.id, ShoppingList.name, ShoppingList.start_date,
+        ShoppingList.end_date, ShoppingList.created_at, ShoppingList.completed, ShoppingList.is_open,
+        item_count, sort_key[0].label('sort_key'), ShoppingList.id.label('row_id')
+    )
+    if completed is not None:
+        stmt = stmt.where(ShoppingList.completed == completed)
+    return _keyset_page(stmt, sort_key, ShoppingList.id, cursor, per_page,
+                        lambda row: ShoppingListRow(*row[:8]))
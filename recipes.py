@@ -0,0 +1,182 @@
+"""
+Sub-recetas: platos que usan otros platos como componentes
+
+Un plato tiene ingredientes crudos (DishIngredient) y componentes
+(DishComponent: salsas, masas, caldos que son platos a su vez). Los
+componentes forman un grafo acíclico; su receta aplanada (vector de
+ingredientes crudos) se guarda en dish_flat_ingredients para que stock,
+listas de compra, proyección y compras centrales la lean con un único join.
+
+Mantenimiento del memo:
+- Tras cada flush se recalculan los platos con cambios en DishIngredient,
+  DishComponent o base_yield, y todos sus ancestros (los platos que los usan
+  directa o indirectamente). Los demás no se tocan.
+- El recorrido comparte resultados (cada componente se aplana una sola vez)
+  y detecta ciclos: un ciclo hace fallar el flush con ValueError.
+- Las escrituras Core (importación masiva) llaman a refresh() a mano.
+"""
+from collections import defaultdict
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session
+from tenancy import current_household_id
+from models import db, Dish, DishIngredient, DishComponent, DishFlatIngredient
+
+
+class CycleError(ValueError):
+    """Los componentes de un plato acaban usándolo a él mismo"""
+    
+    def __init__(self, path):
+        super().__init__('Ciclo de componentes: ' + ' → '.join(str(dish_id) for dish_id in path))
+        self.path = path
+
+
+def _load_graph(connection, household_id):
+    """Aristas plato -> [(componente, raciones)] del hogar y su inverso"""
+    edges, parents = defaultdict(list), defaultdict(set)
+    for dish_id, component_id, quantity in connection.execute(
+        select(DishComponent.dish_id, DishComponent.component_id, DishComponent.quantity)
+        .where(DishComponent.household_id == household_id)
+    ):
+        edges[dish_id].append((component_id, quantity))
+        parents[component_id].add(dish_id)
+    return edges, parents
+
+
+def _reachable(start, neighbours):
+    """Nodos alcanzables desde start (incluidos) siguiendo neighbours"""
+    seen, pending = set(start), list(start)
+    while pending:
+        for node in neighbours(pending.pop()):
+            if node not in seen:
+                seen.add(node)
+                pending.append(node)
+    return seen
+
+
+def ancestors(connection, dish_ids, household_id=None):
+    """Platos que usan estos como componente, directa o indirectamente (incluidos ellos)"""
+    _, parents = _load_graph(connection, household_id or current_household_id())
+    return _reachable(dish_ids, lambda dish_id: parents.get(dish_id, ()))
+
+
+def flatten(dish_ids, own, edges, yields, memo=None):
+    """
+    Vectores de ingredientes crudos de unos platos
+    
+    Args:
+        dish_ids: Platos a aplanar
+        own: dict dish_id -> {ingredient_id: cantidad} (ingredientes propios)
+        edges: dict dish_id -> [(component_id, raciones)]
+        yields: dict dish_id -> base_yield de cada componente
+        memo: dict compartido entre llamadas (dish_id -> vector)
+    
+    Returns:
+        dict: dish_id -> {ingredient_id: cantidad}
+    
+    Raises:
+        CycleError: Si los componentes forman un ciclo (path: ids del ciclo)
+    """
+    memo = {} if memo is None else memo
+    visiting = []
+    
+    def visit(dish_id):
+        if dish_id in memo:
+            return memo[dish_id]
+        if dish_id in visiting:
+            raise CycleError(visiting[visiting.index(dish_id):] + [dish_id])
+        visiting.append(dish_id)
+        vector = dict(own.get(dish_id, {}))
+        for component_id, quantity in edges.get(dish_id, ()):
+            factor = quantity / (yields.get(component_id) or 1)
+            for ingredient_id, amount in visit(component_id).items():
+                vector[ingredient_id] = vector.get(ingredient_id, 0.0) + amount * factor
+        visiting.pop()
+        memo[dish_id] = vector
+        return vector
+    
+    return {dish_id: visit(dish_id) for dish_id in dish_ids}
+
+
+def refresh(connection, dish_ids=None, household_id=None):
+    """
+    Recalcula la receta aplanada de unos platos y de todos sus ancestros
+    
+    Args:
+        connection: Conexión de la transacción en curso
+        dish_ids: Platos cambiados (None = todos los del hogar)
+        household_id: Hogar de los platos (por defecto el activo)
+    
+    Returns:
+        set: Ids de los platos recalculados
+    
+    Raises:
+        ValueError: Si los componentes forman un ciclo (con los nombres de los platos)
+    """
+    household_id = household_id or current_household_id()
+    edges, parents = _load_graph(connection, household_id)
+    if dish_ids is None:
+        affected = set(connection.execute(
+            select(Dish.id).where(Dish.household_id == household_id)).scalars())
+    else:
+        affected = _reachable(dish_ids, lambda dish_id: parents.get(dish_id, ()))
+    if not affected:
+        return affected
+    
+    needed = _reachable(affected, lambda dish_id: (c for c, _ in edges.get(dish_id, ())))
+    own = defaultdict(dict)
+    for dish_id, ingredient_id, quantity in connection.execute(
+        select(DishIngredient.dish_id, DishIngredient.ingredient_id, DishIngredient.quantity)
+        .where(DishIngredient.dish_id.in_(needed))
+    ):
+        own[dish_id][ingredient_id] = quantity
+    yields = dict(connection.execute(
+        select(Dish.id, Dish.base_yield).where(Dish.id.in_(needed))).all())
+    
+    try:
+        vectors = flatten(affected, own, edges, yields)
+    except CycleError as e:
+        names = dict(connection.execute(select(Dish.id, Dish.name).where(Dish.id.in_(set(e.path)))).all())
+        raise ValueError('Ciclo de componentes: ' + ' → '.join(names[dish_id] for dish_id in e.path)) from None
+    
+    table = DishFlatIngredient.__table__
+    connection.execute(delete(table).where(table.c.dish_id.in_(affected)))
+    rows = [
+        {'dish_id': dish_id, 'ingredient_id': ingredient_id, 'quantity': quantity,
+         'household_id': household_id}
+        for dish_id, vector in vectors.items()
+        for ingredient_id, quantity in vector.items()
+        if quantity > 0
+    ]
+    if rows:
+        connection.execute(table.insert(), rows)
+    return affected
+
+
+def _changed_dishes(session):
+    """Platos (por hogar) cuya receta aplanada invalida este flush"""
+    changed = defaultdict(set)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (DishIngredient, DishComponent)):
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            changed[obj.household_id].add(obj.dish_id)
+        elif isinstance(obj, Dish) and obj in session.dirty \
+                and db.inspect(obj).attrs.base_yield.history.has_changes():
+            changed[obj.household_id].add(obj.id)
+    deleted_dishes = {obj.id for obj in session.deleted if isinstance(obj, Dish)}
+    return {
+        household_id: dish_ids - deleted_dishes
+        for household_id, dish_ids in changed.items()
+        if dish_ids - deleted_dishes
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_flat_recipes(session, flush_context):
+    """Mantiene dish_flat_ingredients al día con los cambios del flush"""
+    changed = _changed_dishes(session)
+    if not changed:
+        return
+    connection = session.connection()
+    for household_id, dish_ids in changed.items():
+        refresh(connection, dish_ids, household_id)
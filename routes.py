@@ -7,13 +7,30 @@ Define los endpoints para:
 - Gestión de ingredientes
 - Almacén
 - Lista de compra
+- Importación masiva y exportación en streaming (CSV / JSON)
+- Sincronización con clientes offline
 """
-from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from models import db, Day, Meal, MealDish, Dish, Ingredient, DishIngredient, PantryStock, ShoppingList, ShoppingItem
+import io
+from datetime import date, datetime, timedelta
+from itertools import zip_longest
+from flask import (
+    Blueprint, Response, abort, current_app, render_template, request, redirect, url_for, flash,
+    jsonify, session, stream_with_context
+)
+from models import (
+    db, Household, Day, Meal, MealDish, Dish, Ingredient, DishIngredient, DishComponent, PantryStock, Store,
+    ProductPack, ShoppingList, ShoppingItem, ProcurementOrder, ProcurementLine, ProcurementAllocation
+)
+import exports
+import read_models
+import recipes
+import search_index
+import units
 from services import (
-    PantryService, MealService, ShoppingListService, 
-    CalendarService, StockError
+    PantryService, RequirementService, LotService, MealService, ShoppingListService, 
+    CalendarService, SyncService, BatchAllocationService, FeasibilityService,
+    PlannerService, ProjectionService, ForecastService, UnitService, ImportService, ProcurementService,
+    StoreLayoutService, StockError
 )
 
 
@@ -66,8 +83,12 @@ def assign_meal():
             if dish_mode == 'portions':
                 # Modo 1: Porciones múltiples
                 portions = request.form.get('portions', type=int, default=1)
-                MealService.add_dish_to_meal(day_id, meal_type, dish_id, portions, batch_id=None)
-                flash(f'✓ Plato añadido correctamente (x{portions})', 'success')
+                diners = request.form.get('diners', type=int)
+                MealService.add_dish_to_meal(day_id, meal_type, dish_id, portions, batch_id=None, diners=diners)
+                if diners:
+                    flash(f'✓ Plato añadido correctamente ({diners} comensales)', 'success')
+                else:
+                    flash(f'✓ Plato añadido correctamente (x{portions})', 'success')
                 
             elif dish_mode == 'batch_new':
                 # Modo 2: Crear nuevo batch
@@ -77,9 +98,13 @@ def assign_meal():
                     flash('Porcentaje inválido', 'error')
                     return redirect(url_for('main.calendar'))
                 
-                # Crear batch
+                # Crear batch (caduca según la vida útil del plato)
+                dish = Dish.query.get_or_404(dish_id)
+                preparation_date = datetime.utcnow()
                 batch = DishBatch(
                     dish_id=dish_id,
+                    preparation_date=preparation_date,
+                    expires_at=dish.batch_expiry(preparation_date),
                     percentage_remaining=100.0,
                     ingredients_deducted=False
                 )
@@ -105,13 +130,26 @@ def assign_meal():
                 batch_id = request.form.get('batch_id', type=int)
                 percentage_to_use = request.form.get('batch_percentage_existing', type=float)
                 
-                if not batch_id or not percentage_to_use:
+                if not percentage_to_use:
                     flash('Selección de batch inválida', 'error')
                     return redirect(url_for('main.calendar'))
                 
+                if not batch_id:
+                    # Sin batch concreto: usar primero los más antiguos (FIFO)
+                    allocations = BatchAllocationService.assign_to_meal(
+                        day_id, meal_type, dish_id, percentage_to_use
+                    )
+                    flash(f'✓ Usando {percentage_to_use:.0f}% de {len(allocations)} batch(es), '
+                          f'empezando por el más antiguo', 'success')
+                    return redirect(url_for('main.calendar'))
+                
                 # Validar batch
                 batch = DishBatch.query.get_or_404(batch_id)
                 
+                if batch.is_expired:
+                    flash('Este batch ha caducado y ya no se puede usar', 'error')
+                    return redirect(url_for('main.calendar'))
+                
                 if percentage_to_use > batch.percentage_remaining:
                     flash(f'Solo queda {batch.percentage_remaining:.0f}% del batch', 'error')
                     return redirect(url_for('main.calendar'))
@@ -174,6 +212,45 @@ def remove_meal():
     return redirect(url_for('main.calendar'))
 
 
+@main_bp.route('/calendar/autoplan', methods=['POST'])
+def autoplan_week():
+    """Rellena automáticamente los huecos vacíos de la semana mostrada"""
+    week_offset = request.form.get('week', 0, type=int)
+    today = datetime.now().date()
+    start_of_week = today - timedelta(days=today.weekday()) + timedelta(weeks=week_offset)
+    
+    try:
+        result = PlannerService.plan(start_of_week, start_of_week + timedelta(days=6), apply=True)
+        if result['meals']:
+            flash(f'✓ {len(result["meals"])} comidas planificadas. '
+                  f'Ingredientes a comprar: {len(result["purchases"])}', 'success')
+        else:
+            flash('No hay huecos vacíos o platos con ingredientes para planificar', 'info')
+    except ValueError as e:
+        flash(str(e), 'error')
+    except Exception as e:
+        flash(f'Error al planificar: {str(e)}', 'error')
+    
+    return redirect(url_for('main.calendar', week=week_offset))
+
+
+@main_bp.route('/meal/diners', methods=['POST'])
+def set_meal_diners():
+    """Cambia los comensales de una comida (vacío = sin escalar)"""
+    try:
+        meal_id = request.form.get('meal_id', type=int)
+        diners = request.form.get('diners', type=int)
+        
+        MealService.set_diners(meal_id, diners)
+        flash(f'Comensales actualizados ({diners})' if diners else 'Comida sin comensales: se usan las porciones', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
+    except Exception as e:
+        flash(f'Error al cambiar comensales: {str(e)}', 'error')
+    
+    return redirect(url_for('main.calendar'))
+
+
 @main_bp.route('/meal/confirm', methods=['POST'])
 def confirm_meal():
     """Confirma que una comida se ejecutó realmente (botón ✓)"""
@@ -233,13 +310,14 @@ def replicate_meal():
         if not target_meal:
             target_meal = Meal(
                 day_id=target_day.id,
-                meal_type=target_meal_type
+                meal_type=target_meal_type,
+                diners=source_meal.diners
             )
             db.session.add(target_meal)
             db.session.flush()
         
         # Copiar todos los MealDish
-        copied_count = 0
+        copied = []
         for meal_dish in source_meal.meal_dishes:
             new_meal_dish = MealDish(
                 meal_id=target_meal.id,
@@ -247,9 +325,14 @@ def replicate_meal():
                 portions=meal_dish.portions
             )
             db.session.add(new_meal_dish)
-            copied_count += 1
+            copied.append(new_meal_dish)
+        copied_count = len(copied)
         
-        # El stock planificado ya se actualiza automáticamente al crear los MealDish
+        # Descontar del stock planificado lo que necesitan las copias (escalado por comensales)
+        db.session.flush()
+        PantryService.apply_requirements(
+            RequirementService.for_meal_dishes(meal_dish_ids=[meal_dish.id for meal_dish in copied]), 'subtract'
+        )
         
         db.session.commit()
         
@@ -277,56 +360,12 @@ def edit_meal_dish():
             flash('Faltan datos para editar el plato', 'error')
             return redirect(url_for('main.calendar'))
         
-        if portions < 1:
-            flash('Las porciones deben ser al menos 1', 'error')
-            return redirect(url_for('main.calendar'))
-        
-        # Obtener MealDish
-        meal_dish = MealDish.query.get_or_404(meal_dish_id)
-        
-        # Verificar que la comida no esté confirmada
-        if meal_dish.meal.confirmed:
-            flash('No se puede editar un plato de una comida ya confirmada', 'error')
-            return redirect(url_for('main.calendar'))
-        
-        # Guardar meal_id antes de cambios
-        meal_id = meal_dish.meal_id
-        
-        # Primero devolver el stock del plato anterior
-        old_dish = meal_dish.dish
-        old_portions = meal_dish.portions
-        
-        if not meal_dish.is_batch_mode:
-            # Devolver ingredientes del plato anterior
-            for di in old_dish.ingredients:
-                quantity = di.quantity * old_portions
-                PantryService.update_stock_planificado(
-                    di.ingredient_id,
-                    quantity,
-                    operation='add',
-                    auto_commit=False
-                )
-        
-        # Actualizar datos
-        meal_dish.dish_id = dish_id
-        meal_dish.portions = portions
-        meal_dish.batch_id = None  # Resetear batch al editar
-        meal_dish.percentage = None
-        
-        # Descontar ingredientes del nuevo plato
-        new_dish = Dish.query.get(dish_id)
-        for di in new_dish.ingredients:
-            quantity = di.quantity * portions
-            PantryService.update_stock_planificado(
-                di.ingredient_id,
-                quantity,
-                operation='subtract',
-                auto_commit=False
-            )
-        
-        db.session.commit()
+        # Devuelve lo que descontaba el plato anterior y descuenta el nuevo
+        MealService.update_meal_dish(meal_dish_id, dish_id, portions)
         
         flash('✓ Plato actualizado correctamente', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
     except Exception as e:
         db.session.rollback()
         flash(f'Error al editar plato: {str(e)}', 'error')
@@ -338,9 +377,56 @@ def edit_meal_dish():
 
 @main_bp.route('/dishes')
 def dishes():
-    """Lista todos los platos"""
-    all_dishes = Dish.query.order_by(Dish.name).all()
-    return render_template('dishes.html', dishes=all_dishes)
+    """Lista los platos paginados, con búsqueda por prefijo y orden"""
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'sort': request.args.get('sort', 'name'),
+        'has_batch': request.args.get('has_batch', type=int, default=0),
+    }
+    page = read_models.dish_rows(
+        q=filters['q'], has_batch=bool(filters['has_batch']), sort=filters['sort'],
+        cursor=request.args.get('cursor'), per_page=request.args.get('per_page', type=int)
+    )
+    return render_template('dishes.html', dishes=page.rows, page=page, filters=filters)
+
+
+def _add_form_ingredients(dish_id):
+    """Añade los ingredientes del formulario pasando cada cantidad a la unidad base"""
+    rows = [
+        (int(ing_id), float(qty), unit)
+        for ing_id, qty, unit in zip_longest(
+            request.form.getlist('ingredient_ids[]'),
+            request.form.getlist('quantities[]'),
+            request.form.getlist('units[]'),
+            fillvalue=''
+        )
+        if ing_id and qty
+    ]
+    base_units = dict(db.session.query(Ingredient.id, Ingredient.unit).filter(
+        Ingredient.id.in_([row[0] for row in rows])
+    ).all()) if rows else {}
+    
+    for ingredient_id, quantity, unit in rows:
+        base_unit = base_units[ingredient_id]
+        db.session.add(DishIngredient(
+            dish_id=dish_id,
+            ingredient_id=ingredient_id,
+            quantity=units.convert(quantity, unit or base_unit, base_unit)
+        ))
+
+
+def _add_form_components(dish_id):
+    """Añade los componentes (sub-recetas) del formulario: plato y raciones"""
+    for component_id, quantity in zip_longest(
+        request.form.getlist('component_ids[]'),
+        request.form.getlist('component_quantities[]'),
+        fillvalue=''
+    ):
+        if not component_id or not quantity:
+            continue
+        if int(component_id) == dish_id:
+            raise ValueError('Un plato no puede ser componente de sí mismo')
+        db.session.add(DishComponent(dish_id=dish_id, component_id=int(component_id), quantity=float(quantity)))
 
 
 @main_bp.route('/dish/new', methods=['GET', 'POST'])
@@ -350,23 +436,20 @@ def new_dish():
         try:
             name = request.form.get('name')
             description = request.form.get('description', '')
+            shelf_life_days = request.form.get('shelf_life_days', type=int) or None
+            meal_types = ','.join(request.form.getlist('meal_types')) or None
+            base_yield = request.form.get('base_yield', type=int) or 1
+            if base_yield < 1:
+                raise ValueError('El rendimiento de la receta debe ser al menos 1 ración')
             
-            dish = Dish(name=name, description=description)
+            dish = Dish(name=name, description=description, shelf_life_days=shelf_life_days,
+                        meal_types=meal_types, base_yield=base_yield)
             db.session.add(dish)
             db.session.flush()
             
-            # Añadir ingredientes
-            ingredient_ids = request.form.getlist('ingredient_ids[]')
-            quantities = request.form.getlist('quantities[]')
-            
-            for ing_id, qty in zip(ingredient_ids, quantities):
-                if ing_id and qty:
-                    dish_ingredient = DishIngredient(
-                        dish_id=dish.id,
-                        ingredient_id=int(ing_id),
-                        quantity=float(qty)
-                    )
-                    db.session.add(dish_ingredient)
+            # Añadir ingredientes y componentes
+            _add_form_ingredients(dish.id)
+            _add_form_components(dish.id)
             
             db.session.commit()
             flash(f'Plato "{name}" creado correctamente', 'success')
@@ -376,8 +459,8 @@ def new_dish():
             db.session.rollback()
             flash(f'Error al crear plato: {str(e)}', 'error')
     
-    ingredients = Ingredient.query.order_by(Ingredient.name).all()
-    return render_template('dish_form.html', dish=None, ingredients=ingredients)
+    has_ingredients = db.session.query(Ingredient.query.exists()).scalar()
+    return render_template('dish_form.html', dish=None, has_ingredients=has_ingredients)
 
 
 @main_bp.route('/dish/<int:dish_id>/edit', methods=['GET', 'POST'])
@@ -389,22 +472,23 @@ def edit_dish(dish_id):
         try:
             dish.name = request.form.get('name')
             dish.description = request.form.get('description', '')
+            dish.shelf_life_days = request.form.get('shelf_life_days', type=int) or None
+            dish.meal_types = ','.join(request.form.getlist('meal_types')) or None
+            # Reescala lo planificado en comidas con comensales
+            MealService.set_base_yield(dish, request.form.get('base_yield', type=int) or 1)
             
-            # Eliminar ingredientes previos
+            # Eliminar ingredientes y componentes previos
             DishIngredient.query.filter_by(dish_id=dish.id).delete()
+            DishComponent.query.filter_by(dish_id=dish.id).delete()
             
-            # Añadir nuevos ingredientes
-            ingredient_ids = request.form.getlist('ingredient_ids[]')
-            quantities = request.form.getlist('quantities[]')
+            # Añadir nuevos ingredientes y componentes
+            _add_form_ingredients(dish.id)
+            _add_form_components(dish.id)
             
-            for ing_id, qty in zip(ingredient_ids, quantities):
-                if ing_id and qty:
-                    dish_ingredient = DishIngredient(
-                        dish_id=dish.id,
-                        ingredient_id=int(ing_id),
-                        quantity=float(qty)
-                    )
-                    db.session.add(dish_ingredient)
+            # Los borrados masivos no pasan por el flush: se recalcula a mano
+            # la receta aplanada del plato y de los que lo usan
+            db.session.flush()
+            recipes.refresh(db.session.connection(), [dish.id])
             
             db.session.commit()
             flash(f'Plato "{dish.name}" actualizado correctamente', 'success')
@@ -414,8 +498,8 @@ def edit_dish(dish_id):
             db.session.rollback()
             flash(f'Error al actualizar plato: {str(e)}', 'error')
     
-    ingredients = Ingredient.query.order_by(Ingredient.name).all()
-    return render_template('dish_form.html', dish=dish, ingredients=ingredients)
+    has_ingredients = db.session.query(Ingredient.query.exists()).scalar()
+    return render_template('dish_form.html', dish=dish, has_ingredients=has_ingredients)
 
 
 @main_bp.route('/dish/<int:dish_id>/delete', methods=['POST'])
@@ -424,6 +508,10 @@ def delete_dish(dish_id):
     try:
         dish = Dish.query.get_or_404(dish_id)
         name = dish.name
+        if dish.used_in:
+            users = ', '.join(sorted(usage.dish.name for usage in dish.used_in))
+            flash(f'No se puede eliminar "{name}": es componente de {users}', 'error')
+            return redirect(url_for('main.dishes'))
         db.session.delete(dish)
         db.session.commit()
         flash(f'Plato "{name}" eliminado correctamente', 'success')
@@ -437,9 +525,24 @@ def delete_dish(dish_id):
 
 @main_bp.route('/ingredients')
 def ingredients():
-    """Lista todos los ingredientes"""
-    all_ingredients = Ingredient.query.order_by(Ingredient.name).all()
-    return render_template('ingredients.html', ingredients=all_ingredients)
+    """Lista los ingredientes paginados, con búsqueda por prefijo y orden"""
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'sort': request.args.get('sort', 'name'),
+    }
+    page = read_models.ingredient_rows(
+        q=filters['q'], sort=filters['sort'],
+        cursor=request.args.get('cursor'), per_page=request.args.get('per_page', type=int)
+    )
+    return render_template('ingredients.html', ingredients=page.rows, page=page, filters=filters)
+
+
+def _form_thresholds(unit, base_unit):
+    """Stock objetivo y punto de pedido del formulario, en la unidad base (None si vacíos)"""
+    return tuple(
+        units.convert(value, unit, base_unit) if value is not None else None
+        for value in (request.form.get('par_level', type=float), request.form.get('reorder_point', type=float))
+    )
 
 
 @main_bp.route('/ingredient/new', methods=['GET', 'POST'])
@@ -449,9 +552,14 @@ def new_ingredient():
         try:
             name = request.form.get('name')
             unit = request.form.get('unit')
-            initial_stock = request.form.get('initial_stock', 0, type=float)
+            # Se guarda en la unidad base (kg -> g) y el stock inicial se convierte
+            base_unit = units.base_unit(unit)
+            initial_stock = units.convert(request.form.get('initial_stock', 0, type=float), unit, base_unit)
+            shelf_life_days = request.form.get('shelf_life_days', type=int) or None
+            aisle = (request.form.get('aisle') or '').strip() or None
+            par_level, reorder_point = _form_thresholds(unit, base_unit)
             
-            ingredient = Ingredient(name=name, unit=unit)
+            ingredient = Ingredient(name=name, unit=base_unit, shelf_life_days=shelf_life_days, aisle=aisle)
             db.session.add(ingredient)
             db.session.flush()
             
@@ -462,6 +570,8 @@ def new_ingredient():
                 stock_planificado=initial_stock
             )
             db.session.add(stock)
+            LotService.add_lots([(ingredient.id, initial_stock, None)], 'opening')
+            PantryService.set_thresholds(ingredient.id, par_level, reorder_point, auto_commit=False)
             
             db.session.commit()
             flash(f'Ingrediente "{name}" creado correctamente', 'success')
@@ -471,7 +581,8 @@ def new_ingredient():
             db.session.rollback()
             flash(f'Error al crear ingrediente: {str(e)}', 'error')
     
-    return render_template('ingredient_form.html', ingredient=None)
+    return render_template('ingredient_form.html', ingredient=None,
+                           aisles=StoreLayoutService.known_aisles())
 
 
 @main_bp.route('/ingredient/<int:ingredient_id>/edit', methods=['GET', 'POST'])
@@ -482,7 +593,12 @@ def edit_ingredient(ingredient_id):
     if request.method == 'POST':
         try:
             ingredient.name = request.form.get('name')
-            ingredient.unit = request.form.get('unit')
+            ingredient.shelf_life_days = request.form.get('shelf_life_days', type=int) or None
+            # Cambiar el pasillo reordena el ingrediente en las listas sin completar
+            ingredient.aisle = (request.form.get('aisle') or '').strip() or None
+            UnitService.change_unit(ingredient, request.form.get('unit'), auto_commit=False)
+            par_level, reorder_point = _form_thresholds(request.form.get('unit'), ingredient.unit)
+            PantryService.set_thresholds(ingredient.id, par_level, reorder_point, auto_commit=False)
             
             db.session.commit()
             flash(f'Ingrediente "{ingredient.name}" actualizado correctamente', 'success')
@@ -492,7 +608,57 @@ def edit_ingredient(ingredient_id):
             db.session.rollback()
             flash(f'Error al actualizar ingrediente: {str(e)}', 'error')
     
-    return render_template('ingredient_form.html', ingredient=ingredient)
+    stores = Store.query.order_by(Store.name).all()
+    # Niveles sugeridos por el consumo de las últimas semanas
+    suggestion = ForecastService.suggestions([ingredient.id]).get(ingredient.id)
+    return render_template('ingredient_form.html', ingredient=ingredient, stores=stores,
+                           suggestion=suggestion, aisles=StoreLayoutService.known_aisles())
+
+
+@main_bp.route('/ingredient/<int:ingredient_id>/packs', methods=['POST'])
+def add_pack(ingredient_id):
+    """Añade un formato de compra a un ingrediente"""
+    ingredient = Ingredient.query.get_or_404(ingredient_id)
+    try:
+        pack_size = units.convert(
+            request.form.get('pack_size', type=float),
+            request.form.get('unit') or ingredient.unit,
+            ingredient.unit
+        )
+        price = request.form.get('price', type=float)
+        if not pack_size or pack_size <= 0:
+            raise ValueError("El tamaño del formato debe ser mayor que 0")
+        if price is None or price < 0:
+            raise ValueError("El precio no puede ser negativo")
+        
+        pack = ProductPack(
+            ingredient_id=ingredient.id,
+            name=request.form.get('name') or f'{ingredient.name} {units.format_quantity(pack_size, ingredient.unit)}',
+            pack_size=pack_size,
+            price=price,
+            store_id=request.form.get('store_id', type=int) or None
+        )
+        db.session.add(pack)
+        db.session.commit()
+        flash(f'Formato "{pack.name}" añadido', 'success')
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al añadir formato: {str(e)}', 'error')
+    
+    return redirect(url_for('main.edit_ingredient', ingredient_id=ingredient_id))
+
+
+@main_bp.route('/ingredient/<int:ingredient_id>/packs/<int:pack_id>/delete', methods=['POST'])
+def delete_pack(ingredient_id, pack_id):
+    """Elimina un formato de compra"""
+    pack = ProductPack.query.filter_by(id=pack_id, ingredient_id=ingredient_id).first_or_404()
+    db.session.delete(pack)
+    db.session.commit()
+    flash('Formato eliminado', 'success')
+    return redirect(url_for('main.edit_ingredient', ingredient_id=ingredient_id))
 
 
 @main_bp.route('/ingredient/<int:ingredient_id>/delete', methods=['POST'])
@@ -512,27 +678,33 @@ def delete_ingredient(ingredient_id):
 
 # ==================== ALMACÉN ====================
 
+EXPIRING_DAYS = 3  # Horizonte por defecto de "caduca pronto"
+EXPIRING_LIMIT = 20  # Lotes que se muestran en el almacén
+
+
 @main_bp.route('/pantry')
 def pantry():
-    """Vista del almacén con doble contador de stock"""
-    stocks = PantryStock.query.join(Ingredient).order_by(Ingredient.name).all()
-    
-    # Incluir ingredientes sin stock
-    all_ingredients = Ingredient.query.order_by(Ingredient.name).all()
-    stock_dict = {s.ingredient_id: s for s in stocks}
-    
-    pantry_items = []
-    for ingredient in all_ingredients:
-        stock = stock_dict.get(ingredient.id)
-        pantry_items.append({
-            'ingredient': ingredient,
-            'stock_actual': stock.stock_actual if stock else 0.0,
-            'stock_planificado': stock.stock_planificado if stock else 0.0,
-            'falta_comprar': abs(stock.stock_planificado) if (stock and stock.stock_planificado < 0) else 0.0,
-            'last_updated': stock.last_updated if stock else None
-        })
-    
-    return render_template('pantry.html', pantry_items=pantry_items)
+    """Vista del almacén con doble contador de stock (paginada)"""
+    filters = {
+        'q': request.args.get('q', '').strip(),
+        'sort': request.args.get('sort', 'name'),
+        'below_zero': request.args.get('below_zero', type=int, default=0),
+    }
+    # Incluye ingredientes sin stock (outer join en una sola consulta)
+    page = read_models.pantry_rows(
+        q=filters['q'], below_zero=bool(filters['below_zero']), sort=filters['sort'],
+        cursor=request.args.get('cursor'), per_page=request.args.get('per_page', type=int)
+    )
+    # Fechas de agotamiento solo de los ingredientes de la página (una consulta agregada)
+    run_out = ProjectionService.run_out_dates([item.ingredient_id for item in page.rows])
+    # Stock objetivo y punto de pedido sugeridos (resumen diario, no el historial de comidas)
+    suggested = ForecastService.suggestions([item.ingredient_id for item in page.rows])
+    # Lotes que caducan pronto (índice por hogar y caducidad)
+    expiring_days = request.args.get('expiring_days', type=int, default=EXPIRING_DAYS)
+    expiring = LotService.expiring(expiring_days, limit=EXPIRING_LIMIT)
+    return render_template('pantry.html', pantry_items=page.rows, page=page, filters=filters,
+                           run_out=run_out, suggested=suggested, today=datetime.now().date(),
+                           expiring=expiring, expiring_days=expiring_days)
 
 
 @main_bp.route('/pantry/update', methods=['POST'])
@@ -543,9 +715,13 @@ def update_pantry():
         operation = request.form.get('operation', 'set')  # set, add, subtract
         quantity = request.form.get('quantity', type=float)
         
-        PantryService.update_stock_actual(ingredient_id, quantity, operation)
+        # La cantidad puede venir en otra unidad de la misma dimensión (kg, l...)
+        ingredient = Ingredient.query.get_or_404(ingredient_id)
+        quantity = units.convert(quantity, request.form.get('unit') or ingredient.unit, ingredient.unit)
+        expires_at = _form_date('expires_at', required=False)
+        
+        PantryService.update_stock_actual(ingredient_id, quantity, operation, expires_at=expires_at)
         
-        ingredient = Ingredient.query.get(ingredient_id)
         flash(f'Stock de "{ingredient.name}" actualizado correctamente', 'success')
         
     except StockError as e:
@@ -556,23 +732,145 @@ def update_pantry():
     return redirect(url_for('main.pantry'))
 
 
+# ==================== TIENDAS ====================
+
+@main_bp.route('/stores', methods=['GET', 'POST'])
+def stores():
+    """Lista de tiendas y alta de una nueva"""
+    if request.method == 'POST':
+        try:
+            store = Store(
+                name=request.form.get('name'),
+                delivery_fee=request.form.get('delivery_fee', 0, type=float),
+                min_order=request.form.get('min_order', 0, type=float)
+            )
+            db.session.add(store)
+            db.session.commit()
+            flash(f'Tienda "{store.name}" creada correctamente', 'success')
+            return redirect(url_for('main.stores'))
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al crear tienda: {str(e)}', 'error')
+    
+    all_stores = Store.query.order_by(Store.name).all()
+    pack_counts = dict(
+        db.session.query(ProductPack.store_id, db.func.count(ProductPack.id))
+        .group_by(ProductPack.store_id).all()
+    )
+    return render_template('stores.html', stores=all_stores, pack_counts=pack_counts,
+                           layouts=StoreLayoutService.layouts(), aisles=StoreLayoutService.known_aisles())
+
+
+@main_bp.route('/store/<int:store_id>/edit', methods=['POST'])
+def edit_store(store_id):
+    """Actualiza nombre, gastos de envío y pedido mínimo de una tienda"""
+    store = Store.query.get_or_404(store_id)
+    try:
+        store.name = request.form.get('name')
+        store.delivery_fee = request.form.get('delivery_fee', 0, type=float)
+        store.min_order = request.form.get('min_order', 0, type=float)
+        db.session.commit()
+        flash(f'Tienda "{store.name}" actualizada correctamente', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al actualizar tienda: {str(e)}', 'error')
+    return redirect(url_for('main.stores'))
+
+
+@main_bp.route('/stores/layout', methods=['POST'])
+def store_layout():
+    """Guarda el orden de pasillos de una tienda (o el orden por defecto): uno por línea"""
+    store_id = request.form.get('store_id', type=int) or None
+    try:
+        aisles = StoreLayoutService.set_layout(store_id, (request.form.get('aisles') or '').splitlines())
+        flash(f'Orden de pasillos guardado ({len(aisles)} pasillos)', 'success')
+    except Exception as e:
+        flash(str(e), 'error')
+    return redirect(url_for('main.stores'))
+
+
+@main_bp.route('/store/<int:store_id>/delete', methods=['POST'])
+def delete_store(store_id):
+    """Elimina una tienda (sus formatos quedan sin tienda)"""
+    try:
+        store = Store.query.get_or_404(store_id)
+        name = store.name
+        db.session.delete(store)
+        db.session.commit()
+        flash(f'Tienda "{name}" eliminada correctamente', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al eliminar tienda: {str(e)}', 'error')
+    return redirect(url_for('main.stores'))
+
+
+# ==================== HOGARES ====================
+
+HOUSEHOLDS_PAGE_SIZE = 50
+
+
+@main_bp.route('/households', methods=['GET', 'POST'])
+def households():
+    """Lista de hogares (búsqueda por prefijo) y alta de uno nuevo"""
+    if request.method == 'POST':
+        try:
+            household = Household(name=(request.form.get('name') or '').strip())
+            if not household.name:
+                raise ValueError('El nombre es obligatorio')
+            db.session.add(household)
+            db.session.commit()
+            flash(f'Hogar "{household.name}" creado correctamente', 'success')
+            return redirect(url_for('main.households'))
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al crear hogar: {str(e)}', 'error')
+    
+    q = request.args.get('q', '').strip()
+    query = Household.query
+    if q:
+        query = query.filter(Household.name.startswith(q, autoescape=True))
+    all_households = query.order_by(Household.name).limit(HOUSEHOLDS_PAGE_SIZE).all()
+    return render_template('households.html', households=all_households, q=q,
+                           page_size=HOUSEHOLDS_PAGE_SIZE)
+
+
+@main_bp.route('/household/<int:household_id>/switch', methods=['POST'])
+def switch_household(household_id):
+    """Cambia el hogar activo de la sesión"""
+    household = Household.query.get_or_404(household_id)
+    session['household_id'] = household.id
+    flash(f'Ahora estás en "{household.name}"', 'info')
+    return redirect(url_for('index'))
+
+
 # ==================== LISTA DE COMPRA ====================
 
 @main_bp.route('/shopping')
 def shopping():
-    """Vista de listas de compra"""
-    lists = ShoppingList.query.order_by(ShoppingList.created_at.desc()).all()
-    return render_template('shopping.html', shopping_lists=lists)
+    """Vista de listas de compra (paginada, filtrable por estado)"""
+    filters = {
+        'status': request.args.get('status', ''),
+        'sort': request.args.get('sort', 'recent'),
+    }
+    completed = {'completed': True, 'pending': False}.get(filters['status'])
+    page = read_models.shopping_list_rows(
+        completed=completed, sort=filters['sort'],
+        cursor=request.args.get('cursor'), per_page=request.args.get('per_page', type=int)
+    )
+    return render_template('shopping.html', shopping_lists=page.rows, page=page, filters=filters)
 
 
 @main_bp.route('/shopping/generate', methods=['GET', 'POST'])
 def generate_shopping():
-    """Genera una nueva lista de compra desde stock planificado negativo"""
+    """Genera una nueva lista de compra desde stock planificado negativo (y básicos bajo mínimos)"""
     if request.method == 'POST':
         try:
             name = request.form.get('name', '')
             
-            shopping_list = ShoppingListService.generate_shopping_list_from_stock(name=name)
+            shopping_list = ShoppingListService.generate_shopping_list_from_stock(
+                name=name, time_budget=current_app.config.get('BASKET_TIME_BUDGET'),
+                top_up=bool(request.form.get('top_up'))
+            )
             
             flash(f'Lista de compra generada con {shopping_list.total_items} items', 'success')
             return redirect(url_for('main.shopping_detail', list_id=shopping_list.id))
@@ -586,6 +884,32 @@ def generate_shopping():
     return render_template('shopping_generate.html')
 
 
+@main_bp.route('/shopping/open', methods=['POST'])
+def open_shopping():
+    """Abre (o muestra) la lista que se actualiza sola con cada cambio del plan"""
+    try:
+        shopping_list = ShoppingListService.open_shopping_list(request.form.get('name') or None)
+        return redirect(url_for('main.shopping_detail', list_id=shopping_list.id))
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al abrir lista: {str(e)}', 'error')
+        return redirect(url_for('main.shopping'))
+
+
+@main_bp.route('/shopping/<int:list_id>/close', methods=['POST'])
+def close_shopping(list_id):
+    """Deja de actualizar una lista abierta"""
+    try:
+        ShoppingListService.close_open_list(list_id)
+        flash('La lista ya no se actualiza con el plan', 'success')
+    except ValueError as e:
+        flash(str(e), 'info')
+    except Exception as e:
+        flash(f'Error al cerrar lista: {str(e)}', 'error')
+    
+    return redirect(url_for('main.shopping_detail', list_id=list_id))
+
+
 @main_bp.route('/shopping/<int:list_id>')
 def shopping_detail(list_id):
     """Detalle de una lista de compra"""
@@ -605,6 +929,35 @@ def complete_shopping(list_id):
     return redirect(url_for('main.shopping_detail', list_id=list_id))
 
 
+@main_bp.route('/shopping/<int:list_id>/purchase', methods=['POST'])
+def purchase_shopping_items(list_id):
+    """
+    Marca como comprados uno o varios items (formulario)
+    
+    Form: item_ids (repetible) y opcionalmente quantity_<item_id> con lo
+    que se compró de verdad
+    """
+    try:
+        purchases = {
+            item_id: request.form.get(f'quantity_{item_id}', type=float)
+            for item_id in request.form.getlist('item_ids', type=int)
+        }
+        if not purchases:
+            raise ValueError("No has marcado ningún producto")
+        result = ShoppingListService.purchase_items(list_id, purchases)
+        if result['purchased']:
+            flash(f"{len(result['purchased'])} producto(s) añadidos al almacén", 'success')
+        if result['skipped']:
+            flash(f"{len(result['skipped'])} producto(s) ya estaban comprados", 'info')
+    except ValueError as e:
+        flash(str(e), 'error')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al registrar la compra: {str(e)}', 'error')
+    
+    return redirect(url_for('main.shopping_detail', list_id=list_id))
+
+
 @main_bp.route('/shopping/<int:list_id>/item/<int:item_id>/update', methods=['POST'])
 def update_shopping_item(list_id, item_id):
     """Actualiza la cantidad de un item en la lista de compra"""
@@ -615,6 +968,9 @@ def update_shopping_item(list_id, item_id):
         
         item = ShoppingItem.query.get_or_404(item_id)
         item.quantity_to_buy = new_quantity
+        # Cantidad manual: el plan de formatos deja de ser válido
+        item.pack_plan = None
+        item.estimated_cost = None
         db.session.commit()
         
         flash(f'Cantidad actualizada a {new_quantity}', 'success')
@@ -640,6 +996,191 @@ def delete_shopping(list_id):
     return redirect(url_for('main.shopping'))
 
 
+# ==================== COMPRAS CENTRALES ====================
+
+def _form_date(name, required=True):
+    """Lee una fecha YYYY-MM-DD del formulario; ValueError si falta o es inválida"""
+    value = request.form.get(name)
+    if not value:
+        if required:
+            raise ValueError('La fecha de entrega es obligatoria')
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'Fecha inválida: {value}')
+
+
+@main_bp.route('/procurement', methods=['GET', 'POST'])
+def procurement():
+    """Pedidos consolidados de todos los hogares y generación de los de un día"""
+    if request.method == 'POST':
+        try:
+            orders = ProcurementService.generate(_form_date('delivery_date'), _form_date('window_end', required=False))
+            flash(f'{len(orders)} pedido(s) consolidado(s) creados', 'success')
+            return redirect(url_for('main.procurement'))
+        except ValueError as e:
+            flash(str(e), 'warning')
+        except Exception as e:
+            flash(f'Error al generar pedidos: {str(e)}', 'error')
+    
+    status = request.args.get('status', 'open')
+    query = ProcurementOrder.query.options(db.selectinload(ProcurementOrder.lines))
+    if status in ProcurementOrder.STATUSES:
+        query = query.filter(ProcurementOrder.status == status)
+    orders = query.order_by(ProcurementOrder.delivery_date.desc(), ProcurementOrder.supplier).limit(100).all()
+    return render_template('procurement.html', orders=orders, status=status,
+                           default_delivery=date.today() + timedelta(days=1))
+
+
+@main_bp.route('/procurement/<int:order_id>')
+def procurement_detail(order_id):
+    """Detalle de un pedido consolidado con el desglose por hogar"""
+    order = ProcurementOrder.query.options(
+        db.selectinload(ProcurementOrder.lines)
+        .selectinload(ProcurementLine.allocations)
+        .selectinload(ProcurementAllocation.household)
+    ).filter(ProcurementOrder.id == order_id).first_or_404()
+    return render_template('procurement_detail.html', order=order)
+
+
+@main_bp.route('/procurement/<int:order_id>/receive', methods=['POST'])
+def receive_procurement(order_id):
+    """Recibe el pedido (cantidades entregadas por línea) y lo reparte entre los hogares"""
+    delivered = {}
+    for key, value in request.form.items():
+        if key.startswith('delivered_') and value != '':
+            try:
+                delivered[int(key[len('delivered_'):])] = float(value)
+            except ValueError:
+                flash(f'Cantidad inválida: {value}', 'error')
+                return redirect(url_for('main.procurement_detail', order_id=order_id))
+    try:
+        result = ProcurementService.receive(order_id, delivered)
+        flash(f'Pedido recibido: {result["lines"]} líneas repartidas entre {result["households"]} hogares', 'success')
+    except ValueError as e:
+        flash(str(e), 'warning')
+    except Exception as e:
+        flash(f'Error al recibir pedido: {str(e)}', 'error')
+    return redirect(url_for('main.procurement_detail', order_id=order_id))
+
+
+@main_bp.route('/procurement/<int:order_id>/delete', methods=['POST'])
+def delete_procurement(order_id):
+    """Elimina un pedido consolidado abierto"""
+    try:
+        ProcurementService.delete(order_id)
+        flash('Pedido eliminado', 'success')
+    except ValueError as e:
+        flash(str(e), 'warning')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al eliminar pedido: {str(e)}', 'error')
+    return redirect(url_for('main.procurement'))
+
+
+# ==================== IMPORTACIÓN ====================
+
+def _run_import():
+    """Importa el fichero subido ('file') con el tipo 'kind'; el formato sale de 'format' o de la extensión"""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        raise ValueError('Selecciona un fichero')
+    fmt = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    fmt = {'jsonl': 'ndjson'}.get(fmt, fmt)
+    if fmt not in ImportService.FORMATS:
+        raise ValueError(f'Formato no soportado: {fmt} (usa CSV, JSON o NDJSON)')
+    
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    return ImportService.import_rows(
+        ImportService.read_rows(stream, fmt),
+        kind=request.form.get('kind', 'recipes'),
+        dry_run=bool(request.form.get('dry_run'))
+    )
+
+
+@main_bp.route('/import', methods=['GET', 'POST'])
+def import_data():
+    """Importación masiva de recetas o stock inicial desde un fichero"""
+    result = None
+    if request.method == 'POST':
+        try:
+            result = _run_import()
+            action = 'validadas (sin guardar)' if result['dry_run'] else 'importadas'
+            category = 'warning' if result['error_count'] else 'success'
+            flash(f"{result['imported']} filas {action}, {result['error_count']} con errores", category)
+        except ValueError as e:
+            flash(str(e), 'error')
+        except Exception as e:
+            flash(f'Error al importar: {str(e)}', 'error')
+    
+    return render_template('import.html', result=result)
+
+
+@main_bp.route('/api/import', methods=['POST'])
+def api_import():
+    """API: importación masiva (multipart: file, kind=recipes|stock, format, dry_run)"""
+    try:
+        return jsonify(_run_import())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+# ==================== EXPORTACIÓN ====================
+
+def _export_response(export, fmt):
+    """Respuesta en streaming de una exportación (404 si el formato no existe)"""
+    if fmt not in exports.MIMETYPES:
+        abort(404)
+    return Response(
+        stream_with_context(exports.stream(export, fmt)),
+        mimetype=exports.MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{export.filename}.{fmt}"'}
+    )
+
+
+def _export_range():
+    """Lee start/end (YYYY-MM-DD) de la query string; ValueError si son inválidas"""
+    bounds = []
+    for name in ('start', 'end'):
+        value = request.args.get(name)
+        bounds.append(datetime.strptime(value, '%Y-%m-%d').date() if value else None)
+    return bounds
+
+
+@main_bp.route('/export/shopping/<int:list_id>.<fmt>')
+def export_shopping(list_id, fmt):
+    """Exporta los items de una lista de compra"""
+    ShoppingList.query.get_or_404(list_id)
+    return _export_response(exports.shopping_list(list_id), fmt)
+
+
+@main_bp.route('/export/pantry.<fmt>')
+def export_pantry(fmt):
+    """Exporta la foto actual del almacén"""
+    return _export_response(exports.pantry(), fmt)
+
+
+@main_bp.route('/export/plan.<fmt>')
+def export_plan(fmt):
+    """Exporta las comidas planificadas (query params: start, end)"""
+    try:
+        start_date, end_date = _export_range()
+    except ValueError:
+        return jsonify({'error': 'Fechas inválidas: usa YYYY-MM-DD'}), 400
+    return _export_response(exports.meal_plan(start_date, end_date), fmt)
+
+
+@main_bp.route('/export/consumption.<fmt>')
+def export_consumption(fmt):
+    """Exporta el historial de consumo de las comidas confirmadas (query params: start, end)"""
+    try:
+        start_date, end_date = _export_range()
+    except ValueError:
+        return jsonify({'error': 'Fechas inválidas: usa YYYY-MM-DD'}), 400
+    return _export_response(exports.consumption(start_date, end_date), fmt)
+
+
 # ==================== API ENDPOINTS ====================
 
 @main_bp.route('/api/dishes')
@@ -648,15 +1189,17 @@ def api_dishes():
     from models import DishBatch
     dishes = Dish.query.order_by(Dish.name).all()
     
+    # Porcentaje disponible por plato en una sola consulta (ignora batches caducados)
+    available_by_dish = dict(
+        db.session.query(DishBatch.dish_id, db.func.sum(DishBatch.percentage_remaining))
+        .filter(DishBatch.available_filter())
+        .group_by(DishBatch.dish_id)
+        .all()
+    )
+    
     result = []
     for d in dishes:
-        # Buscar batches con porcentaje disponible
-        available_batches = DishBatch.query.filter(
-            DishBatch.dish_id == d.id,
-            DishBatch.percentage_remaining > 0
-        ).all()
-        
-        total_available = sum(b.percentage_remaining for b in available_batches)
+        total_available = available_by_dish.get(d.id) or 0.0
         
         result.append({
             'id': d.id,
@@ -669,6 +1212,20 @@ def api_dishes():
     return jsonify(result)
 
 
+@main_bp.route('/api/search')
+def api_search():
+    """API de autocompletado: mejores coincidencias de platos o ingredientes"""
+    kind = request.args.get('type', 'dish')
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    
+    index = search_index.get_index(kind)
+    if index is None:
+        return jsonify({'error': 'Tipo inválido: usa "dish" o "ingredient"'}), 400
+    
+    return jsonify(index.search(query, limit=limit))
+
+
 @main_bp.route('/api/batches')
 def api_batches():
     """API para obtener batches disponibles de un plato"""
@@ -680,7 +1237,7 @@ def api_batches():
     
     batches = DishBatch.query.filter(
         DishBatch.dish_id == dish_id,
-        DishBatch.percentage_remaining > 0
+        DishBatch.available_filter()
     ).order_by(DishBatch.preparation_date.desc()).all()
     
     result = []
@@ -689,6 +1246,7 @@ def api_batches():
             'id': batch.id,
             'dish_id': batch.dish_id,
             'preparation_date': batch.preparation_date.strftime('%Y-%m-%d'),
+            'expires_at': batch.expires_at.strftime('%Y-%m-%d %H:%M') if batch.expires_at else None,
             'percentage_remaining': batch.percentage_remaining,
             'display_info': batch.display_info
         })
@@ -696,6 +1254,219 @@ def api_batches():
     return jsonify(result)
 
 
+@main_bp.route('/api/batches/allocate', methods=['POST'])
+def api_allocate_batches():
+    """API para asignar (o previsualizar) el consumo FIFO de batches de un plato"""
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Se esperaba un objeto JSON'}), 400
+    dish_id = payload.get('dish_id')
+    
+    if not dish_id or payload.get('percentage') is None:
+        return jsonify({'error': 'Faltan dish_id o percentage'}), 400
+    
+    # Datos inválidos: 400; batches insuficientes: 409
+    try:
+        percentage = BatchAllocationService.validate_percentage(payload['percentage'])
+        assign = bool(payload.get('day_id') and payload.get('meal_type'))
+        if assign:
+            BatchAllocationService.validate_meal_type(payload['meal_type'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        if assign:
+            allocations = BatchAllocationService.assign_to_meal(
+                payload['day_id'], payload['meal_type'], dish_id, percentage
+            )
+            return jsonify({
+                'allocations': [{'batch_id': b, 'percentage': p} for b, p in allocations],
+                'shortfall': 0.0
+            })
+        return jsonify(BatchAllocationService.preview(dish_id, percentage))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+
+
+@main_bp.route('/api/batches/plan', methods=['POST'])
+def api_plan_batches():
+    """API para planificar en lote las asignaciones de batches de una semana"""
+    payload = request.get_json(silent=True) or {}
+    requests_data = payload.get('requests') if isinstance(payload, dict) else None
+    
+    if not isinstance(requests_data, list):
+        return jsonify({'error': 'Se esperaba una lista "requests"'}), 400
+    
+    try:
+        results = BatchAllocationService.plan_allocations(
+            requests_data, apply=bool(payload.get('apply'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(results)
+
+
+@main_bp.route('/api/planner', methods=['POST'])
+def api_planner():
+    """
+    API del planificador automático
+    
+    Body JSON: {'start_date', 'end_date', 'meal_types', 'preferences': {dish_id: peso},
+                'exclude': [dish_id], 'max_repeats', 'min_gap_days', 'time_budget', 'apply'}
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        start_date = datetime.strptime(payload['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(payload.get('end_date') or payload['start_date'], '%Y-%m-%d').date()
+        preferences = {int(k): float(v) for k, v in (payload.get('preferences') or {}).items()}
+        for dish_id in payload.get('exclude') or []:
+            preferences[int(dish_id)] = None
+        meal_types = payload.get('meal_types') or None
+        if meal_types and any(t not in Meal.MEAL_TYPES for t in meal_types):
+            raise ValueError(f'Tipos de comida inválidos: {meal_types}')
+        time_budget = min(float(payload.get('time_budget', PlannerService.TIME_BUDGET)), 5.0)
+        
+        result = PlannerService.plan(
+            start_date, end_date,
+            meal_types=meal_types,
+            preferences=preferences,
+            max_repeats=int(payload.get('max_repeats', 2)),
+            min_gap_days=int(payload.get('min_gap_days', 2)),
+            time_budget=time_budget,
+            apply=bool(payload.get('apply'))
+        )
+    except KeyError:
+        return jsonify({'error': 'Falta start_date'}), 400
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
+@main_bp.route('/api/feasibility')
+def api_feasibility():
+    """API: platos que se pueden cocinar con el stock actual y cuántas porciones"""
+    meal_type = request.args.get('meal_type')
+    if meal_type and meal_type not in Meal.MEAL_TYPES:
+        return jsonify({'error': f'Tipo de comida inválido: {meal_type}'}), 400
+    
+    results = FeasibilityService.feasible_dishes(
+        meal_type=meal_type,
+        min_portions=request.args.get('min_portions', 1, type=int),
+        limit=request.args.get('limit', type=int)
+    )
+    return jsonify(results)
+
+
+@main_bp.route('/api/projection')
+def api_projection():
+    """
+    API: curva de stock real día a día y fecha de agotamiento por ingrediente
+    
+    Query params: days (horizonte desde hoy), ingredient_id (repetible), only_run_out=1
+    """
+    days = request.args.get('days', type=int)
+    if days is not None and not 1 <= days <= ProjectionService.MAX_HORIZON_DAYS:
+        return jsonify({'error': f'days debe estar entre 1 y {ProjectionService.MAX_HORIZON_DAYS}'}), 400
+    end_date = datetime.now().date() + timedelta(days=days) if days else None
+    ingredient_ids = request.args.getlist('ingredient_id', type=int) or None
+    
+    projection = ProjectionService.project(end_date=end_date, ingredient_ids=ingredient_ids)
+    only_run_out = request.args.get('only_run_out', type=int, default=0)
+    return jsonify([
+        {
+            'ingredient_id': ingredient_id,
+            'stock_actual': entry['stock_actual'],
+            'final_stock': entry['final_stock'],
+            'run_out_date': entry['run_out_date'].isoformat() if entry['run_out_date'] else None,
+            'timeline': [{'date': d.isoformat(), 'stock': q} for d, q in entry['timeline']],
+        }
+        for ingredient_id, entry in sorted(
+            projection.items(),
+            key=lambda item: (item[1]['run_out_date'] is None, item[1]['run_out_date'] or date.max)
+        )
+        if not only_run_out or entry['run_out_date']
+    ])
+
+
+@main_bp.route('/api/lots/expiring')
+def api_expiring_lots():
+    """
+    API: lotes con existencias que caducan en los próximos días (o ya caducados)
+    
+    Query params: days (por defecto 3), limit
+    """
+    lots = LotService.expiring(
+        request.args.get('days', type=int, default=EXPIRING_DAYS),
+        limit=request.args.get('limit', type=int)
+    )
+    return jsonify([
+        {
+            'lot_id': lot.id,
+            'ingredient_id': lot.ingredient_id,
+            'ingredient': lot.name,
+            'unit': lot.unit,
+            'quantity_remaining': lot.quantity_remaining,
+            'expires_at': lot.expires_at.isoformat(),
+            'source': lot.source,
+        }
+        for lot in lots
+    ])
+
+
+@main_bp.route('/api/forecast')
+def api_forecast():
+    """
+    API: previsión de consumo y niveles sugeridos por ingrediente
+    
+    Query params: ingredient_id (repetible), days (horizonte de la previsión)
+    """
+    try:
+        forecast = ForecastService.forecast(
+            ingredient_ids=request.args.getlist('ingredient_id', type=int) or None,
+            horizon=request.args.get('days', type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify([
+        {
+            'ingredient_id': ingredient_id,
+            'daily_average': entry['daily_average'],
+            'recent_average': entry['recent_average'],
+            'weekday_profile': entry['weekday_profile'],
+            'par_level': entry['par_level'],
+            'reorder_point': entry['reorder_point'],
+            'forecast': [{'date': d.isoformat(), 'quantity': q} for d, q in entry['forecast']],
+        }
+        for ingredient_id, entry in forecast.items()
+    ])
+
+
+@main_bp.route('/api/shopping/<int:list_id>/purchase', methods=['POST'])
+def api_purchase_shopping_items(list_id):
+    """
+    API: compra de items desde el móvil, uno o varios por petición
+    
+    JSON: {"items": [{"item_id": 1, "quantity": 2.5}, ...]} (quantity
+    opcional = la cantidad a comprar). Repetir la petición no vuelve a
+    sumar stock: los items ya comprados vuelven en "skipped".
+    """
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Se esperaba un objeto {"items": [...]}'}), 400
+    try:
+        purchases = {
+            int(entry['item_id']): float(entry['quantity']) if entry.get('quantity') is not None else None
+            for entry in payload.get('items') or []
+        }
+        if not purchases:
+            raise ValueError("No se ha indicado ningún item")
+        result = ShoppingListService.purchase_items(list_id, purchases)
+    except (KeyError, TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
 @main_bp.route('/api/ingredients/<int:ingredient_id>/stock')
 def api_ingredient_stock(ingredient_id):
     """API para obtener stock de un ingrediente"""
@@ -707,3 +1478,28 @@ def api_ingredient_stock(ingredient_id):
         'unit': ingredient.unit,
         'quantity': quantity
     })
+
+
+
+@main_bp.route('/api/sync')
+def api_sync():
+    """API delta-sync: filas cambiadas desde la versión del cliente"""
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', 5000, type=int), 20000))
+    return jsonify(SyncService.get_changes(since=since, limit=limit))
+
+
+@main_bp.route('/api/sync', methods=['POST'])
+def api_sync_upload():
+    """API delta-sync: sube en lote las escrituras hechas offline"""
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    
+    if not isinstance(operations, list):
+        return jsonify({'error': 'Se esperaba una lista "operations"'}), 400
+    
+    results = SyncService.apply_uploaded_changes(operations)
+    return jsonify({
+        'results': results,
+        'version': SyncService.current_version()
+    })
@@ -0,0 +1,278 @@
+"""
+Índice de búsqueda en memoria para autocompletar platos e ingredientes
+
+Cada proceso mantiene un índice por catálogo (dishes.name, ingredients.name)
+con dos estructuras invertidas:
+- Prefijos de cada palabra del nombre (búsqueda mientras se escribe)
+- Trigramas del nombre completo (tolera erratas y coincidencias parciales)
+
+El índice se construye con una única consulta la primera vez que se usa y
+se mantiene de forma incremental: tras cada commit se aplican las altas,
+ediciones y bajas de Dish e Ingredient hechas en la sesión. Como otros
+workers no ven esos cambios, además se reconstruye pasado MAX_AGE segundos.
+
+Hay un índice por hogar y catálogo. Solo se guardan en memoria los de los
+MAX_HOUSEHOLDS hogares usados más recientemente (LRU): la memoria del
+proceso no crece con el número de hogares y cada búsqueda solo recorre el
+catálogo de su hogar.
+"""
+import heapq
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+import tenancy
+from models import db, Dish, Ingredient
+
+
+MAX_PREFIX = 12  # Longitud máxima de prefijo indexado por palabra
+MIN_TRIGRAM_SCORE = 0.3  # Similitud mínima para resultados por trigramas
+MAX_AGE = 300  # Segundos antes de reconstruir (cambios de otros workers)
+MAX_HOUSEHOLDS = 256  # Hogares con índices en memoria a la vez
+
+
+def normalize(text):
+    """Minúsculas y sin tildes: 'Limón' -> 'limon'"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower().strip()
+
+
+def trigrams(text):
+    """Trigramas con relleno de espacios, como pg_trgm"""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Índice de prefijos y trigramas sobre los nombres de un catálogo"""
+    
+    def __init__(self, model, extra_columns=(), household_id=None):
+        self.model = model
+        self.extra_columns = extra_columns
+        self.household_id = household_id
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._entries = {}  # id -> (nombre, nombre normalizado, extras, nº trigramas)
+        self._prefixes = defaultdict(set)
+        self._trigrams = defaultdict(set)
+        self._alphabetical = None  # Caché para búsquedas vacías
+    
+    def _ensure_built(self):
+        if self._built_at is None or time.monotonic() - self._built_at > MAX_AGE:
+            self.rebuild()
+    
+    def rebuild(self):
+        """Reconstruye el índice completo con una sola consulta"""
+        columns = [self.model.id, self.model.name] + [
+            getattr(self.model, name) for name in self.extra_columns
+        ]
+        with tenancy.use(self.household_id or tenancy.current_household_id()):
+            rows = db.session.execute(select(*columns)).all()
+        with self._lock:
+            self._entries.clear()
+            self._prefixes.clear()
+            self._trigrams.clear()
+            self._alphabetical = None
+            for row in rows:
+                self._add(row[0], row[1], dict(zip(self.extra_columns, row[2:])))
+            self._built_at = time.monotonic()
+    
+    def _add(self, item_id, name, extras):
+        key = normalize(name)
+        grams = trigrams(key)
+        self._entries[item_id] = (name, key, extras, len(grams))
+        self._alphabetical = None
+        for word in key.split():
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                self._prefixes[word[:length]].add(item_id)
+        for gram in grams:
+            self._trigrams[gram].add(item_id)
+    
+    def _remove(self, item_id):
+        entry = self._entries.pop(item_id, None)
+        if entry is None:
+            return
+        self._alphabetical = None
+        key = entry[1]
+        for word in key.split():
+            for length in range(1, min(len(word), MAX_PREFIX) + 1):
+                postings = self._prefixes.get(word[:length])
+                if postings is not None:
+                    postings.discard(item_id)
+                    if not postings:
+                        del self._prefixes[word[:length]]
+        for gram in trigrams(key):
+            postings = self._trigrams.get(gram)
+            if postings is not None:
+                postings.discard(item_id)
+                if not postings:
+                    del self._trigrams[gram]
+    
+    def invalidate(self):
+        """Fuerza reconstrucción en la próxima búsqueda (cambios hechos sin el ORM)"""
+        with self._lock:
+            self._built_at = None
+    
+    def upsert(self, item_id, name, **extras):
+        """Añade o actualiza una entrada (si el índice ya está construido)"""
+        with self._lock:
+            if self._built_at is None:
+                return
+            self._remove(item_id)
+            self._add(item_id, name, extras)
+    
+    def remove(self, item_id):
+        """Elimina una entrada"""
+        with self._lock:
+            self._remove(item_id)
+    
+    def search(self, query, limit=10):
+        """
+        Busca los mejores resultados para un texto
+        
+        Orden: nombre exacto, nombre que empieza por el texto, alguna palabra
+        que empieza por cada palabra del texto y, si faltan resultados,
+        similitud de trigramas.
+        
+        Returns:
+            list[dict]: {'id', 'name', 'score', ...extras}
+        """
+        self._ensure_built()
+        key = normalize(query)
+        
+        with self._lock:
+            if not key:
+                if self._alphabetical is None:
+                    self._alphabetical = sorted(self._entries, key=lambda item_id: self._entries[item_id][1])
+                return [self._result(item_id, self._entries[item_id], 0.0)
+                        for item_id in self._alphabetical[:limit]]
+            
+            scores = {}
+            words = key.split()
+            long_words = [w for w in words if len(w) > MAX_PREFIX]
+            candidates = None
+            for word in words:
+                postings = self._prefixes.get(word[:MAX_PREFIX], set())
+                candidates = set(postings) if candidates is None else candidates & postings
+            for item_id in candidates or ():
+                entry_key = self._entries[item_id][1]
+                # Palabras más largas que MAX_PREFIX se verifican sobre el nombre
+                if long_words and not all(w in entry_key for w in long_words):
+                    continue
+                if entry_key == key:
+                    scores[item_id] = 3.0
+                elif entry_key.startswith(key):
+                    scores[item_id] = 2.0
+                else:
+                    scores[item_id] = 1.0 + len(key) / len(entry_key)
+            
+            if len(scores) < limit:
+                query_grams = trigrams(key)
+                shared = defaultdict(int)
+                for gram in query_grams:
+                    for item_id in self._trigrams.get(gram, ()):
+                        shared[item_id] += 1
+                for item_id, count in shared.items():
+                    if item_id in scores:
+                        continue
+                    entry_grams = self._entries[item_id][3]
+                    similarity = count / (len(query_grams) + entry_grams - count)
+                    if similarity >= MIN_TRIGRAM_SCORE:
+                        scores[item_id] = similarity
+            
+            ranked = heapq.nsmallest(limit, scores.items(),
+                                     key=lambda item: (-item[1], self._entries[item[0]][1]))
+            return [self._result(item_id, self._entries[item_id], score) for item_id, score in ranked]
+    
+    @staticmethod
+    def _result(item_id, entry, score):
+        name, _, extras, _ = entry
+        return {'id': item_id, 'name': name, 'score': round(score, 3), **extras}
+
+
+# Catálogos indexables: tipo -> (modelo, columnas extra del resultado)
+CATALOGS = {
+    'dish': (Dish, ()),
+    'ingredient': (Ingredient, ('unit',)),
+}
+
+_indexes = OrderedDict()  # (tipo, hogar) -> NameIndex, en orden de uso
+_indexes_lock = threading.Lock()
+
+
+def get_index(kind, household_id=None, create=True):
+    """
+    Índice de un catálogo para un hogar (el activo por defecto)
+    
+    Returns:
+        NameIndex o None si el tipo no existe (o no está en memoria y create=False)
+    """
+    if kind not in CATALOGS:
+        return None
+    key = (kind, household_id or tenancy.current_household_id())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+        elif create:
+            model, extra_columns = CATALOGS[kind]
+            index = _indexes[key] = NameIndex(model, extra_columns, household_id=key[1])
+            while len(_indexes) > MAX_HOUSEHOLDS * len(CATALOGS):
+                _indexes.popitem(last=False)
+        return index
+
+
+def invalidate(household_id=None):
+    """Descarta los índices de un hogar (cambios hechos sin el ORM)"""
+    for kind in CATALOGS:
+        index = get_index(kind, household_id, create=False)
+        if index is not None:
+            index.invalidate()
+
+
+def invalidate_all():
+    """Descarta los índices de todos los hogares"""
+    with _indexes_lock:
+        _indexes.clear()
+
+
+# ==================== MANTENIMIENTO INCREMENTAL ====================
+
+def _pending(session):
+    return session.info.setdefault('search_index_pending', {})
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_catalog_changes(session, flush_context):
+    """Anota los platos e ingredientes tocados para aplicarlos tras el commit"""
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Dish):
+            pending[('dish', obj.household_id, obj.id)] = {'name': obj.name}
+        elif isinstance(obj, Ingredient):
+            pending[('ingredient', obj.household_id, obj.id)] = {'name': obj.name, 'unit': obj.unit}
+    for obj in session.deleted:
+        if isinstance(obj, Dish):
+            pending[('dish', obj.household_id, obj.id)] = None
+        elif isinstance(obj, Ingredient):
+            pending[('ingredient', obj.household_id, obj.id)] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_catalog_changes(session):
+    pending = session.info.pop('search_index_pending', {})
+    for (kind, household_id, item_id), values in pending.items():
+        index = get_index(kind, household_id, create=False)
+        if index is None:
+            continue
+        if values is None:
+            index.remove(item_id)
+        else:
+            index.upsert(item_id, **values)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_catalog_changes(session):
+    session.info.pop('search_index_pending', None)
@@ -21,13 +21,41 @@ NUEVA FILOSOFÍA:
 
 Contiene servicios para:
 - Gestión de stock del almacén (doble contador)
+- Cambio de unidad base de ingredientes (reescalado de cantidades)
 - Asignación de platos con porciones
 - Confirmación de comidas ejecutadas
-- Generación de listas de compra
+- Generación de listas de compra (redondeadas a formatos de compra)
+- Reparto de la compra en cestas por tienda (envíos y pedido mínimo)
+- Orden de recorrido de cada tienda (pasillos) para las listas de compra
+- Compras centrales consolidadas entre hogares y reparto de lo recibido
+- Asignación automática de batches (FIFO)
+- Caducidad de batches y barrido de desperdicio
+- Consulta de platos cocinables con el stock actual
+- Planificador automático de semanas que minimiza la compra
+- Proyección diaria del stock y fecha en que se agota cada ingrediente
+- Historial de consumo diario y previsión (stock objetivo y punto de pedido)
+- Importación masiva de recetas y stock desde CSV / JSON
+- Sincronización incremental con clientes offline
 """
-from datetime import datetime, timedelta
-from sqlalchemy import and_, func
-from models import db, Ingredient, PantryStock, Dish, DishIngredient, Day, Meal, MealDish, ShoppingList, ShoppingItem
+import csv
+import json
+import math
+import random
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, bindparam, case, func, literal, select, union_all
+import open_list
+import recipes
+import search_index
+import store_layout
+import units
+from tenancy import current_household_id, unscoped
+from models import (
+    db, Ingredient, PantryStock, PantryLot, Store, ProductPack, Dish, DishIngredient, DishFlatIngredient,
+    DishBatch, BatchWaste, Day, Meal, ConsumptionDaily, StoreAisle,
+    MealDish, ShoppingList, ShoppingItem, ProcurementOrder, ProcurementLine, ProcurementAllocation,
+    SyncChange, record_sync_changes
+)
 
 
 class StockError(Exception):
@@ -55,16 +83,22 @@ class PantryService:
         return {'actual': 0.0, 'planificado': 0.0}
     
     @staticmethod
-    def update_stock_actual(ingredient_id, quantity, operation='set', auto_commit=True):
+    def update_stock_actual(ingredient_id, quantity, operation='set', auto_commit=True,
+                            expires_at=None, source='manual'):
         """
         Actualiza el stock ACTUAL (físico) de un ingrediente
         También actualiza stock_planificado en la misma cantidad
         
+        Lo que entra crea un lote (PantryLot) y lo que sale vacía lotes en
+        orden FEFO.
+        
         Args:
             ingredient_id: ID del ingrediente
             quantity: Cantidad a modificar
             operation: 'set' (establecer), 'add' (añadir), 'subtract' (restar)
             auto_commit: Si True, hace commit automáticamente
+            expires_at: Caducidad del lote que entra (None = la del ingrediente)
+            source: Origen del lote que entra (PantryLot.SOURCES)
         """
         stock = PantryStock.query.filter_by(ingredient_id=ingredient_id).first()
         
@@ -95,6 +129,12 @@ class PantryService:
             stock.stock_actual -= quantity
             stock.stock_planificado -= quantity
         
+        diff = stock.stock_actual - old_actual
+        if diff > 0:
+            LotService.add_lots([(ingredient_id, diff, expires_at)], source)
+        elif diff < 0:
+            LotService.consume(LotService.needs_select({ingredient_id: -diff}))
+        
         if auto_commit:
             db.session.commit()
         
@@ -129,6 +169,413 @@ class PantryService:
             db.session.commit()
         
         return stock
+    
+    @staticmethod
+    def set_thresholds(ingredient_id, par_level=None, reorder_point=None, auto_commit=True):
+        """
+        Marca un ingrediente como básico (o deja de serlo)
+        
+        Con solo uno de los dos valores, el otro toma el mismo: reponer
+        siempre que se baje del objetivo.
+        
+        Args:
+            ingredient_id: ID del ingrediente
+            par_level: Stock objetivo al reponer (None = no es básico)
+            reorder_point: Reponer cuando el planificado baja de aquí
+            auto_commit: Si True, hace commit automáticamente
+        
+        Returns:
+            PantryStock: Fila de stock del ingrediente
+        """
+        if par_level is None:
+            par_level = reorder_point
+        if reorder_point is None:
+            reorder_point = par_level
+        if reorder_point is not None and reorder_point < 0:
+            raise ValueError("El punto de pedido no puede ser negativo")
+        if par_level is not None and par_level < reorder_point:
+            raise ValueError("El stock objetivo debe ser mayor o igual que el punto de pedido")
+        
+        stock = PantryStock.query.filter_by(ingredient_id=ingredient_id).first()
+        if not stock:
+            stock = PantryStock(ingredient_id=ingredient_id, stock_actual=0.0, stock_planificado=0.0)
+            db.session.add(stock)
+        stock.par_level = par_level
+        stock.reorder_point = reorder_point
+        
+        if auto_commit:
+            db.session.commit()
+        return stock
+    
+    @staticmethod
+    def apply_requirements(requirements, operation, actual=False):
+        """
+        Aplica de una vez unas necesidades {ingredient_id: cantidad} al almacén
+        
+        Carga todas las filas de stock en una consulta; el flush las escribe
+        en lote. Mismas reglas que update_stock_planificado / update_stock_actual.
+        
+        Args:
+            requirements: dict ingredient_id -> cantidad (puede ser negativa)
+            operation: 'add' (devolver) o 'subtract' (descontar)
+            actual: Si True mueve stock_actual y planificado (confirmar una
+                comida); al restar sin stock real suficiente se deja a 0
+        """
+        if not requirements:
+            return
+        stocks = {
+            stock.ingredient_id: stock
+            for stock in PantryStock.query.filter(PantryStock.ingredient_id.in_(list(requirements)))
+        }
+        sign = 1 if operation == 'add' else -1
+        for ingredient_id, quantity in requirements.items():
+            stock = stocks.get(ingredient_id)
+            if stock is None:
+                stock = PantryStock(ingredient_id=ingredient_id, stock_actual=0.0, stock_planificado=0.0)
+                db.session.add(stock)
+            
+            if not actual:
+                stock.stock_planificado += sign * quantity
+            elif sign < 0 and stock.stock_actual < quantity:
+                # Ya se cocinó aunque no hubiera stock registrado
+                ingredient = db.session.get(Ingredient, ingredient_id)
+                print(f"⚠️  Advertencia: Stock insuficiente de {ingredient.name}. "
+                      f"Disponible: {stock.stock_actual} {ingredient.unit}, "
+                      f"Intentas restar: {quantity} {ingredient.unit}. Se permite confirmar de todas formas.")
+                stock.stock_actual = 0
+            else:
+                stock.stock_actual += sign * quantity
+                stock.stock_planificado += sign * quantity
+
+
+class RequirementService:
+    """
+    Necesidades de ingredientes de las comidas, agregadas en SQL
+    
+    Todas las rutas de stock (planificar, confirmar, lista de compra,
+    proyección, compras centrales) usan la misma regla: cantidad de la
+    receta aplanada × MealDish.scale_expression() (porciones × comensales /
+    rendimiento de la receta). Una consulta agrupada por ingrediente cuesta
+    lo mismo para 2 comensales que para 200, y lo mismo para un plato con
+    sub-recetas que sin ellas (dish_flat_ingredients, ver recipes.py).
+    """
+    
+    @staticmethod
+    def quantity_expression():
+        """Cantidad de un ingrediente para un MealDish (escalada)"""
+        return DishFlatIngredient.quantity * MealDish.scale_expression()
+    
+    @staticmethod
+    def select_requirements(*columns):
+        """select de columnas sobre MealDish ⋈ Meal ⋈ Dish ⋈ DishFlatIngredient"""
+        return (
+            select(*columns)
+            .select_from(MealDish)
+            .join(Meal, Meal.id == MealDish.meal_id)
+            .join(Dish, Dish.id == MealDish.dish_id)
+            .join(DishFlatIngredient, DishFlatIngredient.dish_id == MealDish.dish_id)
+        )
+    
+    @staticmethod
+    def requirements_select(meal_ids=None, meal_dish_ids=None, dish_id=None, dish_ids=None,
+                            pending_only=False, portions_only=False):
+        """
+        select agrupado (ingredient_id, quantity) de un conjunto de MealDish
+        
+        Args:
+            meal_ids: Solo los platos de estas comidas
+            meal_dish_ids: Solo estos MealDish
+            dish_id: Solo los MealDish de este plato
+            dish_ids: Solo los MealDish de estos platos
+            pending_only: Excluye comidas confirmadas
+            portions_only: Excluye los MealDish en modo batch
+        """
+        stmt = RequirementService.select_requirements(
+            DishFlatIngredient.ingredient_id.label('ingredient_id'),
+            func.sum(RequirementService.quantity_expression()).label('quantity')
+        ).group_by(DishFlatIngredient.ingredient_id)
+        if meal_ids is not None:
+            stmt = stmt.where(MealDish.meal_id.in_(meal_ids))
+        if meal_dish_ids is not None:
+            stmt = stmt.where(MealDish.id.in_(meal_dish_ids))
+        if dish_id is not None:
+            stmt = stmt.where(MealDish.dish_id == dish_id)
+        if dish_ids is not None:
+            stmt = stmt.where(MealDish.dish_id.in_(dish_ids))
+        if pending_only:
+            stmt = stmt.where(Meal.confirmed.is_(False))
+        if portions_only:
+            stmt = stmt.where(MealDish.batch_id.is_(None))
+        return stmt
+    
+    @staticmethod
+    def for_meal_dishes(**filters):
+        """
+        Necesidades agregadas por ingrediente de un conjunto de MealDish
+        
+        Args:
+            **filters: Filtros de requirements_select
+        
+        Returns:
+            dict: ingredient_id -> cantidad
+        """
+        stmt = RequirementService.requirements_select(**filters)
+        return {ingredient_id: quantity or 0.0 for ingredient_id, quantity in db.session.execute(stmt)}
+    
+    @staticmethod
+    def replan(change, **filters):
+        """
+        Ajusta el stock planificado de los platos pendientes afectados por un cambio
+        
+        Calcula las necesidades antes y después de change() (por ejemplo,
+        cambiar los comensales o el rendimiento de una receta) y aplica solo
+        la diferencia. No hace commit.
+        
+        Args:
+            change: Función sin argumentos que modifica los objetos
+            **filters: Filtros de for_meal_dishes (meal_ids, dish_id...)
+        """
+        before = RequirementService.for_meal_dishes(pending_only=True, portions_only=True, **filters)
+        change()
+        db.session.flush()
+        after = RequirementService.for_meal_dishes(pending_only=True, portions_only=True, **filters)
+        delta = {
+            ingredient_id: before.get(ingredient_id, 0.0) - after.get(ingredient_id, 0.0)
+            for ingredient_id in set(before) | set(after)
+        }
+        PantryService.apply_requirements(
+            {ingredient_id: quantity for ingredient_id, quantity in delta.items() if abs(quantity) > 1e-9},
+            'add'
+        )
+
+
+class LotService:
+    """
+    Lotes del almacén (PantryLot): caducidad y consumo FEFO
+    
+    stock_actual sigue siendo el agregado que leen las vistas; este servicio
+    reparte cada entrada y salida de stock entre lotes. Un consumo es una
+    única sentencia UPDATE: la suma acumulada de cada ingrediente en orden
+    FEFO (función de ventana) decide cuánto se lleva cada lote.
+    """
+    
+    @staticmethod
+    def add_lots(entries, source, received_at=None):
+        """
+        Crea lotes con un insert multi-fila
+        
+        Cada lote va al hogar de su ingrediente, así sirve también para
+        procesos entre hogares (compras centrales).
+        
+        Args:
+            entries: Iterable de (ingredient_id, cantidad, caducidad o None);
+                sin caducidad se usa Ingredient.shelf_life_days desde hoy
+            source: Origen del lote (PantryLot.SOURCES)
+            received_at: Fecha de entrada (por defecto ahora)
+        
+        Returns:
+            int: Lotes creados
+        """
+        entries = [(ingredient_id, quantity, expires_at)
+                   for ingredient_id, quantity, expires_at in entries if quantity > 0]
+        if not entries:
+            return 0
+        received_at = received_at or datetime.utcnow()
+        table = Ingredient.__table__
+        ingredients = {
+            ingredient_id: (household_id, shelf_life_days)
+            for ingredient_id, household_id, shelf_life_days in db.session.execute(
+                select(table.c.id, table.c.household_id, table.c.shelf_life_days)
+                .where(table.c.id.in_({ingredient_id for ingredient_id, _, _ in entries})))
+        }
+        
+        rows = []
+        for ingredient_id, quantity, expires_at in entries:
+            household_id, shelf_life_days = ingredients[ingredient_id]
+            if expires_at is None and shelf_life_days:
+                expires_at = received_at.date() + timedelta(days=shelf_life_days)
+            rows.append({'household_id': household_id, 'ingredient_id': ingredient_id,
+                         'quantity': quantity, 'quantity_remaining': quantity, 'expires_at': expires_at,
+                         'source': source, 'received_at': received_at})
+        db.session.execute(PantryLot.__table__.insert(), rows)
+        return len(rows)
+    
+    @staticmethod
+    def needs_select(requirements):
+        """select (ingredient_id, quantity) con las filas de un dict de necesidades"""
+        selects = [
+            select(literal(ingredient_id).label('ingredient_id'), literal(float(quantity)).label('quantity'))
+            for ingredient_id, quantity in requirements.items()
+            if quantity > 0
+        ]
+        if not selects:
+            return None
+        return selects[0] if len(selects) == 1 else union_all(*selects)
+    
+    @staticmethod
+    def consume(needs):
+        """
+        Vacía lotes en orden FEFO con una sola sentencia UPDATE
+        
+        Cada lote queda en max(0, acumulado - necesidad), donde acumulado es
+        la suma de lo que queda en ese lote y en los que caducan antes. Los
+        lotes posteriores al que cubre la necesidad no se tocan. Si los lotes
+        no llegan se vacían todos (stock_actual sigue su propia regla).
+        
+        Args:
+            needs: select con columnas ingredient_id y quantity (por ejemplo
+                RequirementService.requirements_select o needs_select)
+        
+        Returns:
+            int: Lotes modificados
+        """
+        if needs is None:
+            return 0
+        needs = needs.subquery('needs')
+        lot = PantryLot.__table__
+        running = (
+            select(
+                lot.c.id,
+                lot.c.quantity_remaining.label('remaining'),
+                func.sum(lot.c.quantity_remaining).over(
+                    partition_by=lot.c.ingredient_id, order_by=PantryLot.fefo_order(), rows=(None, 0)
+                ).label('running'),
+                needs.c.quantity.label('need'),
+            )
+            .join(needs, needs.c.ingredient_id == lot.c.ingredient_id)
+            .where(lot.c.household_id == current_household_id(), lot.c.quantity_remaining > 0)
+            .subquery('running')
+        )
+        result = db.session.execute(
+            lot.update()
+            .where(lot.c.id == running.c.id, running.c.running - running.c.remaining < running.c.need)
+            .values(quantity_remaining=case(
+                (running.c.running <= running.c.need, 0.0),
+                else_=running.c.running - running.c.need
+            ))
+        )
+        return result.rowcount
+    
+    @staticmethod
+    def expiring(days=3, today=None, limit=None):
+        """
+        Lotes con existencias que caducan en los próximos días (o ya caducados)
+        
+        Args:
+            days: Horizonte en días desde hoy
+            today: Fecha de referencia (por defecto hoy)
+            limit: Máximo de lotes
+        
+        Returns:
+            list: Filas (id, ingredient_id, name, unit, quantity_remaining,
+                  expires_at, source), por caducidad
+        """
+        today = today or date.today()
+        stmt = (
+            select(PantryLot.id, PantryLot.ingredient_id, Ingredient.name, Ingredient.unit,
+                   PantryLot.quantity_remaining, PantryLot.expires_at, PantryLot.source)
+            .join(Ingredient, Ingredient.id == PantryLot.ingredient_id)
+            .where(PantryLot.expires_at <= today + timedelta(days=days),
+                   PantryLot.quantity_remaining > 0)
+            .order_by(PantryLot.expires_at, PantryLot.id)
+        )
+        if limit:
+            stmt = stmt.limit(limit)
+        return db.session.execute(stmt).all()
+
+
+class UnitService:
+    """Servicio para cambiar la unidad base de un ingrediente sin romper sus cantidades"""
+    
+    @staticmethod
+    def change_unit(ingredient, new_unit, auto_commit=True):
+        """
+        Cambia la unidad de un ingrediente a la base de new_unit
+        
+        Si la unidad anterior es convertible (misma dimensión) se reescalan
+        en bloque recetas, stock, formatos de compra y listas de compra. Si no
+        lo es, solo se permite el cambio cuando el ingrediente aún no tiene
+        cantidades.
+        
+        Args:
+            ingredient: Ingrediente a modificar
+            new_unit: Unidad elegida (cualquier alias: 'kg', 'litros'...)
+            auto_commit: Si True, hace commit automáticamente
+        
+        Returns:
+            float: Factor aplicado a las cantidades (1.0 si no cambia nada)
+        """
+        new_base = units.base_unit(new_unit)
+        if not new_base:
+            raise ValueError("La unidad de medida es obligatoria")
+        if ingredient.unit == new_base:
+            return 1.0
+        
+        try:
+            factor = units.convert(1.0, ingredient.unit, new_base)
+        except ValueError:
+            in_use = (
+                db.session.query(DishIngredient.query.filter_by(ingredient_id=ingredient.id).exists()).scalar()
+                or db.session.query(PantryStock.query.filter(
+                    PantryStock.ingredient_id == ingredient.id,
+                    (PantryStock.stock_actual != 0) | (PantryStock.stock_planificado != 0)
+                ).exists()).scalar()
+            )
+            if in_use:
+                raise ValueError(
+                    f"No se puede cambiar '{ingredient.name}' de {ingredient.unit} a {new_base}: "
+                    f"ya tiene recetas o stock en otra dimensión"
+                )
+            factor = 1.0
+        
+        if factor != 1.0:
+            db.session.flush()
+            connection = db.session.connection()
+            for model in (DishIngredient, DishFlatIngredient, ConsumptionDaily):
+                db.session.execute(
+                    model.__table__.update()
+                    .where(model.ingredient_id == ingredient.id)
+                    .values(quantity=model.quantity * factor)
+                )
+            db.session.execute(
+                PantryLot.__table__.update()
+                .where(PantryLot.ingredient_id == ingredient.id)
+                .values(quantity=PantryLot.quantity * factor,
+                        quantity_remaining=PantryLot.quantity_remaining * factor)
+            )
+            stock_ids = [row[0] for row in db.session.execute(
+                select(PantryStock.id).where(PantryStock.ingredient_id == ingredient.id)
+            )]
+            db.session.execute(
+                PantryStock.__table__.update()
+                .where(PantryStock.ingredient_id == ingredient.id)
+                .values(stock_actual=PantryStock.stock_actual * factor,
+                        stock_planificado=PantryStock.stock_planificado * factor)
+            )
+            item_ids = [row[0] for row in db.session.execute(
+                select(ShoppingItem.id).where(ShoppingItem.ingredient_id == ingredient.id)
+            )]
+            db.session.execute(
+                ShoppingItem.__table__.update()
+                .where(ShoppingItem.ingredient_id == ingredient.id)
+                .values(quantity_needed=ShoppingItem.quantity_needed * factor,
+                        quantity_available=ShoppingItem.quantity_available * factor,
+                        quantity_to_buy=ShoppingItem.quantity_to_buy * factor)
+            )
+            db.session.execute(
+                ProductPack.__table__.update()
+                .where(ProductPack.ingredient_id == ingredient.id)
+                .values(pack_size=ProductPack.pack_size * factor)
+            )
+            record_sync_changes(connection, 'pantry_stock', stock_ids)
+            record_sync_changes(connection, 'shopping_items', item_ids)
+            # Las filas ya cargadas en la sesión tienen los valores antiguos
+            db.session.expire_all()
+        
+        ingredient.unit = new_base
+        if auto_commit:
+            db.session.commit()
+        return factor
 
 
 class MealService:
@@ -136,7 +583,7 @@ class MealService:
     
     @staticmethod
     @staticmethod
-    def add_dish_to_meal(day_id, meal_type, dish_id, portions=1, batch_id=None, percentage=None):
+    def add_dish_to_meal(day_id, meal_type, dish_id, portions=1, batch_id=None, percentage=None, diners=None):
         """
         Añade un plato a una comida con dos modos:
         1. Porciones múltiples: portions=5, batch_id=None
@@ -148,9 +595,10 @@ class MealService:
             day_id: ID del día
             meal_type: Tipo de comida (breakfast, lunch, dinner)
             dish_id: ID del plato
-            portions: Número de porciones (default 1)
+            portions: Número de porciones (default 1; por comensal si la comida tiene comensales)
             batch_id: ID del batch si se usa un batch existente
             percentage: Porcentaje del batch a usar (si batch_id)
+            diners: Comensales de la comida (None = no cambia)
         
         Returns:
             MealDish: Relación creada
@@ -162,6 +610,9 @@ class MealService:
             if batch_id and not percentage:
                 raise ValueError("Si usas batch, debes especificar el porcentaje")
             
+            if diners is not None and diners < 1:
+                raise ValueError("Los comensales deben ser al menos 1")
+            
             day = Day.query.get_or_404(day_id)
             dish = Dish.query.get_or_404(dish_id)
             
@@ -176,24 +627,9 @@ class MealService:
             if meal.special_type:
                 meal.special_type = None
             
-            # Descontar del stock PLANIFICADO según el modo
-            if batch_id:
-                # Modo batch: usar porcentaje (los ingredientes ya se descontaron al crear el batch)
-                # Solo actualizamos stock_planificado por el porcentaje usado
-                for di in dish.ingredients:
-                    quantity_needed = di.quantity * (percentage / 100.0)
-                    # Ya no se descuenta porque se hizo al crear el batch
-                    # Este registro es solo informativo
-            else:
-                # Modo porciones: descontar según número de porciones
-                for di in dish.ingredients:
-                    quantity_needed = di.quantity * portions
-                    PantryService.update_stock_planificado(
-                        di.ingredient_id, 
-                        quantity_needed, 
-                        operation='subtract',
-                        auto_commit=False
-                    )
+            # Cambiar comensales reescala lo ya planificado en la comida
+            if diners is not None and diners != meal.diners:
+                MealService._set_diners(meal, diners)
             
             # Obtener el siguiente orden
             max_order = db.session.query(func.max(MealDish.order)).filter_by(meal_id=meal.id).scalar() or -1
@@ -208,6 +644,14 @@ class MealService:
                 order=max_order + 1
             )
             db.session.add(meal_dish)
+            db.session.flush()
+            
+            # Modo porciones: descontar del stock PLANIFICADO (escalado por comensales).
+            # Modo batch: los ingredientes ya se descontaron al crear el batch
+            if not batch_id:
+                PantryService.apply_requirements(
+                    RequirementService.for_meal_dishes(meal_dish_ids=[meal_dish.id]), 'subtract'
+                )
             db.session.commit()
             
             return meal_dish
@@ -241,15 +685,9 @@ class MealService:
                         batch.percentage_remaining += meal_dish.percentage
             else:
                 # Modo porciones: devolver al stock planificado
-                portions = meal_dish.portions
-                for di in dish.ingredients:
-                    quantity = di.quantity * portions
-                    PantryService.update_stock_planificado(
-                        di.ingredient_id,
-                        quantity,
-                        operation='add',
-                        auto_commit=False
-                    )
+                PantryService.apply_requirements(
+                    RequirementService.for_meal_dishes(meal_dish_ids=[meal_dish.id]), 'add'
+                )
             
             db.session.delete(meal_dish)
             db.session.commit()
@@ -272,7 +710,7 @@ class MealService:
             dish = batch.dish
             
             # Descontar ingredientes del plato completo
-            for di in dish.ingredients:
+            for di in dish.flat_ingredients:
                 PantryService.update_stock_planificado(
                     di.ingredient_id,
                     di.quantity,
@@ -311,33 +749,22 @@ class MealService:
                 db.session.commit()
                 return meal
             
-            # Descontar del stock ACTUAL
-            for meal_dish in meal.meal_dishes:
-                dish = meal_dish.dish
-                portions = meal_dish.portions
-                
-                for di in dish.ingredients:
-                    quantity = di.quantity * portions
-                    try:
-                        PantryService.update_stock_actual(
-                            di.ingredient_id,
-                            quantity,
-                            operation='subtract',
-                            auto_commit=False
-                        )
-                    except StockError as e:
-                        # Si no hay stock actual suficiente, aún así permitir confirmar
-                        # (ya cocinaste, aunque no tenías stock registrado)
-                        ingredient = Ingredient.query.get(di.ingredient_id)
-                        print(f"⚠️  Advertencia: {e}. Se permite confirmar de todas formas.")
-                        # Forzar stock actual a 0
-                        stock = PantryStock.query.filter_by(ingredient_id=di.ingredient_id).first()
-                        stock.stock_actual = 0
+            # Descontar del stock ACTUAL (si no hay suficiente, se deja a 0:
+            # ya cocinaste, aunque no tenías stock registrado)
+            PantryService.apply_requirements(
+                RequirementService.for_meal_dishes(meal_ids=[meal.id]), 'subtract', actual=True
+            )
+            # Y de los lotes, primero los que caducan antes (un solo UPDATE)
+            LotService.consume(RequirementService.requirements_select(meal_ids=[meal.id]))
             
             # Marcar como confirmada
             meal.confirmed = True
             meal.confirmed_at = datetime.utcnow()
             
+            # Historial de consumo del día
+            db.session.flush()
+            ConsumptionService.rebuild(meal.day.date, meal.day.date)
+            
             db.session.commit()
             return meal
             
@@ -364,24 +791,21 @@ class MealService:
                 raise ValueError("Esta comida no está confirmada")
             
             if not meal.is_special:
-                # Devolver al stock ACTUAL
-                for meal_dish in meal.meal_dishes:
-                    dish = meal_dish.dish
-                    portions = meal_dish.portions
-                    
-                    for di in dish.ingredients:
-                        quantity = di.quantity * portions
-                        PantryService.update_stock_actual(
-                            di.ingredient_id,
-                            quantity,
-                            operation='add',
-                            auto_commit=False
-                        )
+                # Devolver al stock ACTUAL, como lotes nuevos
+                requirements = RequirementService.for_meal_dishes(meal_ids=[meal.id])
+                PantryService.apply_requirements(requirements, 'add', actual=True)
+                LotService.add_lots(
+                    [(ingredient_id, quantity, None) for ingredient_id, quantity in requirements.items()], 'return'
+                )
             
             # Desmarcar confirmación
             meal.confirmed = False
             meal.confirmed_at = None
             
+            if not meal.is_special:
+                db.session.flush()
+                ConsumptionService.rebuild(meal.day.date, meal.day.date)
+            
             db.session.commit()
             
         except ValueError as e:
@@ -409,19 +833,10 @@ class MealService:
             
             if meal:
                 # Devolver stock de todos los platos
+                PantryService.apply_requirements(
+                    RequirementService.for_meal_dishes(meal_ids=[meal.id]), 'add'
+                )
                 for meal_dish in meal.meal_dishes:
-                    dish = meal_dish.dish
-                    portions = meal_dish.portions
-                    
-                    for di in dish.ingredients:
-                        quantity = di.quantity * portions
-                        PantryService.update_stock_planificado(
-                            di.ingredient_id,
-                            quantity,
-                            operation='add',
-                            auto_commit=False
-                        )
-                    
                     db.session.delete(meal_dish)
                 
                 meal.special_type = special_type
@@ -447,127 +862,2746 @@ class MealService:
             
             if meal:
                 # Devolver stock de todos los platos
-                for meal_dish in meal.meal_dishes:
-                    dish = meal_dish.dish
-                    portions = meal_dish.portions
-                    
-                    for di in dish.ingredients:
-                        quantity = di.quantity * portions
-                        PantryService.update_stock_planificado(
-                            di.ingredient_id,
-                            quantity,
-                            operation='add',
-                            auto_commit=False
-                        )
-                
+                PantryService.apply_requirements(
+                    RequirementService.for_meal_dishes(meal_ids=[meal.id]), 'add'
+                )
                 db.session.delete(meal)
                 db.session.commit()
         except Exception as e:
             db.session.rollback()
             raise Exception(f"Error al eliminar comida: {str(e)}")
-
-
-class ShoppingListService:
-    """Servicio para generación de listas de compra"""
     
     @staticmethod
-    def generate_shopping_list_from_stock(name=None):
+    def _set_diners(meal, diners):
+        """Cambia los comensales reescalando el stock planificado de sus platos (sin commit)"""
+        def change():
+            meal.diners = diners
+        RequirementService.replan(change, meal_ids=[meal.id])
+    
+    @staticmethod
+    def set_diners(meal_id, diners):
         """
-        Genera lista de compra basándose en ingredientes con stock_planificado NEGATIVO
-        (stock negativo = hay que comprar)
+        Fija los comensales de una comida (None = sin escalar)
+        
+        Las necesidades de sus platos pasan a ser receta × porciones ×
+        comensales / rendimiento; el stock planificado se ajusta con la
+        diferencia.
         
         Args:
-            name: Nombre personalizado para la lista
-            
-        Returns:
-            ShoppingList: Lista de compra generada
+            meal_id: ID de la comida
+            diners: Número de comensales o None
         """
-        # Obtener todos los stocks con planificado negativo
-        negative_stocks = PantryStock.query.filter(PantryStock.stock_planificado < 0).all()
-        
-        if not negative_stocks:
-            raise ValueError("No hay ingredientes que comprar. Stock planificado suficiente.")
-        
-        # Crear lista
-        if name is None:
-            name = f"Lista de Compra - {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-        
-        shopping_list = ShoppingList(
-            name=name,
-            start_date=datetime.now().date(),
-            end_date=datetime.now().date() + timedelta(days=7),
-            completed=False
-        )
-        db.session.add(shopping_list)
-        db.session.flush()
+        try:
+            meal = Meal.query.get_or_404(meal_id)
+            if meal.confirmed:
+                raise ValueError("No se pueden cambiar los comensales de una comida confirmada")
+            if diners is not None and diners < 1:
+                raise ValueError("Los comensales deben ser al menos 1")
+            MealService._set_diners(meal, diners)
+            db.session.commit()
+            return meal
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al cambiar comensales: {str(e)}")
+    
+    @staticmethod
+    def update_meal_dish(meal_dish_id, dish_id, portions):
+        """
+        Cambia el plato o las porciones de un MealDish pendiente
         
-        # Crear items
-        for stock in negative_stocks:
-            quantity_to_buy = abs(stock.stock_planificado)  # Convertir negativo a positivo
+        Devuelve al planificado lo que descontaba (si no era batch), lo pasa
+        a modo porciones y descuenta lo nuevo.
+        """
+        try:
+            if portions < 1:
+                raise ValueError("Las porciones deben ser al menos 1")
+            meal_dish = MealDish.query.get_or_404(meal_dish_id)
+            if meal_dish.meal.confirmed:
+                raise ValueError("No se puede editar un plato de una comida ya confirmada")
+            Dish.query.get_or_404(dish_id)
             
-            item = ShoppingItem(
-                shopping_list_id=shopping_list.id,
-                ingredient_id=stock.ingredient_id,
-                quantity_needed=quantity_to_buy,  # Lo que falta
-                quantity_available=stock.stock_actual,  # Lo que tienes
-                quantity_to_buy=quantity_to_buy,
-                purchased=False
+            PantryService.apply_requirements(
+                RequirementService.for_meal_dishes(meal_dish_ids=[meal_dish.id], portions_only=True), 'add'
             )
-            db.session.add(item)
-        
-        db.session.commit()
-        return shopping_list
+            meal_dish.dish_id = dish_id
+            meal_dish.portions = portions
+            meal_dish.batch_id = None  # Resetear batch al editar
+            meal_dish.percentage = None
+            db.session.flush()
+            PantryService.apply_requirements(
+                RequirementService.for_meal_dishes(meal_dish_ids=[meal_dish.id]), 'subtract'
+            )
+            db.session.commit()
+            return meal_dish
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al editar plato: {str(e)}")
     
     @staticmethod
-    def complete_shopping_list(shopping_list_id):
+    def set_base_yield(dish, base_yield):
         """
-        Marca lista como completada y añade ingredientes al stock ACTUAL y PLANIFICADO
+        Cambia las raciones que salen de una receta (sin commit)
         
-        Args:
-            shopping_list_id: ID de la lista
+        Afecta a las comidas pendientes del plato con comensales y a las de
+        todos los platos que lo usan como componente (su receta aplanada se
+        divide por este rendimiento); el stock planificado se ajusta con la
+        diferencia.
         """
-        shopping_list = ShoppingList.query.get_or_404(shopping_list_id)
-        
-        for item in shopping_list.items:
-            if not item.purchased:
-                # Añadir al stock actual Y planificado
-                PantryService.update_stock_actual(
-                    item.ingredient_id,
-                    item.quantity_to_buy,
-                    operation='add',
-                    auto_commit=False
-                )
-                item.purchased = True
+        if base_yield < 1:
+            raise ValueError("El rendimiento de la receta debe ser al menos 1 ración")
+        if base_yield == dish.base_yield:
+            return
         
-        shopping_list.completed = True
-        db.session.commit()
+        def change():
+            dish.base_yield = base_yield
+        dish_ids = recipes.ancestors(db.session.connection(), [dish.id], dish.household_id)
+        RequirementService.replan(change, dish_ids=dish_ids)
 
 
-class CalendarService:
-    """Servicio para gestión del calendario"""
+class BatchAllocationService:
+    """
+    Servicio de asignación automática de batches (FIFO)
+    
+    Dado un plato y un porcentaje, consume primero los batches más antiguos
+    repartiendo entre varios si hace falta. Las filas de batch se bloquean
+    (SELECT ... FOR UPDATE) siempre en orden de id para que dos asignaciones
+    concurrentes no se bloqueen mutuamente.
+    """
+    
+    EPSILON = 1e-6  # Tolerancia para restos de coma flotante
     
     @staticmethod
-    def get_or_create_day(date):
-        """Obtiene o crea un día en el calendario"""
-        day = Day.query.filter_by(date=date).first()
-        if not day:
-            day = Day(date=date)
-            db.session.add(day)
-            
-            # Crear las 3 comidas vacías
-            for meal_type in Meal.MEAL_TYPES:
-                meal = Meal(day=day, meal_type=meal_type)
-                db.session.add(meal)
-            
-            db.session.commit()
-        return day
+    def _load_batches(dish_ids, lock=True):
+        """
+        Carga los batches disponibles de varios platos en una sola consulta
+        
+        Returns:
+            dict: dish_id -> [DishBatch] en orden FIFO (preparación, id)
+        """
+        query = DishBatch.query.filter(
+            DishBatch.dish_id.in_(dish_ids),
+            DishBatch.available_filter()
+        ).order_by(DishBatch.id)
+        if lock:
+            query = query.with_for_update()
+        
+        by_dish = {}
+        for batch in query.all():
+            by_dish.setdefault(batch.dish_id, []).append(batch)
+        for batches in by_dish.values():
+            batches.sort(key=lambda b: (b.preparation_date, b.id))
+        return by_dish
     
     @staticmethod
-    def get_week_days(start_date):
-        """Obtiene o crea 7 días consecutivos desde start_date"""
-        days = []
-        for i in range(7):
-            current_date = start_date + timedelta(days=i)
-            day = CalendarService.get_or_create_day(current_date)
-            days.append(day)
-        return days
+    def _draw(batches, percentage, remaining):
+        """
+        Reparte un porcentaje entre batches FIFO sin modificar nada
+        
+        Args:
+            batches: Batches del plato en orden FIFO
+            percentage: Porcentaje a consumir
+            remaining: dict batch_id -> porcentaje aún libre (se actualiza)
+        
+        Returns:
+            tuple: (lista de (batch, porcentaje), porcentaje que falta)
+        """
+        allocations = []
+        pending = percentage
+        for batch in batches:
+            if pending <= BatchAllocationService.EPSILON:
+                break
+            available = remaining.get(batch.id, batch.percentage_remaining)
+            if available <= BatchAllocationService.EPSILON:
+                continue
+            used = min(available, pending)
+            allocations.append((batch, used))
+            pending -= used
+        
+        shortfall = pending if pending > BatchAllocationService.EPSILON else 0.0
+        if not shortfall:
+            for batch, used in allocations:
+                remaining[batch.id] = remaining.get(batch.id, batch.percentage_remaining) - used
+        return allocations, shortfall
+    
+    @staticmethod
+    def _add_batch_meal_dishes(meal, dish_id, allocations):
+        """Crea un MealDish en modo batch por cada batch usado y descuenta el batch"""
+        max_order = db.session.query(func.max(MealDish.order)).filter_by(meal_id=meal.id).scalar()
+        next_order = (max_order if max_order is not None else -1) + 1
+        
+        meal_dishes = []
+        for batch, used in allocations:
+            batch.percentage_remaining = max(0.0, batch.percentage_remaining - used)
+            meal_dish = MealDish(
+                meal_id=meal.id,
+                dish_id=dish_id,
+                portions=1,
+                batch_id=batch.id,
+                percentage=used,
+                order=next_order
+            )
+            db.session.add(meal_dish)
+            meal_dishes.append(meal_dish)
+            next_order += 1
+        return meal_dishes
+    
+    @staticmethod
+    def _get_or_create_meal(day_id, meal_type):
+        meal = Meal.query.filter_by(day_id=day_id, meal_type=meal_type).first()
+        if not meal:
+            meal = Meal(day_id=day_id, meal_type=meal_type)
+            db.session.add(meal)
+            db.session.flush()
+        # Un plato sustituye a cualquier opción especial
+        meal.special_type = None
+        return meal
+    
+    @staticmethod
+    def validate_percentage(value):
+        """Porcentaje pedido como float; ValueError si no es un número finito mayor que 0"""
+        try:
+            percentage = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Porcentaje no válido: {value}") from None
+        if not math.isfinite(percentage) or percentage <= 0:
+            raise ValueError("El porcentaje debe ser un número mayor que 0")
+        return percentage
+    
+    @staticmethod
+    def validate_meal_type(meal_type):
+        """ValueError si el tipo de comida no es uno de Meal.MEAL_TYPES"""
+        if meal_type not in Meal.MEAL_TYPES:
+            raise ValueError(f"Tipo de comida no válido: {meal_type}")
+        return meal_type
+    
+    @staticmethod
+    def preview(dish_id, percentage):
+        """
+        Calcula qué batches se usarían, sin bloquear ni modificar nada
+        
+        Returns:
+            dict: {'allocations': [{'batch_id', 'percentage'}], 'shortfall': float}
+        """
+        percentage = BatchAllocationService.validate_percentage(percentage)
+        batches = BatchAllocationService._load_batches([dish_id], lock=False).get(dish_id, [])
+        allocations, shortfall = BatchAllocationService._draw(batches, percentage, {})
+        return {
+            'allocations': [{'batch_id': b.id, 'percentage': used} for b, used in allocations],
+            'shortfall': shortfall,
+        }
+    
+    @staticmethod
+    def assign_to_meal(day_id, meal_type, dish_id, percentage):
+        """
+        Asigna un plato a una comida consumiendo batches FIFO
+        
+        Args:
+            day_id: ID del día
+            meal_type: Tipo de comida
+            dish_id: ID del plato
+            percentage: Porcentaje total a usar (puede repartirse entre batches)
+        
+        Returns:
+            list: [(batch_id, porcentaje)] usados, del más antiguo al más nuevo
+        """
+        try:
+            percentage = BatchAllocationService.validate_percentage(percentage)
+            BatchAllocationService.validate_meal_type(meal_type)
+            
+            Day.query.get_or_404(day_id)
+            batches = BatchAllocationService._load_batches([dish_id]).get(dish_id, [])
+            allocations, shortfall = BatchAllocationService._draw(batches, percentage, {})
+            
+            if shortfall:
+                available = percentage - shortfall
+                raise ValueError(
+                    f"No hay suficiente en los batches de este plato. "
+                    f"Disponible: {available:.0f}%, pedido: {percentage:.0f}%"
+                )
+            
+            meal = BatchAllocationService._get_or_create_meal(day_id, meal_type)
+            BatchAllocationService._add_batch_meal_dishes(meal, dish_id, allocations)
+            db.session.commit()
+            return [(batch.id, used) for batch, used in allocations]
+        
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al asignar batches: {str(e)}")
+    
+    @staticmethod
+    def _validate_request(request_data):
+        """Comprueba una petición de plan_allocations y normaliza su porcentaje"""
+        if not isinstance(request_data, dict):
+            raise ValueError("Cada petición debe ser un objeto")
+        required = ('day_id', 'meal_type', 'dish_id', 'percentage')
+        missing_fields = [f for f in required if not request_data.get(f)]
+        if missing_fields:
+            raise ValueError(f"Faltan campos en la petición: {', '.join(missing_fields)}")
+        BatchAllocationService.validate_meal_type(request_data['meal_type'])
+        percentage = BatchAllocationService.validate_percentage(request_data['percentage'])
+        return dict(request_data, percentage=percentage)
+    
+    @staticmethod
+    def plan_allocations(requests, apply=False):
+        """
+        Planifica en una sola pasada las asignaciones de batches de varias comidas
+        
+        Carga (y bloquea, si apply=True) todos los batches de los platos
+        implicados con una única consulta. Las peticiones se atienden en orden
+        de fecha, así las comidas más tempranas usan los batches más antiguos.
+        Una petición que no puede cubrirse entera no consume nada y se
+        informa con su déficit.
+        
+        Args:
+            requests: Lista de dicts {'day_id', 'meal_type', 'dish_id', 'percentage'}
+            apply: Si True crea los MealDish y descuenta los batches
+        
+        Returns:
+            list: Por petición {'day_id', 'meal_type', 'dish_id', 'percentage',
+                  'allocations': [{'batch_id', 'percentage'}], 'shortfall'}
+        """
+        try:
+            requests = [BatchAllocationService._validate_request(r) for r in requests]
+            
+            day_ids = {r['day_id'] for r in requests}
+            dates = dict(db.session.query(Day.id, Day.date).filter(Day.id.in_(day_ids)).all())
+            missing = day_ids - set(dates)
+            if missing:
+                raise ValueError(f"Días inexistentes: {sorted(missing)}")
+            
+            dish_ids = {r['dish_id'] for r in requests}
+            batches_by_dish = BatchAllocationService._load_batches(dish_ids, lock=apply)
+            
+            meal_order = {meal_type: i for i, meal_type in enumerate(Meal.MEAL_TYPES)}
+            ordered = sorted(
+                requests,
+                key=lambda r: (dates[r['day_id']], meal_order.get(r['meal_type'], len(meal_order)))
+            )
+            
+            remaining = {}
+            results = []
+            for request_data in ordered:
+                allocations, shortfall = BatchAllocationService._draw(
+                    batches_by_dish.get(request_data['dish_id'], []),
+                    request_data['percentage'],
+                    remaining
+                )
+                if shortfall:
+                    allocations = []
+                elif apply:
+                    meal = BatchAllocationService._get_or_create_meal(
+                        request_data['day_id'], request_data['meal_type']
+                    )
+                    BatchAllocationService._add_batch_meal_dishes(
+                        meal, request_data['dish_id'], allocations
+                    )
+                
+                results.append({
+                    'day_id': request_data['day_id'],
+                    'meal_type': request_data['meal_type'],
+                    'dish_id': request_data['dish_id'],
+                    'percentage': request_data['percentage'],
+                    'allocations': [{'batch_id': b.id, 'percentage': used} for b, used in allocations],
+                    'shortfall': shortfall,
+                })
+            
+            if apply:
+                db.session.commit()
+            return results
+        
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al planificar batches: {str(e)}")
+
+
+class BatchExpiryService:
+    """Servicio de caducidad de batches: barrido periódico del desperdicio"""
+    
+    @staticmethod
+    def sweep_expired(now=None):
+        """
+        Da por perdidos los batches caducados que aún tenían porcentaje libre
+        
+        En una sola transacción:
+        1. Registra el desperdicio (BatchWaste) de cada batch caducado
+        2. Devuelve al stock planificado los ingredientes de la parte no usada
+           (se descontaron al 100% al crear el batch y ya nunca se consumirán)
+        3. Pone a 0 el porcentaje restante con un único UPDATE
+        
+        Las comidas futuras sin confirmar que ya tenían porciones de esos
+        batches no se tocan; se devuelven para poder avisar y replanificar.
+        
+        Args:
+            now: Instante de referencia (por defecto, ahora en UTC)
+        
+        Returns:
+            dict: {'batches': int, 'wasted_percentage': float, 'affected_meal_ids': [int]}
+        """
+        now = now or datetime.utcnow()
+        try:
+            expired = db.session.execute(
+                select(DishBatch.id, DishBatch.dish_id, DishBatch.percentage_remaining, DishBatch.expires_at)
+                .where(
+                    DishBatch.expires_at.is_not(None),
+                    DishBatch.expires_at <= now,
+                    DishBatch.percentage_remaining > 0
+                )
+                .order_by(DishBatch.id)
+                .with_for_update()
+            ).all()
+            
+            if not expired:
+                return {'batches': 0, 'wasted_percentage': 0.0, 'affected_meal_ids': []}
+            
+            batch_ids = [row.id for row in expired]
+            
+            db.session.execute(BatchWaste.__table__.insert(), [
+                {'batch_id': row.id, 'dish_id': row.dish_id,
+                 'percentage_wasted': row.percentage_remaining,
+                 'expired_at': row.expires_at, 'recorded_at': now}
+                for row in expired
+            ])
+            
+            # Fracción de plato no usada por plato, y de ahí por ingrediente
+            unused_by_dish = {}
+            for row in expired:
+                unused_by_dish[row.dish_id] = unused_by_dish.get(row.dish_id, 0.0) + row.percentage_remaining / 100.0
+            
+            released = {}
+            for dish_id, ingredient_id, quantity in db.session.execute(
+                select(DishFlatIngredient.dish_id, DishFlatIngredient.ingredient_id, DishFlatIngredient.quantity)
+                .where(DishFlatIngredient.dish_id.in_(unused_by_dish.keys()))
+            ):
+                released[ingredient_id] = released.get(ingredient_id, 0.0) + quantity * unused_by_dish[dish_id]
+            
+            for ingredient_id, quantity in released.items():
+                PantryService.update_stock_planificado(
+                    ingredient_id, quantity, operation='add', auto_commit=False
+                )
+            
+            db.session.execute(
+                DishBatch.__table__.update()
+                .where(DishBatch.__table__.c.id.in_(batch_ids))
+                .values(percentage_remaining=0.0)
+            )
+            record_sync_changes(db.session.connection(), 'dish_batches', batch_ids)
+            
+            # Comidas sin confirmar, posteriores a la caducidad, que contaban con el batch
+            expires_by_batch = {row.id: row.expires_at.date() for row in expired}
+            affected_meal_ids = sorted({
+                meal_id for meal_id, batch_id, meal_date in db.session.execute(
+                    select(MealDish.meal_id, MealDish.batch_id, Day.date)
+                    .join(Meal, Meal.id == MealDish.meal_id)
+                    .join(Day, Day.id == Meal.day_id)
+                    .where(MealDish.batch_id.in_(batch_ids), Meal.confirmed.is_(False))
+                )
+                if meal_date >= expires_by_batch[batch_id]
+            })
+            
+            db.session.commit()
+            
+            return {
+                'batches': len(expired),
+                'wasted_percentage': sum(row.percentage_remaining for row in expired),
+                'affected_meal_ids': affected_meal_ids,
+            }
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al barrer batches caducados: {str(e)}")
+
+
+class FeasibilityService:
+    """Servicio para saber qué platos se pueden cocinar ahora y cuántas porciones"""
+    
+    @staticmethod
+    def load_stock_vector():
+        """
+        Stock actual de todos los ingredientes en una sola consulta
+        
+        Returns:
+            dict: ingredient_id -> stock_actual (los negativos cuentan como 0)
+        """
+        return {
+            ingredient_id: max(stock or 0.0, 0.0)
+            for ingredient_id, stock in db.session.execute(
+                select(PantryStock.ingredient_id, PantryStock.stock_actual)
+            )
+        }
+    
+    @staticmethod
+    def load_requirement_matrix(meal_type=None):
+        """
+        Matriz dispersa plato × ingrediente con las cantidades de cada receta
+        
+        Args:
+            meal_type: Si se indica, solo platos aptos para ese tipo de comida
+        
+        Returns:
+            dict: dish_id -> {'name': str, 'meal_types': set,
+                              'requirements': {ingredient_id: cantidad}}
+        """
+        stmt = (
+            select(Dish.id, Dish.name, Dish.meal_types,
+                   DishFlatIngredient.ingredient_id, DishFlatIngredient.quantity)
+            .join(DishFlatIngredient, DishFlatIngredient.dish_id == Dish.id)
+        )
+        if meal_type:
+            stmt = stmt.where(Dish.meal_type_filter(meal_type))
+        
+        matrix = {}
+        for dish_id, name, meal_types, ingredient_id, quantity in db.session.execute(stmt):
+            entry = matrix.get(dish_id)
+            if entry is None:
+                entry = matrix[dish_id] = {
+                    'name': name,
+                    'meal_types': {t for t in (meal_types or '').split(',') if t},
+                    'requirements': {},
+                }
+            entry['requirements'][ingredient_id] = quantity
+        return matrix
+    
+    @staticmethod
+    def max_portions(requirements, stock):
+        """
+        Porciones completas que permite el stock: mínimo de stock/cantidad
+        
+        Returns:
+            tuple: (porciones, id del ingrediente limitante)
+        """
+        best, limiting = None, None
+        for ingredient_id, quantity in requirements.items():
+            portions = int(stock.get(ingredient_id, 0.0) // quantity)
+            if best is None or portions < best:
+                best, limiting = portions, ingredient_id
+                if best == 0:
+                    break
+        return best or 0, limiting
+    
+    @staticmethod
+    def feasible_dishes(meal_type=None, min_portions=1, limit=None):
+        """
+        Calcula, para todo el catálogo, las porciones que se pueden cocinar ya
+        
+        Dos consultas (vector de stock y matriz de recetas) y una pasada en
+        memoria, sin cargar objetos ORM por plato.
+        
+        Args:
+            meal_type: Filtra por tipo de comida (breakfast, lunch, dinner)
+            min_portions: Descarta platos con menos porciones posibles
+            limit: Máximo de resultados
+        
+        Returns:
+            list: [{'dish_id', 'name', 'portions', 'limiting_ingredient_id'}]
+                  ordenados de más a menos porciones
+        """
+        stock = FeasibilityService.load_stock_vector()
+        matrix = FeasibilityService.load_requirement_matrix(meal_type)
+        
+        results = []
+        for dish_id, entry in matrix.items():
+            portions, limiting = FeasibilityService.max_portions(entry['requirements'], stock)
+            if portions >= min_portions:
+                results.append({
+                    'dish_id': dish_id,
+                    'name': entry['name'],
+                    'portions': portions,
+                    'limiting_ingredient_id': limiting,
+                })
+        
+        results.sort(key=lambda r: (-r['portions'], r['name']))
+        return results[:limit] if limit else results
+
+
+class PlannerService:
+    """
+    Planificador automático de comidas
+    
+    Rellena los huecos vacíos de un rango de fechas eligiendo platos que
+    aprovechen el stock planificado disponible y los batches abiertos, de
+    forma que generate_shopping_list_from_stock tenga que comprar lo menos
+    posible.
+    
+    El núcleo (optimize) trabaja sobre diccionarios planos, sin base de
+    datos: primero un voraz por orden cronológico y después búsqueda local
+    (sustituir el plato de un hueco) mientras quede presupuesto de tiempo.
+    """
+    
+    ITEM_COST = 1.0  # Coste por ingrediente que pasa a necesitar compra
+    STOCK_REWARD = 0.25  # Premio por receta completa cubierta con stock
+    PREFERENCE_WEIGHT = 0.5  # Peso de las preferencias del usuario
+    BATCH_PERCENTAGE = 50.0  # Porcentaje de batch que ocupa una comida
+    TIME_BUDGET = 0.5  # Segundos por defecto para la búsqueda local
+    SAMPLE_SIZE = 8  # Candidatos probados por iteración de búsqueda local
+    
+    # ---------- Núcleo puro ----------
+    
+    @staticmethod
+    def _ingredient_cost(consumed, available, ref):
+        """Coste de consumir `consumed` de un ingrediente con `available` en stock"""
+        cost = 0.0
+        if consumed > available + 1e-9:
+            cost += PlannerService.ITEM_COST + (consumed - available) / ref
+        cost -= PlannerService.STOCK_REWARD * min(consumed, available) / ref
+        return cost
+    
+    @staticmethod
+    def _delta(requirements, consumption, available, refs, sign=1):
+        """Variación de coste al añadir (sign=1) o quitar (sign=-1) una receta"""
+        cost = PlannerService._ingredient_cost
+        delta = 0.0
+        for ingredient_id, quantity in requirements:
+            current = consumption.get(ingredient_id, 0.0)
+            stock = available.get(ingredient_id, 0.0)
+            ref = refs[ingredient_id]
+            delta += cost(current + sign * quantity, stock, ref) - cost(current, stock, ref)
+        return delta
+    
+    @staticmethod
+    def _apply(requirements, consumption, sign=1):
+        for ingredient_id, quantity in requirements:
+            consumption[ingredient_id] = consumption.get(ingredient_id, 0.0) + sign * quantity
+    
+    @staticmethod
+    def _allowed(dish_id, slot_date, uses, max_repeats, min_gap_days):
+        """Comprueba las restricciones de repetición de un plato en una fecha"""
+        dates = uses.get(dish_id, ())
+        if len(dates) >= max_repeats:
+            return False
+        return all(abs((slot_date - used).days) >= min_gap_days for used in dates)
+    
+    @staticmethod
+    def optimize(slots, dishes, stock, batches=None, preferences=None, planned=None,
+                 max_repeats=2, min_gap_days=2, time_budget=None, seed=0):
+        """
+        Elige un plato para cada hueco minimizando la compra
+        
+        Args:
+            slots: Lista de (fecha, meal_type) a rellenar
+            dishes: dict dish_id -> {'meal_types': set, 'requirements': {ingredient_id: cantidad}}
+                    (meal_types vacío = sirve para cualquier comida)
+            stock: dict ingredient_id -> stock disponible (stock_planificado)
+            batches: dict dish_id -> [[porcentaje libre, caducidad o None]] en orden FEFO
+            preferences: dict dish_id -> peso (positivo = preferido, negativo = evitar)
+            planned: Lista de (fecha, dish_id) ya planificados (cuentan para las repeticiones)
+            max_repeats: Veces máximas que se repite un plato en el rango
+            min_gap_days: Días mínimos entre dos usos del mismo plato
+            time_budget: Segundos para la búsqueda local (None = TIME_BUDGET)
+            seed: Semilla del generador aleatorio (resultados reproducibles)
+        
+        Returns:
+            dict: {'assignments': {(fecha, meal_type): (dish_id, 'batch'|'cook', porcentaje)},
+                   'unfilled': [(fecha, meal_type)], 'purchases': {ingredient_id: cantidad},
+                   'cost': float, 'iterations': int}
+        """
+        started = time.perf_counter()
+        budget = PlannerService.TIME_BUDGET if time_budget is None else time_budget
+        preferences = preferences or {}
+        weight = PlannerService.PREFERENCE_WEIGHT
+        available = {i: max(q or 0.0, 0.0) for i, q in stock.items()}
+        slots = sorted(slots, key=lambda s: (s[0], PlannerService._meal_rank(s[1])))
+        
+        # Matriz dispersa: lista de (ingrediente, cantidad) por plato
+        recipes = {d: tuple(entry['requirements'].items()) for d, entry in dishes.items()
+                   if entry['requirements'] and preferences.get(d, 0) is not None}
+        refs = {}
+        for requirements in recipes.values():
+            for ingredient_id, quantity in requirements:
+                refs[ingredient_id] = max(refs.get(ingredient_id, 0.0), quantity)
+        by_ingredient = {}
+        for dish_id, requirements in recipes.items():
+            for ingredient_id, _ in requirements:
+                by_ingredient.setdefault(ingredient_id, []).append(dish_id)
+        by_meal_type = {
+            meal_type: [d for d in recipes
+                        if not dishes[d]['meal_types'] or meal_type in dishes[d]['meal_types']]
+            for meal_type in {s[1] for s in slots}
+        }
+        
+        assignments = {}
+        uses = {}
+        for planned_date, dish_id in planned or ():
+            uses.setdefault(dish_id, []).append(planned_date)
+        consumption = {}
+        
+        # 1. Batches abiertos: coste cero, se usan antes de que caduquen
+        remaining = {d: [list(b) for b in entries] for d, entries in (batches or {}).items()}
+        for slot in slots:
+            slot_date, meal_type = slot
+            best = None
+            for dish_id, entries in remaining.items():
+                meal_types = dishes.get(dish_id, {}).get('meal_types')
+                if (meal_types and meal_type not in meal_types) or preferences.get(dish_id, 0) is None:
+                    continue
+                usable = [b for b in entries if b[0] > 1e-6 and (b[1] is None or b[1] > slot_date)]
+                if not usable or not PlannerService._allowed(dish_id, slot_date, uses,
+                                                             max_repeats, min_gap_days):
+                    continue
+                expiry = min((b[1] for b in usable if b[1] is not None), default=date.max)
+                key = (expiry, -(preferences.get(dish_id) or 0))
+                if best is None or key < best[0]:
+                    best = (key, dish_id, usable)
+            if best is None:
+                continue
+            _, dish_id, usable = best
+            wanted = PlannerService.BATCH_PERCENTAGE
+            used = 0.0
+            for batch in usable:
+                take = min(batch[0], wanted - used)
+                batch[0] -= take
+                used += take
+                if used >= wanted - 1e-6:
+                    break
+            assignments[slot] = (dish_id, 'batch', used)
+            uses.setdefault(dish_id, []).append(slot_date)
+        
+        # 2. Voraz: coste marginal de cada plato, recalculado solo para los
+        #    platos que comparten ingrediente con el último elegido
+        marginal = {d: PlannerService._delta(r, consumption, available, refs) - weight * (preferences.get(d) or 0)
+                    for d, r in recipes.items()}
+        for slot in slots:
+            if slot in assignments:
+                continue
+            slot_date, meal_type = slot
+            best_id, best_cost = None, None
+            for dish_id in by_meal_type[meal_type]:
+                cost = marginal[dish_id]
+                if best_cost is not None and cost >= best_cost:
+                    continue
+                if PlannerService._allowed(dish_id, slot_date, uses, max_repeats, min_gap_days):
+                    best_id, best_cost = dish_id, cost
+            if best_id is None:
+                continue
+            assignments[slot] = (best_id, 'cook', None)
+            uses.setdefault(best_id, []).append(slot_date)
+            PlannerService._apply(recipes[best_id], consumption)
+            touched = {d for i, _ in recipes[best_id] for d in by_ingredient[i]}
+            for dish_id in touched:
+                marginal[dish_id] = (PlannerService._delta(recipes[dish_id], consumption, available, refs)
+                                     - weight * (preferences.get(dish_id) or 0))
+        
+        # 3. Búsqueda local: sustituir el plato de un hueco si baja el coste
+        rng = random.Random(seed)
+        cooked = [slot for slot, (_, mode, _) in assignments.items() if mode == 'cook']
+        iterations = 0
+        stall_limit = max(200, 20 * len(cooked))  # Sin mejoras: óptimo local
+        stalled = 0
+        while cooked and stalled < stall_limit and time.perf_counter() - started < budget:
+            iterations += 1
+            stalled += 1
+            slot = rng.choice(cooked)
+            slot_date, meal_type = slot
+            current = assignments[slot][0]
+            pool = by_meal_type[meal_type]
+            
+            PlannerService._apply(recipes[current], consumption, sign=-1)
+            uses[current].remove(slot_date)
+            current_cost = (PlannerService._delta(recipes[current], consumption, available, refs)
+                            - weight * (preferences.get(current) or 0))
+            best_id, best_cost = current, current_cost
+            for dish_id in rng.sample(pool, min(PlannerService.SAMPLE_SIZE, len(pool))):
+                if dish_id == current or not PlannerService._allowed(
+                        dish_id, slot_date, uses, max_repeats, min_gap_days):
+                    continue
+                cost = (PlannerService._delta(recipes[dish_id], consumption, available, refs)
+                        - weight * (preferences.get(dish_id) or 0))
+                if cost < best_cost - 1e-9:
+                    best_id, best_cost = dish_id, cost
+                    stalled = 0
+            
+            PlannerService._apply(recipes[best_id], consumption)
+            uses.setdefault(best_id, []).append(slot_date)
+            assignments[slot] = (best_id, 'cook', None)
+        
+        purchases = {i: q - available.get(i, 0.0) for i, q in consumption.items()
+                     if q > available.get(i, 0.0) + 1e-9}
+        cost = sum(PlannerService._ingredient_cost(q, available.get(i, 0.0), refs[i])
+                   for i, q in consumption.items())
+        cost -= weight * sum(preferences.get(d) or 0 for d, _, _ in assignments.values())
+        return {
+            'assignments': assignments,
+            'unfilled': [slot for slot in slots if slot not in assignments],
+            'purchases': purchases,
+            'cost': cost,
+            'iterations': iterations,
+        }
+    
+    @staticmethod
+    def _meal_rank(meal_type):
+        return Meal.MEAL_TYPES.index(meal_type) if meal_type in Meal.MEAL_TYPES else len(Meal.MEAL_TYPES)
+    
+    # ---------- Carga y escritura ----------
+    
+    @staticmethod
+    def empty_slots(start_date, end_date, meal_types=None):
+        """
+        Huecos sin plato ni opción especial en un rango de fechas
+        
+        Returns:
+            list: [(fecha, meal_type)] en orden cronológico
+        """
+        meal_types = meal_types or Meal.MEAL_TYPES
+        has_dishes = select(MealDish.id).where(MealDish.meal_id == Meal.id).exists()
+        filled = set(db.session.execute(
+            select(Day.date, Meal.meal_type)
+            .join(Meal, Meal.day_id == Day.id)
+            .where(Day.date.between(start_date, end_date))
+            .where(has_dishes | Meal.special_type.isnot(None) | Meal.confirmed.is_(True))
+        ).all())
+        
+        slots = []
+        current = start_date
+        while current <= end_date:
+            for meal_type in meal_types:
+                if (current, meal_type) not in filled:
+                    slots.append((current, meal_type))
+            current += timedelta(days=1)
+        return slots
+    
+    @staticmethod
+    def _load_batches():
+        """Porcentaje libre y caducidad de los batches abiertos, en orden FEFO"""
+        rows = db.session.execute(
+            select(DishBatch.dish_id, DishBatch.percentage_remaining, DishBatch.expires_at)
+            .where(DishBatch.available_filter())
+            .order_by(DishBatch.preparation_date, DishBatch.id)
+        )
+        batches = {}
+        for dish_id, percentage, expires_at in rows:
+            batches.setdefault(dish_id, []).append(
+                [percentage, expires_at.date() if expires_at else None]
+            )
+        return batches
+    
+    @staticmethod
+    def plan(start_date, end_date, meal_types=None, preferences=None, max_repeats=2,
+             min_gap_days=2, time_budget=None, apply=False):
+        """
+        Planifica automáticamente los huecos vacíos de un rango de fechas
+        
+        Args:
+            start_date: Primer día del rango
+            end_date: Último día del rango (incluido)
+            meal_types: Comidas a rellenar (default: todas)
+            preferences: dict dish_id -> peso; None excluye el plato
+            max_repeats: Veces máximas que se repite un plato
+            min_gap_days: Días mínimos entre repeticiones
+            time_budget: Segundos para la búsqueda local
+            apply: Si True guarda el plan en una única transacción
+        
+        Returns:
+            dict: {'meals': [{'date', 'meal_type', 'dish_id', 'mode', 'percentage'}],
+                   'unfilled': [{'date', 'meal_type'}],
+                   'purchases': {ingredient_id: cantidad}, 'iterations': int}
+        """
+        try:
+            if end_date < start_date:
+                raise ValueError("La fecha final debe ser posterior a la inicial")
+            if (end_date - start_date).days > 62:
+                raise ValueError("El rango máximo de planificación es de dos meses")
+            
+            # No se planifica el pasado
+            start_date = max(start_date, date.today())
+            slots = PlannerService.empty_slots(start_date, end_date, meal_types)
+            planned = db.session.execute(
+                select(Day.date, MealDish.dish_id)
+                .join(Meal, Meal.day_id == Day.id)
+                .join(MealDish, MealDish.meal_id == Meal.id)
+                .where(Day.date.between(start_date - timedelta(days=min_gap_days),
+                                        end_date + timedelta(days=min_gap_days)))
+                .distinct()
+            ).all()
+            dishes = FeasibilityService.load_requirement_matrix()
+            stock = dict(db.session.execute(
+                select(PantryStock.ingredient_id, PantryStock.stock_planificado)
+            ).all())
+            result = PlannerService.optimize(
+                slots, dishes, stock,
+                batches=PlannerService._load_batches(),
+                preferences=preferences,
+                planned=planned,
+                max_repeats=max_repeats,
+                min_gap_days=min_gap_days,
+                time_budget=time_budget
+            )
+            
+            if apply:
+                PlannerService._save(result)
+            
+            return {
+                'meals': [
+                    {'date': slot[0].isoformat(), 'meal_type': slot[1], 'dish_id': dish_id,
+                     'mode': mode, 'percentage': percentage}
+                    for slot, (dish_id, mode, percentage) in sorted(
+                        result['assignments'].items(),
+                        key=lambda item: (item[0][0], PlannerService._meal_rank(item[0][1]))
+                    )
+                ],
+                'unfilled': [{'date': d.isoformat(), 'meal_type': t} for d, t in result['unfilled']],
+                'purchases': result['purchases'],
+                'iterations': result['iterations'],
+            }
+        
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al planificar comidas: {str(e)}")
+    
+    @staticmethod
+    def _save(result):
+        """Escribe el plan completo (días, comidas, platos y stock) con un solo commit"""
+        assignments = result['assignments']
+        if not assignments:
+            return
+        
+        # Días y comidas: se crean los que falten, en bloque
+        dates = {slot[0] for slot in assignments}
+        days = {day.date: day for day in Day.query.filter(Day.date.in_(dates))}
+        for missing in dates - set(days):
+            days[missing] = Day(date=missing)
+            db.session.add(days[missing])
+            for meal_type in Meal.MEAL_TYPES:
+                db.session.add(Meal(day=days[missing], meal_type=meal_type))
+        db.session.flush()
+        
+        meals = {
+            (meal.day_id, meal.meal_type): meal
+            for meal in Meal.query.filter(Meal.day_id.in_([d.id for d in days.values()]))
+        }
+        for slot_date, meal_type in assignments:
+            key = (days[slot_date].id, meal_type)
+            if key not in meals:
+                meals[key] = Meal(day_id=key[0], meal_type=meal_type)
+                db.session.add(meals[key])
+        db.session.flush()
+        
+        # Platos cocinados: un MealDish por hueco y el stock agregado por ingrediente
+        # (una consulta, escalada por los comensales de cada comida)
+        cooked = []
+        batch_slots = []
+        for (slot_date, meal_type), (dish_id, mode, percentage) in assignments.items():
+            meal = meals[(days[slot_date].id, meal_type)]
+            if mode == 'batch':
+                batch_slots.append((slot_date, meal, dish_id, percentage))
+                continue
+            cooked.append(MealDish(meal_id=meal.id, dish_id=dish_id, portions=1, order=0))
+        if cooked:
+            db.session.add_all(cooked)
+            db.session.flush()
+            PantryService.apply_requirements(
+                RequirementService.for_meal_dishes(meal_dish_ids=[meal_dish.id for meal_dish in cooked]),
+                'subtract'
+            )
+        
+        # Batches: reparto FIFO real sobre las filas bloqueadas
+        if batch_slots:
+            batch_slots.sort(key=lambda s: (s[0], PlannerService._meal_rank(s[1].meal_type)))
+            batches_by_dish = BatchAllocationService._load_batches({s[2] for s in batch_slots})
+            remaining = {}
+            for slot_date, meal, dish_id, percentage in batch_slots:
+                allocations, shortfall = BatchAllocationService._draw(
+                    batches_by_dish.get(dish_id, []), percentage, remaining
+                )
+                if shortfall:
+                    # Otro proceso consumió el batch entre la carga y el bloqueo
+                    del assignments[(slot_date, meal.meal_type)]
+                    result['unfilled'].append((slot_date, meal.meal_type))
+                else:
+                    BatchAllocationService._add_batch_meal_dishes(meal, dish_id, allocations)
+        
+        db.session.commit()
+
+
+class ProjectionService:
+    """
+    Proyección día a día del stock real según lo planificado
+    
+    stock_planificado resume todo el plan en un único número; aquí se parte
+    de stock_actual y se resta el consumo de cada comida pendiente en la
+    fecha de su día (suma acumulada sobre fechas ordenadas), así se sabe
+    qué día se acaba cada ingrediente aunque el total semanal cuadre.
+    """
+    
+    EPSILON = 1e-6  # Tolerancia para restos de coma flotante
+    MAX_HORIZON_DAYS = 366  # Horizonte máximo pedido por la API
+    
+    @staticmethod
+    def daily_requirements(start_date=None, end_date=None, ingredient_ids=None):
+        """
+        Consumo pendiente agregado por fecha e ingrediente en una sola consulta
+        
+        Cuenta las comidas sin confirmar que no son especiales, con la misma
+        regla que confirm_meal (receta escalada por porciones y comensales,
+        ver RequirementService).
+        
+        Args:
+            start_date: Primera fecha (None = sin límite)
+            end_date: Última fecha incluida (None = sin límite)
+            ingredient_ids: Restringe a estos ingredientes (None = todos)
+        
+        Returns:
+            list: [(fecha, ingredient_id, cantidad)] ordenada por fecha
+        """
+        quantity = func.sum(RequirementService.quantity_expression())
+        stmt = (
+            RequirementService.select_requirements(Day.date, DishFlatIngredient.ingredient_id, quantity)
+            .join(Day, Day.id == Meal.day_id)
+            .where(Meal.confirmed.is_(False), Meal.special_type.is_(None))
+            .group_by(Day.date, DishFlatIngredient.ingredient_id)
+            .order_by(Day.date)
+        )
+        if start_date:
+            stmt = stmt.where(Day.date >= start_date)
+        if end_date:
+            stmt = stmt.where(Day.date <= end_date)
+        if ingredient_ids is not None:
+            stmt = stmt.where(DishFlatIngredient.ingredient_id.in_(ingredient_ids))
+        return db.session.execute(stmt).all()
+    
+    @staticmethod
+    def project(end_date=None, ingredient_ids=None, today=None):
+        """
+        Curva de stock por ingrediente y primera fecha en negativo
+        
+        Las comidas pendientes de días ya pasados se cuentan como consumo de
+        hoy: aún no se han descontado del stock real.
+        
+        Args:
+            end_date: Horizonte de la proyección (None = todo lo planificado)
+            ingredient_ids: Restringe a estos ingredientes (None = todos)
+            today: Fecha de referencia (default: hoy)
+        
+        Returns:
+            dict: ingredient_id -> {'stock_actual', 'timeline': [(fecha, stock)],
+                  'run_out_date': fecha o None, 'final_stock'}
+        """
+        today = today or date.today()
+        stock_stmt = select(PantryStock.ingredient_id, PantryStock.stock_actual)
+        if ingredient_ids is not None:
+            stock_stmt = stock_stmt.where(PantryStock.ingredient_id.in_(ingredient_ids))
+        stock = {i: q or 0.0 for i, q in db.session.execute(stock_stmt)}
+        
+        projection = {}
+        for day_date, ingredient_id, quantity in ProjectionService.daily_requirements(
+                end_date=end_date, ingredient_ids=ingredient_ids):
+            entry = projection.get(ingredient_id)
+            if entry is None:
+                initial = stock.get(ingredient_id, 0.0)
+                entry = projection[ingredient_id] = {
+                    'stock_actual': initial,
+                    'timeline': [],
+                    'run_out_date': None,
+                    'final_stock': initial,
+                }
+            
+            day_date = max(day_date, today)
+            entry['final_stock'] -= quantity or 0.0
+            timeline = entry['timeline']
+            if timeline and timeline[-1][0] == day_date:
+                timeline[-1] = (day_date, entry['final_stock'])
+            else:
+                timeline.append((day_date, entry['final_stock']))
+            if entry['run_out_date'] is None and entry['final_stock'] < -ProjectionService.EPSILON:
+                entry['run_out_date'] = day_date
+        
+        # Ingredientes con stock pero sin consumo previsto: curva plana
+        for ingredient_id, initial in stock.items():
+            if ingredient_id not in projection:
+                projection[ingredient_id] = {
+                    'stock_actual': initial,
+                    'timeline': [],
+                    'run_out_date': None,
+                    'final_stock': initial,
+                }
+        return projection
+    
+    @staticmethod
+    def run_out_dates(ingredient_ids=None, end_date=None):
+        """
+        Primera fecha en la que cada ingrediente queda en negativo
+        
+        Returns:
+            dict: ingredient_id -> fecha (solo los que se agotan)
+        """
+        projection = ProjectionService.project(end_date=end_date, ingredient_ids=ingredient_ids)
+        return {
+            ingredient_id: entry['run_out_date']
+            for ingredient_id, entry in projection.items()
+            if entry['run_out_date'] is not None
+        }
+
+
+class ConsumptionService:
+    """
+    Historial de consumo real: resumen diario por ingrediente (ConsumptionDaily)
+    
+    Un día se recalcula entero desde sus comidas confirmadas (DELETE +
+    INSERT ... SELECT agrupado), así confirmar, desconfirmar y reconstruir
+    en bloque usan la misma consulta y el resultado no depende del orden de
+    las confirmaciones. Regla de cantidades: la de confirm_meal (ver
+    RequirementService).
+    """
+    
+    @staticmethod
+    def daily_select(start_date=None, end_date=None, household_id=None):
+        """
+        select (household_id, ingredient_id, date, quantity) del consumo de
+        las comidas confirmadas, agrupado por fecha e ingrediente
+        """
+        household_id = household_id or current_household_id()
+        stmt = (
+            RequirementService.select_requirements(
+                literal(household_id).label('household_id'),
+                DishFlatIngredient.ingredient_id.label('ingredient_id'),
+                Day.date.label('date'),
+                func.sum(RequirementService.quantity_expression()).label('quantity')
+            )
+            .join(Day, Day.id == Meal.day_id)
+            .where(Meal.household_id == household_id, Meal.confirmed.is_(True),
+                   Meal.special_type.is_(None))
+            .group_by(Day.date, DishFlatIngredient.ingredient_id)
+        )
+        if start_date:
+            stmt = stmt.where(Day.date >= start_date)
+        if end_date:
+            stmt = stmt.where(Day.date <= end_date)
+        return stmt
+    
+    @staticmethod
+    def rebuild(start_date=None, end_date=None, household_id=None):
+        """
+        Recalcula el resumen diario de un rango de fechas desde las comidas confirmadas
+        
+        No hace commit. Usa las recetas actuales: reconstruir un rango
+        antiguo después de cambiar una receta recalcula también su consumo.
+        
+        Args:
+            start_date: Primera fecha (None = desde el principio)
+            end_date: Última fecha incluida (None = hasta el final)
+            household_id: Hogar (por defecto el activo)
+        
+        Returns:
+            int: Filas (día, ingrediente) escritas
+        """
+        household_id = household_id or current_household_id()
+        table = ConsumptionDaily.__table__
+        stmt = table.delete().where(table.c.household_id == household_id)
+        if start_date:
+            stmt = stmt.where(table.c.date >= start_date)
+        if end_date:
+            stmt = stmt.where(table.c.date <= end_date)
+        db.session.execute(stmt)
+        
+        daily = ConsumptionService.daily_select(start_date, end_date, household_id).subquery()
+        result = db.session.execute(
+            table.insert().from_select(
+                ['household_id', 'ingredient_id', 'date', 'quantity'],
+                select(daily.c.household_id, daily.c.ingredient_id, daily.c.date, daily.c.quantity)
+                .where(daily.c.quantity > 0)
+            )
+        )
+        return result.rowcount
+    
+    @staticmethod
+    def history(start_date, end_date, ingredient_ids=None):
+        """
+        Consumo diario de un rango de fechas
+        
+        Returns:
+            list: [(ingredient_id, fecha, cantidad)] ordenada por fecha
+        """
+        stmt = (
+            select(ConsumptionDaily.ingredient_id, ConsumptionDaily.date, ConsumptionDaily.quantity)
+            .where(ConsumptionDaily.date >= start_date, ConsumptionDaily.date <= end_date)
+            .order_by(ConsumptionDaily.date)
+        )
+        if ingredient_ids is not None:
+            stmt = stmt.where(ConsumptionDaily.ingredient_id.in_(ingredient_ids))
+        return db.session.execute(stmt).all()
+
+
+class ForecastService:
+    """
+    Previsión de consumo por ingrediente a partir del resumen diario
+    
+    Cada ingrediente se convierte en una serie densa de WINDOW_DAYS días
+    (los días sin consumo valen 0) y todo se calcula sobre esas series:
+    - Nivel: media de las medias móviles de SHORT_WINDOW_DAYS y WINDOW_DAYS
+      días (sigue la tendencia sin saltar por una semana atípica)
+    - Perfil semanal: media de cada día de la semana / media diaria
+    - Previsión de un día: nivel × perfil de su día de la semana
+    - Stock de seguridad: SAFETY_FACTOR × desviación diaria × √LEAD_DAYS
+    - Stock objetivo (par): previsión de COVER_DAYS días + seguridad
+    - Punto de pedido: previsión de LEAD_DAYS días + seguridad
+    """
+    
+    WINDOW_DAYS = 28  # Historial que se lee (4 semanas completas)
+    SHORT_WINDOW_DAYS = 7
+    COVER_DAYS = 7  # Días que debe cubrir una compra
+    LEAD_DAYS = 2  # Días hasta que llega una compra
+    SAFETY_FACTOR = 1.65  # ~95% de días sin rotura
+    MAX_HORIZON_DAYS = 62  # Previsión máxima (dos meses, como el planificador)
+    
+    @staticmethod
+    def series(ingredient_ids=None, today=None):
+        """
+        Series densas de consumo diario de los últimos WINDOW_DAYS días (sin hoy)
+        
+        Returns:
+            tuple: (fecha del primer día, dict ingredient_id -> [cantidad por día])
+        """
+        today = today or date.today()
+        window = ForecastService.WINDOW_DAYS
+        start = today - timedelta(days=window)
+        series = {}
+        for ingredient_id, day_date, quantity in ConsumptionService.history(
+                start, today - timedelta(days=1), ingredient_ids):
+            values = series.get(ingredient_id)
+            if values is None:
+                values = series[ingredient_id] = [0.0] * window
+            values[(day_date - start).days] += quantity
+        return start, series
+    
+    @staticmethod
+    def forecast(ingredient_ids=None, today=None, horizon=None):
+        """
+        Previsión y niveles sugeridos de los ingredientes con historial
+        
+        Args:
+            ingredient_ids: Restringe a estos ingredientes (None = todos)
+            today: Fecha de referencia (default: hoy)
+            horizon: Días de previsión desde hoy, de 1 a MAX_HORIZON_DAYS
+                (default: COVER_DAYS)
+        
+        Returns:
+            dict: ingredient_id -> {'daily_average', 'recent_average',
+                  'weekday_profile': [lunes..domingo], 'forecast': [(fecha, cantidad)],
+                  'safety_stock', 'par_level', 'reorder_point'}
+        """
+        today = today or date.today()
+        horizon = ForecastService.COVER_DAYS if horizon is None else horizon
+        if not 1 <= horizon <= ForecastService.MAX_HORIZON_DAYS:
+            raise ValueError(f"El horizonte debe estar entre 1 y {ForecastService.MAX_HORIZON_DAYS} días")
+        window = ForecastService.WINDOW_DAYS
+        short = ForecastService.SHORT_WINDOW_DAYS
+        start, series = ForecastService.series(ingredient_ids, today)
+        # Posiciones de cada día de la semana dentro de la ventana
+        weekdays = [[i for i in range(window) if (start + timedelta(days=i)).weekday() == weekday]
+                    for weekday in range(7)]
+        ahead = [today + timedelta(days=i) for i in range(max(horizon, ForecastService.COVER_DAYS))]
+        
+        result = {}
+        for ingredient_id, values in series.items():
+            daily_average = sum(values) / window
+            recent_average = sum(values[-short:]) / short
+            level = (daily_average + recent_average) / 2
+            profile = [
+                (sum(values[i] for i in positions) / len(positions)) / daily_average if daily_average else 1.0
+                for positions in weekdays
+            ]
+            daily = [level * profile[day.weekday()] for day in ahead]
+            deviation = math.sqrt(sum((v - daily_average) ** 2 for v in values) / window)
+            safety = ForecastService.SAFETY_FACTOR * deviation * math.sqrt(ForecastService.LEAD_DAYS)
+            result[ingredient_id] = {
+                'daily_average': daily_average,
+                'recent_average': recent_average,
+                'weekday_profile': profile,
+                'forecast': list(zip(ahead[:horizon], daily[:horizon])),
+                'safety_stock': safety,
+                'par_level': sum(daily[:ForecastService.COVER_DAYS]) + safety,
+                'reorder_point': sum(daily[:ForecastService.LEAD_DAYS]) + safety,
+            }
+        return result
+    
+    @staticmethod
+    def suggestions(ingredient_ids=None, today=None):
+        """
+        Stock objetivo y punto de pedido sugeridos
+        
+        Returns:
+            dict: ingredient_id -> {'par_level', 'reorder_point'} (solo
+                  ingredientes con consumo en la ventana)
+        """
+        return {
+            ingredient_id: {'par_level': entry['par_level'], 'reorder_point': entry['reorder_point']}
+            for ingredient_id, entry in ForecastService.forecast(ingredient_ids, today).items()
+        }
+
+
+class StoreLayoutService:
+    """
+    Orden de recorrido de cada tienda (pasillos) para las listas de compra
+    
+    Los items guardan su clave de orden (store_layout.py); aquí solo se
+    editan los órdenes. Cada cambio recalcula las claves de las listas sin
+    completar en el mismo flush.
+    """
+    
+    @staticmethod
+    def layouts():
+        """
+        Orden de pasillos de cada tienda del hogar
+        
+        Returns:
+            dict: store_id (None = orden por defecto) -> [pasillos en orden]
+        """
+        layouts = {}
+        for store_id, aisle in db.session.execute(
+            select(StoreAisle.store_id, StoreAisle.aisle)
+            .order_by(StoreAisle.store_id, StoreAisle.position)
+        ):
+            layouts.setdefault(store_id, []).append(aisle)
+        return layouts
+    
+    @staticmethod
+    def known_aisles():
+        """Pasillos usados en ingredientes u órdenes del hogar, por nombre"""
+        aisles = set(db.session.execute(
+            select(Ingredient.aisle).where(Ingredient.aisle.isnot(None)).distinct()).scalars())
+        aisles.update(db.session.execute(select(StoreAisle.aisle).distinct()).scalars())
+        return sorted(aisles, key=search_index.normalize)
+    
+    @staticmethod
+    def set_layout(store_id, aisles, auto_commit=True):
+        """
+        Sustituye el orden de pasillos de una tienda
+        
+        Args:
+            store_id: ID de la tienda (None = orden por defecto del hogar)
+            aisles: Pasillos en orden de recorrido (se ignoran vacíos y repetidos)
+            auto_commit: Si True, hace commit automáticamente
+        
+        Returns:
+            list: Pasillos guardados, en orden
+        """
+        if store_id is not None and not Store.query.get(store_id):
+            raise ValueError("Tienda no encontrada")
+        
+        ordered, seen = [], set()
+        for aisle in aisles:
+            aisle = (aisle or '').strip()[:50]
+            if aisle and search_index.normalize(aisle) not in seen:
+                seen.add(search_index.normalize(aisle))
+                ordered.append(aisle)
+        
+        try:
+            for row in StoreAisle.query.filter(StoreAisle.store_id.is_(None) if store_id is None
+                                               else StoreAisle.store_id == store_id):
+                db.session.delete(row)
+            db.session.flush()
+            for position, aisle in enumerate(ordered):
+                db.session.add(StoreAisle(store_id=store_id, aisle=aisle, position=position))
+            db.session.flush()
+            
+            if auto_commit:
+                db.session.commit()
+            return ordered
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al guardar el orden de pasillos: {str(e)}")
+
+
+class PackService:
+    """
+    Redondeo de la compra a formatos reales (paquetes, botellas, cajas)
+    
+    Para cada faltante se busca la combinación de formatos más barata que lo
+    cubre, con programación dinámica de mochila sin límite de unidades sobre
+    una rejilla de cantidades. La rejilla es el máximo común divisor de los
+    tamaños (250 g, 500 g, 1 kg -> pasos de 250 g), limitada a MAX_CELLS
+    celdas por ingrediente: con rejilla más gruesa los tamaños se redondean
+    hacia abajo, así el plan siempre cubre la necesidad real.
+    """
+    
+    MAX_CELLS = 1000  # Tamaño máximo de la tabla DP por ingrediente
+    
+    @staticmethod
+    def cheapest_combination(need, packs):
+        """
+        Combinación más barata de formatos que cubre una cantidad
+        
+        Args:
+            need: Cantidad a cubrir (unidad base)
+            packs: Lista de (pack_id, pack_size, price)
+        
+        Returns:
+            tuple: ({pack_id: unidades}, cantidad comprada, coste) o None si no hay formatos
+        """
+        packs = [p for p in packs if p[1] > 0]
+        if need <= 0 or not packs:
+            return None
+        
+        # Rejilla: mcd de los tamaños (a centésimas), o más gruesa si hay demasiadas celdas
+        step = math.gcd(*[max(int(round(size * 100)), 1) for _, size, _ in packs]) / 100.0
+        step = max(step, need / PackService.MAX_CELLS)
+        cells = [(pack_id, int(size / step + 1e-9), price) for pack_id, size, price in packs]
+        cells = [c for c in cells if c[1] > 0]
+        if not cells:
+            # Todos los formatos son diminutos frente a la necesidad: el de mejor precio unitario
+            pack_id, size, price = min(packs, key=lambda p: p[2] / p[1])
+            count = math.ceil(need / size - 1e-9)
+            return {pack_id: count}, count * size, count * price
+        
+        target = math.ceil(need / step - 1e-9)
+        sizes = {pack_id: size for pack_id, size, _ in packs}
+        # best[c] = (coste, cantidad real) mínimos para cubrir al menos c celdas
+        best = [(0.0, 0.0)] + [None] * target
+        choice = [None] * (target + 1)
+        for c in range(1, target + 1):
+            current = None
+            for index, (pack_id, size_cells, price) in enumerate(cells):
+                previous = best[c - size_cells] if c > size_cells else best[0]
+                candidate = (previous[0] + price, previous[1] + sizes[pack_id])
+                if current is None or candidate < current:
+                    current, choice[c] = candidate, index
+            best[c] = current
+        
+        plan = {}
+        c = target
+        while c > 0:
+            pack_id, size_cells, _ = cells[choice[c]]
+            plan[pack_id] = plan.get(pack_id, 0) + 1
+            c = max(c - size_cells, 0)
+        cost, quantity = best[target]
+        return plan, quantity, cost
+    
+    @staticmethod
+    def store_options(needs):
+        """
+        Plan de formatos de cada necesidad en cada tienda que la vende
+        
+        Una sola consulta de catálogo; la mochila se resuelve por separado con
+        los formatos de cada tienda (los formatos sin tienda cuentan como una
+        tienda más, sin envío ni mínimo, con clave None).
+        
+        Args:
+            needs: dict ingredient_id -> cantidad a cubrir
+        
+        Returns:
+            dict: ingredient_id -> {store_id: {'quantity', 'cost', 'packs': [{'pack_id',
+                  'name', 'pack_size', 'count', 'price'}]}} (solo los que tienen formatos)
+        """
+        if not needs:
+            return {}
+        catalog = {}
+        for pack in ProductPack.query.filter(ProductPack.ingredient_id.in_(needs.keys())):
+            catalog.setdefault(pack.ingredient_id, {}).setdefault(pack.store_id, []).append(pack)
+        
+        options = {}
+        for ingredient_id, by_store in catalog.items():
+            for store_id, packs in by_store.items():
+                result = PackService.cheapest_combination(
+                    needs[ingredient_id], [(p.id, p.pack_size, p.price) for p in packs]
+                )
+                if result is None:
+                    continue
+                counts, quantity, cost = result
+                by_id = {p.id: p for p in packs}
+                options.setdefault(ingredient_id, {})[store_id] = {
+                    'quantity': quantity,
+                    'cost': round(cost, 2),
+                    'packs': [
+                        {
+                            'pack_id': pack_id,
+                            'name': by_id[pack_id].name,
+                            'pack_size': by_id[pack_id].pack_size,
+                            'count': count,
+                            'price': by_id[pack_id].price,
+                        }
+                        for pack_id, count in sorted(counts.items(), key=lambda c: -by_id[c[0]].pack_size)
+                    ],
+                }
+        return options
+
+
+class BasketService:
+    """
+    Reparto de una lista de compra en cestas por tienda
+    
+    Minimiza el coste total (formatos + gastos de envío de cada tienda usada)
+    respetando el pedido mínimo de cada tienda. Es un problema de
+    localización de instalaciones, así que se usa una heurística:
+    1. Cada item a su tienda más barata
+    2. Movimientos de cerrar una tienda (sus items a la siguiente mejor) y
+       de abrirla (traer los items que allí salen más baratos)
+    3. Reubicación item a item
+    repitiendo 2-3 mientras mejore y quede presupuesto de tiempo.
+    """
+    
+    TIME_BUDGET = 0.5  # Segundos por defecto
+    PENALTY = 1000.0  # Coste por euro que falta para el pedido mínimo
+    
+    @staticmethod
+    def split(options, stores, time_budget=None):
+        """
+        Asigna cada item a una tienda
+        
+        Args:
+            options: dict item -> {store_id: coste} (store_id None = sin tienda)
+            stores: dict store_id -> (gastos de envío, pedido mínimo)
+            time_budget: Segundos máximos (None = TIME_BUDGET)
+        
+        Returns:
+            dict: {'assignment': {item: store_id}, 'items_cost', 'delivery_fees',
+                   'total', 'below_minimum': [store_id], 'iterations'}
+        """
+        started = time.perf_counter()
+        budget = BasketService.TIME_BUDGET if time_budget is None else time_budget
+        penalty = BasketService.PENALTY
+        
+        def store_cost(store_id, subtotal, count):
+            if count == 0 or store_id is None:
+                return 0.0
+            fee, minimum = stores.get(store_id, (0.0, 0.0))
+            return fee + penalty * max(0.0, minimum - subtotal)
+        
+        # 1. Tienda más barata por item
+        assignment = {item: min(costs, key=lambda s: (costs[s], s is None, s or 0))
+                      for item, costs in options.items() if costs}
+        subtotal, count = {}, {}
+        for item, store_id in assignment.items():
+            subtotal[store_id] = subtotal.get(store_id, 0.0) + options[item][store_id]
+            count[store_id] = count.get(store_id, 0) + 1
+        
+        def move(item, target):
+            """Aplica el cambio y devuelve la variación de coste"""
+            source = assignment[item]
+            if source == target:
+                return 0.0
+            before = (store_cost(source, subtotal.get(source, 0.0), count.get(source, 0))
+                      + store_cost(target, subtotal.get(target, 0.0), count.get(target, 0)))
+            item_delta = options[item][target] - options[item][source]
+            subtotal[source] -= options[item][source]
+            count[source] -= 1
+            subtotal[target] = subtotal.get(target, 0.0) + options[item][target]
+            count[target] = count.get(target, 0) + 1
+            assignment[item] = target
+            after = (store_cost(source, subtotal[source], count[source])
+                     + store_cost(target, subtotal[target], count[target]))
+            return item_delta + after - before
+        
+        def try_moves(moves):
+            """Aplica varios movimientos; los deshace si no bajan el coste"""
+            undo = [(item, assignment[item]) for item, _ in moves]
+            delta = sum(move(item, target) for item, target in moves)
+            if delta < -1e-9:
+                return True
+            for item, previous in reversed(undo):
+                move(item, previous)
+            return False
+        
+        movable = [item for item, costs in options.items() if len(costs) > 1]
+        iterations = 0
+        improved = True
+        while improved and time.perf_counter() - started < budget:
+            improved = False
+            iterations += 1
+            
+            # 2a. Cerrar tienda: sus items a la mejor alternativa ya abierta
+            for store_id in [s for s in list(count) if count.get(s) and s is not None]:
+                used = {s for s, n in count.items() if n and s != store_id}
+                moves = []
+                for item in (i for i, s in assignment.items() if s == store_id):
+                    alternatives = [s for s in options[item] if s != store_id]
+                    if not alternatives:
+                        moves = None
+                        break
+                    preferred = [s for s in alternatives if s in used] or alternatives
+                    moves.append((item, min(preferred, key=lambda s: options[item][s])))
+                if moves and try_moves(moves):
+                    improved = True
+            
+            # 2b. Abrir tienda: traer los items que allí son más baratos
+            for store_id in stores:
+                if count.get(store_id):
+                    continue
+                moves = [(item, store_id) for item in movable
+                         if store_id in options[item]
+                         and options[item][store_id] < options[item][assignment[item]]]
+                if moves and try_moves(moves):
+                    improved = True
+            
+            # 3. Reubicación individual
+            for item in movable:
+                if time.perf_counter() - started >= budget:
+                    break
+                current = assignment[item]
+                best_target, best_delta = None, -1e-9
+                for target in options[item]:
+                    if target == current:
+                        continue
+                    delta = move(item, target)
+                    move(item, current)
+                    if delta < best_delta:
+                        best_target, best_delta = target, delta
+                if best_target is not None:
+                    move(item, best_target)
+                    improved = True
+        
+        items_cost = sum(options[item][store_id] for item, store_id in assignment.items())
+        fees = sum(stores.get(s, (0.0, 0.0))[0] for s, n in count.items() if n and s is not None)
+        below = [s for s, n in count.items()
+                 if n and s is not None and subtotal[s] < stores.get(s, (0.0, 0.0))[1] - 1e-9]
+        return {
+            'assignment': assignment,
+            'items_cost': round(items_cost, 2),
+            'delivery_fees': round(fees, 2),
+            'total': round(items_cost + fees, 2),
+            'below_minimum': below,
+            'iterations': iterations,
+        }
+
+
+class ShoppingListService:
+    """Servicio para generación de listas de compra"""
+    
+    EPSILON = 1e-6  # Por debajo no hace falta comprar
+    
+    @staticmethod
+    def quantity_needed(stock, top_up=True):
+        """
+        Cantidad que falta de un ingrediente: lo que pide el plan o, si es un
+        básico bajo su punto de pedido (y top_up), hasta su stock objetivo
+        """
+        needed = -stock.stock_planificado
+        if top_up and stock.reorder_point is not None and stock.stock_planificado < stock.reorder_point:
+            needed = (stock.par_level if stock.par_level is not None else stock.reorder_point) \
+                - stock.stock_planificado
+        return needed
+    
+    @staticmethod
+    def stocks_to_buy(top_up=True):
+        """
+        Filas de stock con algo que comprar, en una sola consulta por índice
+        
+        Args:
+            top_up: Si True incluye los básicos bajo su punto de pedido
+                (reorder_margin < 0); si False solo las faltas del plan
+        """
+        condition = PantryStock.reorder_margin < 0 if top_up else PantryStock.stock_planificado < 0
+        return PantryStock.query.filter(condition).all()
+    
+    @staticmethod
+    def generate_shopping_list_from_stock(name=None, time_budget=None, top_up=True):
+        """
+        Genera lista de compra basándose en ingredientes con stock_planificado NEGATIVO
+        (stock negativo = hay que comprar)
+        
+        Con top_up también repone los básicos (PantryStock.par_level) cuyo
+        planificado ha bajado del punto de pedido, en la misma lista: un
+        ingrediente que falta para el plan y además es básico aparece una
+        vez, repuesto hasta su stock objetivo.
+        
+        Cada faltante se redondea a formatos de compra y se asigna a la tienda
+        que minimiza el total de la lista (ver BasketService).
+        
+        Args:
+            name: Nombre personalizado para la lista
+            time_budget: Segundos para el reparto en cestas (None = por defecto)
+            top_up: Si True incluye la reposición de básicos
+        
+        Returns:
+            ShoppingList: Lista de compra generada
+        """
+        # Faltas del plan y básicos bajo mínimos (un rango del índice de reorder_margin)
+        negative_stocks = ShoppingListService.stocks_to_buy(top_up)
+        
+        if not negative_stocks:
+            raise ValueError("No hay ingredientes que comprar. Stock planificado suficiente.")
+        needed = {stock.ingredient_id: ShoppingListService.quantity_needed(stock, top_up)
+                  for stock in negative_stocks}
+        
+        # Crear lista
+        if name is None:
+            name = f"Lista de Compra - {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+        
+        shopping_list = ShoppingList(
+            name=name,
+            start_date=datetime.now().date(),
+            end_date=datetime.now().date() + timedelta(days=7),
+            completed=False,
+            pending_items=len(negative_stocks)
+        )
+        db.session.add(shopping_list)
+        db.session.flush()
+        
+        # Formatos más baratos por tienda (una consulta para toda la lista) y reparto en cestas
+        options = PackService.store_options(needed)
+        stores = {
+            store.id: (store.delivery_fee, store.min_order)
+            for store in Store.query.filter(Store.id.in_(
+                {s for by_store in options.values() for s in by_store if s is not None}
+            ))
+        }
+        baskets = BasketService.split(
+            {i: {s: plan['cost'] for s, plan in by_store.items()} for i, by_store in options.items()},
+            stores,
+            time_budget=time_budget
+        )
+        
+        # Crear items (agrupados por tienda con store_id)
+        for stock in negative_stocks:
+            quantity_needed = needed[stock.ingredient_id]  # Falta del plan o reposición
+            store_id = baskets['assignment'].get(stock.ingredient_id)
+            plan = options[stock.ingredient_id][store_id] if stock.ingredient_id in options else None
+            
+            item = ShoppingItem(
+                shopping_list_id=shopping_list.id,
+                ingredient_id=stock.ingredient_id,
+                quantity_needed=quantity_needed,  # Lo que falta
+                quantity_available=stock.stock_actual,  # Lo que tienes
+                quantity_to_buy=plan['quantity'] if plan else quantity_needed,  # Formatos completos
+                pack_plan=json.dumps(plan['packs']) if plan else None,
+                estimated_cost=plan['cost'] if plan else None,
+                store_id=store_id,
+                purchased=False
+            )
+            db.session.add(item)
+        
+        db.session.commit()
+        return shopping_list
+    
+    @staticmethod
+    def get_open_list():
+        """Lista abierta del hogar (None si no hay)"""
+        return ShoppingList.query.filter_by(is_open=True).first()
+    
+    @staticmethod
+    def open_shopping_list(name=None):
+        """
+        Abre la lista que se mantiene al día con cada cambio de stock
+        
+        Se rellena una única vez con lo que falta ahora (plan y básicos); a
+        partir de ahí solo recibe las diferencias (sync_open_list). Si ya hay
+        una lista abierta, la devuelve.
+        
+        Args:
+            name: Nombre personalizado para la lista
+        
+        Returns:
+            ShoppingList: Lista abierta
+        """
+        shopping_list = ShoppingListService.get_open_list()
+        if shopping_list:
+            return shopping_list
+        
+        shopping_list = ShoppingList(
+            name=name or f"Lista abierta - {datetime.now().strftime('%d/%m/%Y')}",
+            start_date=datetime.now().date(),
+            end_date=datetime.now().date() + timedelta(days=7),
+            completed=False,
+            is_open=True
+        )
+        db.session.add(shopping_list)
+        db.session.flush()
+        ShoppingListService.sync_open_list(
+            [stock.ingredient_id for stock in ShoppingListService.stocks_to_buy(top_up=True)]
+        )
+        db.session.commit()
+        return shopping_list
+    
+    @staticmethod
+    def close_open_list(shopping_list_id):
+        """Deja de actualizar una lista abierta (queda como lista normal)"""
+        shopping_list = ShoppingList.query.get_or_404(shopping_list_id)
+        if not shopping_list.is_open:
+            raise ValueError("Esta lista no está abierta")
+        shopping_list.is_open = False
+        db.session.commit()
+    
+    @staticmethod
+    def sync_open_list(ingredient_ids):
+        """
+        Lleva a la lista abierta lo que falta ahora de unos ingredientes
+        
+        Por ingrediente: crea el item pendiente si ahora falta, lo actualiza
+        si ya estaba (conservando su tienda si aún tiene formatos allí) o lo
+        borra si ya no falta. Los items comprados no se tocan. Los formatos
+        se recalculan solo para estos ingredientes. No hace commit.
+        
+        Args:
+            ingredient_ids: Ingredientes con cambios de stock
+        
+        Returns:
+            int: Items creados, modificados o borrados
+        """
+        shopping_list = ShoppingListService.get_open_list()
+        ingredient_ids = set(ingredient_ids)
+        if shopping_list is None or not ingredient_ids:
+            return 0
+        
+        stocks = {
+            stock.ingredient_id: stock
+            for stock in PantryStock.query.filter(PantryStock.ingredient_id.in_(ingredient_ids))
+        }
+        items = {
+            item.ingredient_id: item
+            for item in ShoppingItem.query.filter(
+                ShoppingItem.shopping_list_id == shopping_list.id,
+                ShoppingItem.ingredient_id.in_(ingredient_ids),
+                ShoppingItem.purchased.is_(False)
+            )
+        }
+        needed = {}
+        for ingredient_id in ingredient_ids:
+            stock = stocks.get(ingredient_id)
+            quantity = ShoppingListService.quantity_needed(stock) if stock else 0.0
+            if quantity > ShoppingListService.EPSILON:
+                needed[ingredient_id] = quantity
+        options = PackService.store_options(needed)
+        
+        changes, pending = 0, 0
+        for ingredient_id in ingredient_ids - set(needed):
+            if ingredient_id in items:
+                db.session.delete(items[ingredient_id])
+                changes += 1
+                pending -= 1
+        for ingredient_id, quantity_needed in needed.items():
+            by_store = options.get(ingredient_id, {})
+            item = items.get(ingredient_id)
+            if item is not None and item.store_id in by_store:
+                store_id = item.store_id
+            else:
+                store_id = min(by_store, key=lambda s: by_store[s]['cost']) if by_store else None
+            plan = by_store.get(store_id)
+            if item is None:
+                item = ShoppingItem(shopping_list_id=shopping_list.id, ingredient_id=ingredient_id,
+                                    purchased=False)
+                db.session.add(item)
+                pending += 1
+            item.quantity_needed = quantity_needed
+            item.quantity_available = stocks[ingredient_id].stock_actual
+            item.quantity_to_buy = plan['quantity'] if plan else quantity_needed
+            item.pack_plan = json.dumps(plan['packs']) if plan else None
+            item.estimated_cost = plan['cost'] if plan else None
+            item.store_id = store_id
+            changes += 1
+        if pending:
+            shopping_list.pending_items = ShoppingList.pending_items + pending
+        return changes
+    
+    @staticmethod
+    def purchase_items(shopping_list_id, purchases, auto_commit=True):
+        """
+        Registra la compra de uno o varios items de una lista
+        
+        Las filas de los items se bloquean (SELECT ... FOR UPDATE) y solo se
+        compran las que siguen pendientes: una segunda pulsación, o dos
+        móviles a la vez, no suman el stock dos veces. El stock real y
+        planificado sube con un único UPDATE sobre pantry_stock unido a las
+        cantidades compradas por ingrediente, y el contador pending_items de
+        la lista baja en la misma transacción.
+        
+        Args:
+            shopping_list_id: ID de la lista
+            purchases: dict item_id -> cantidad comprada (None = quantity_to_buy)
+            auto_commit: Si True, hace commit automáticamente
+        
+        Returns:
+            dict: {'purchased': [item_ids], 'skipped': [item_ids ya comprados o
+                   de otra lista], 'pending_items', 'completed'}
+        """
+        shopping_list = ShoppingList.query.get_or_404(shopping_list_id)
+        for quantity in purchases.values():
+            if quantity is not None and (not math.isfinite(quantity) or quantity < 0):
+                raise ValueError("La cantidad comprada debe ser un número no negativo")
+        
+        rows = db.session.execute(
+            select(ShoppingItem.id, ShoppingItem.ingredient_id, ShoppingItem.quantity_to_buy)
+            .where(ShoppingItem.shopping_list_id == shopping_list_id,
+                   ShoppingItem.id.in_(list(purchases)),
+                   ShoppingItem.purchased.is_(False))
+            .with_for_update()
+        ).all()
+        result = {
+            'purchased': [row.id for row in rows],
+            'skipped': sorted(set(purchases) - {row.id for row in rows}),
+        }
+        if rows:
+            now = datetime.utcnow()
+            bought = [
+                (row.id, row.ingredient_id,
+                 purchases[row.id] if purchases[row.id] is not None else row.quantity_to_buy)
+                for row in rows
+            ]
+            connection = db.session.connection()
+            
+            items = ShoppingItem.__table__
+            connection.execute(
+                items.update()
+                .where(items.c.id == bindparam('item_id'))
+                .values(purchased=True, quantity_purchased=bindparam('quantity'), purchased_at=now),
+                [{'item_id': item_id, 'quantity': quantity} for item_id, _, quantity in bought]
+            )
+            
+            by_ingredient = {}
+            for _, ingredient_id, quantity in bought:
+                by_ingredient[ingredient_id] = by_ingredient.get(ingredient_id, 0.0) + quantity
+            amounts = LotService.needs_select(by_ingredient)
+            if amounts is not None:
+                amounts = amounts.subquery('bought')
+                stock = PantryStock.__table__
+                connection.execute(
+                    stock.update()
+                    .where(stock.c.ingredient_id == amounts.c.ingredient_id,
+                           stock.c.household_id == shopping_list.household_id)
+                    .values(stock_actual=stock.c.stock_actual + amounts.c.quantity,
+                            stock_planificado=stock.c.stock_planificado + amounts.c.quantity,
+                            last_updated=now)
+                )
+                stock_ids = db.session.execute(
+                    select(PantryStock.id).where(PantryStock.ingredient_id.in_(list(by_ingredient)))
+                ).scalars().all()
+                record_sync_changes(connection, 'pantry_stock', stock_ids)
+                open_list.mark(db.session, shopping_list.household_id, by_ingredient)
+                LotService.add_lots([(ingredient_id, quantity, None) for _, ingredient_id, quantity in bought],
+                                    'shopping', received_at=now)
+            
+            # Contador de pendientes; una lista normal se completa al llegar a 0
+            lists = ShoppingList.__table__
+            remaining = lists.c.pending_items - len(rows)
+            connection.execute(
+                lists.update()
+                .where(lists.c.id == shopping_list_id)
+                .ordered_values(
+                    (lists.c.completed, case((and_(remaining <= 0, lists.c.is_open.is_(False)), True),
+                                             else_=lists.c.completed)),
+                    (lists.c.pending_items, remaining),
+                )
+            )
+            record_sync_changes(connection, 'shopping_items', result['purchased'])
+            record_sync_changes(connection, 'shopping_lists', [shopping_list_id])
+            # Las filas ya cargadas en la sesión tienen los valores antiguos
+            db.session.expire_all()
+            # En una lista abierta, el resto de una compra parcial vuelve como item nuevo
+            open_list.push(db.session)
+            db.session.refresh(shopping_list)
+        
+        result['pending_items'] = shopping_list.pending_items
+        result['completed'] = shopping_list.completed
+        if auto_commit:
+            db.session.commit()
+        return result
+    
+    @staticmethod
+    def complete_shopping_list(shopping_list_id):
+        """
+        Marca lista como completada y añade ingredientes al stock ACTUAL y PLANIFICADO
+        
+        Compra a la vez todos los items pendientes (purchase_items con la
+        cantidad a comprar de cada uno). Una lista abierta se cierra al
+        completarla y se abre otra con lo que siga faltando.
+        
+        Args:
+            shopping_list_id: ID de la lista
+        """
+        shopping_list = ShoppingList.query.get_or_404(shopping_list_id)
+        reopen = shopping_list.is_open
+        
+        pending = db.session.execute(
+            select(ShoppingItem.id)
+            .where(ShoppingItem.shopping_list_id == shopping_list_id, ShoppingItem.purchased.is_(False))
+        ).scalars().all()
+        if pending:
+            ShoppingListService.purchase_items(shopping_list_id, dict.fromkeys(pending), auto_commit=False)
+        
+        shopping_list.is_open = False
+        shopping_list.completed = True
+        db.session.commit()
+        if reopen:
+            ShoppingListService.open_shopping_list()
+
+
+class ProcurementService:
+    """
+    Compras centrales: un pedido consolidado por proveedor y día de entrega
+    
+    Suma los faltantes de todos los hogares (sin filtro de hogar) y, al
+    recibir el pedido, reparte lo entregado en el almacén de cada uno en
+    proporción a su faltante.
+    """
+    
+    DEFAULT_WINDOW_DAYS = 6  # Consumo cubierto tras el día de entrega
+    EPSILON = 1e-6
+    
+    @staticmethod
+    def shortfalls(window_end, household_ids=None):
+        """
+        Faltante de cada ingrediente de cada hogar hasta window_end, en una consulta
+        
+        faltante = consumo pendiente hasta window_end (misma regla que
+        ProjectionService.daily_requirements) - stock_actual - lo ya pedido
+        en pedidos consolidados abiertos
+        
+        Args:
+            window_end: Última fecha de consumo a cubrir (incluida)
+            household_ids: Restringe a estos hogares (None = todos)
+        
+        Returns:
+            list: [(household_id, ingredient_id, nombre, unidad, faltante)]
+                  solo los positivos, ordenada por hogar
+        """
+        pending = (
+            RequirementService.select_requirements(
+                DishFlatIngredient.ingredient_id.label('ingredient_id'),
+                func.sum(RequirementService.quantity_expression()).label('quantity'))
+            .join(Day, Day.id == Meal.day_id)
+            .where(Meal.confirmed.is_(False), Meal.special_type.is_(None), Day.date <= window_end)
+            .group_by(DishFlatIngredient.ingredient_id)
+            .subquery()
+        )
+        on_order = (
+            select(ProcurementAllocation.ingredient_id.label('ingredient_id'),
+                   func.sum(ProcurementAllocation.quantity_needed).label('quantity'))
+            .join(ProcurementLine, ProcurementLine.id == ProcurementAllocation.line_id)
+            .join(ProcurementOrder, ProcurementOrder.id == ProcurementLine.order_id)
+            .where(ProcurementOrder.status == 'open')
+            .group_by(ProcurementAllocation.ingredient_id)
+            .subquery()
+        )
+        shortfall = (pending.c.quantity
+                     - func.coalesce(PantryStock.stock_actual, 0.0)
+                     - func.coalesce(on_order.c.quantity, 0.0))
+        stmt = (
+            select(Ingredient.household_id, Ingredient.id, Ingredient.name, Ingredient.unit, shortfall)
+            .join(pending, pending.c.ingredient_id == Ingredient.id)
+            .outerjoin(PantryStock, PantryStock.ingredient_id == Ingredient.id)
+            .outerjoin(on_order, on_order.c.ingredient_id == Ingredient.id)
+            .where(shortfall > ProcurementService.EPSILON)
+            .order_by(Ingredient.household_id, Ingredient.id)
+        )
+        if household_ids is not None:
+            stmt = stmt.where(Ingredient.household_id.in_(household_ids))
+        with unscoped():
+            return db.session.execute(stmt).all()
+    
+    @staticmethod
+    def preferred_suppliers(household_ids=None):
+        """
+        Proveedor de cada ingrediente: la tienda de su formato con menor precio por unidad
+        
+        Returns:
+            dict: ingredient_id -> nombre de la tienda
+        """
+        stmt = (
+            select(ProductPack.ingredient_id, Store.name, ProductPack.price / ProductPack.pack_size)
+            .join(Store, Store.id == ProductPack.store_id)
+        )
+        if household_ids is not None:
+            stmt = stmt.where(ProductPack.household_id.in_(household_ids))
+        best = {}
+        with unscoped():
+            for ingredient_id, store_name, unit_price in db.session.execute(stmt):
+                current = best.get(ingredient_id)
+                if current is None or unit_price < current[0]:
+                    best[ingredient_id] = (unit_price, store_name)
+        return {ingredient_id: store_name for ingredient_id, (_, store_name) in best.items()}
+    
+    @staticmethod
+    def generate(delivery_date, window_end=None, household_ids=None):
+        """
+        Crea los pedidos consolidados de un día de entrega
+        
+        Las líneas agrupan por proveedor, nombre normalizado e unidad base; el
+        desglose por hogar queda en ProcurementAllocation. Lo que ya está en
+        pedidos abiertos no se vuelve a pedir.
+        
+        Args:
+            delivery_date: Día de entrega
+            window_end: Última fecha de consumo a cubrir (default: entrega + DEFAULT_WINDOW_DAYS)
+            household_ids: Restringe a estos hogares (None = todos)
+        
+        Returns:
+            list: ProcurementOrder creados (uno por proveedor)
+        """
+        window_end = window_end or delivery_date + timedelta(days=ProcurementService.DEFAULT_WINDOW_DAYS)
+        if window_end < delivery_date:
+            raise ValueError("La ventana debe terminar en o después del día de entrega")
+        
+        try:
+            rows = ProcurementService.shortfalls(window_end, household_ids)
+            if not rows:
+                raise ValueError("Ningún hogar tiene faltantes en esa ventana")
+            suppliers = ProcurementService.preferred_suppliers(household_ids)
+            
+            # (proveedor, nombre normalizado, unidad) -> línea con su desglose
+            lines = {}
+            for household_id, ingredient_id, name, unit, quantity in rows:
+                supplier = suppliers.get(ingredient_id)
+                key = (supplier, search_index.normalize(name), unit)
+                line = lines.get(key)
+                if line is None:
+                    line = lines[key] = {'name': name, 'quantity': 0.0, 'allocations': []}
+                line['quantity'] += quantity
+                line['allocations'].append((household_id, ingredient_id, quantity))
+            
+            orders = {}
+            for supplier, _, unit in lines:
+                if supplier not in orders:
+                    orders[supplier] = ProcurementOrder(
+                        delivery_date=delivery_date, window_end=window_end, supplier=supplier, status='open'
+                    )
+            db.session.add_all(orders.values())
+            
+            line_objects = {}
+            for key, line in lines.items():
+                supplier, _, unit = key
+                line_objects[key] = ProcurementLine(
+                    order=orders[supplier], ingredient_name=line['name'], unit=unit,
+                    quantity_needed=line['quantity'], households=len(line['allocations'])
+                )
+            db.session.add_all(line_objects.values())
+            db.session.flush()
+            
+            db.session.execute(ProcurementAllocation.__table__.insert(), [
+                {'line_id': line_objects[key].id, 'household_id': household_id,
+                 'ingredient_id': ingredient_id, 'quantity_needed': quantity}
+                for key, line in lines.items()
+                for household_id, ingredient_id, quantity in line['allocations']
+            ])
+            
+            db.session.commit()
+            return sorted(orders.values(), key=lambda order: order.supplier or '')
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al generar pedidos consolidados: {str(e)}")
+    
+    @staticmethod
+    def receive(order_id, delivered=None):
+        """
+        Recibe un pedido consolidado y reparte lo entregado entre los hogares
+        
+        Cada hogar recibe cantidad_entregada × su_faltante / faltante_total de
+        la línea (todo lo pedido si se entrega completo; el exceso o la falta
+        se reparten en la misma proporción). Se suma a stock_actual y
+        stock_planificado con UPDATE por lotes, creando el stock que falte.
+        
+        Args:
+            order_id: ID del pedido (debe estar abierto)
+            delivered: dict line_id -> cantidad entregada (las que falten: completas)
+        
+        Returns:
+            dict: {'lines', 'households', 'allocations', 'delivered'}
+        """
+        delivered = delivered or {}
+        try:
+            with unscoped():
+                order = db.session.execute(
+                    select(ProcurementOrder).where(ProcurementOrder.id == order_id).with_for_update()
+                ).scalar_one_or_none()
+                if order is None:
+                    raise ValueError("Pedido no encontrado")
+                if order.status != 'open':
+                    raise ValueError("El pedido ya se recibió")
+                
+                ratios, line_delivered = {}, {}
+                for line_id, needed in db.session.execute(
+                        select(ProcurementLine.id, ProcurementLine.quantity_needed)
+                        .where(ProcurementLine.order_id == order_id)):
+                    quantity = delivered.get(line_id, needed)
+                    if quantity is None or not math.isfinite(quantity) or quantity < 0:
+                        raise ValueError("La cantidad entregada debe ser un número no negativo")
+                    line_delivered[line_id] = quantity
+                    ratios[line_id] = quantity / needed
+                
+                allocations = db.session.execute(
+                    select(ProcurementAllocation.id, ProcurementAllocation.line_id,
+                           ProcurementAllocation.household_id, ProcurementAllocation.ingredient_id,
+                           ProcurementAllocation.quantity_needed)
+                    .join(ProcurementLine, ProcurementLine.id == ProcurementAllocation.line_id)
+                    .where(ProcurementLine.order_id == order_id)
+                ).all()
+                
+                # Reparto proporcional en una pasada: (id, hogar, ingrediente, cantidad)
+                shares = [
+                    (row.id, row.household_id, row.ingredient_id, row.quantity_needed * ratios[row.line_id])
+                    for row in allocations
+                ]
+                deltas, households = {}, {}
+                for _, household_id, ingredient_id, quantity in shares:
+                    deltas[ingredient_id] = deltas.get(ingredient_id, 0.0) + quantity
+                    households[ingredient_id] = household_id
+                
+                conn = db.session.connection()
+                now = datetime.utcnow()
+                stock_ids_stmt = (
+                    select(PantryStock.ingredient_id, PantryStock.id)
+                    .join(ProcurementAllocation, ProcurementAllocation.ingredient_id == PantryStock.ingredient_id)
+                    .join(ProcurementLine, ProcurementLine.id == ProcurementAllocation.line_id)
+                    .where(ProcurementLine.order_id == order_id)
+                )
+                stock_ids = dict(db.session.execute(stock_ids_stmt).all())
+                missing = [ingredient_id for ingredient_id in deltas if ingredient_id not in stock_ids]
+                if missing:
+                    conn.execute(PantryStock.__table__.insert(), [
+                        {'household_id': households[ingredient_id], 'ingredient_id': ingredient_id,
+                         'stock_actual': 0.0, 'stock_planificado': 0.0, 'last_updated': now}
+                        for ingredient_id in missing
+                    ])
+                    stock_ids = dict(db.session.execute(stock_ids_stmt).all())
+                
+                table = PantryStock.__table__
+                conn.execute(
+                    table.update()
+                    .where(table.c.id == bindparam('stock_id'))
+                    .values(stock_actual=table.c.stock_actual + bindparam('delta'),
+                            stock_planificado=table.c.stock_planificado + bindparam('delta'),
+                            last_updated=now),
+                    [{'stock_id': stock_ids[ingredient_id], 'delta': delta}
+                     for ingredient_id, delta in deltas.items()]
+                )
+                
+                allocation_table = ProcurementAllocation.__table__
+                conn.execute(
+                    allocation_table.update()
+                    .where(allocation_table.c.id == bindparam('allocation_id'))
+                    .values(quantity_allocated=bindparam('quantity')),
+                    [{'allocation_id': allocation_id, 'quantity': quantity}
+                     for allocation_id, _, _, quantity in shares]
+                )
+                line_table = ProcurementLine.__table__
+                conn.execute(
+                    line_table.update()
+                    .where(line_table.c.id == bindparam('line_id'))
+                    .values(quantity_delivered=bindparam('quantity')),
+                    [{'line_id': line_id, 'quantity': quantity} for line_id, quantity in line_delivered.items()]
+                )
+                
+                by_household = {}
+                for ingredient_id, household_id in households.items():
+                    by_household.setdefault(household_id, []).append(stock_ids[ingredient_id])
+                for household_id, stock_row_ids in by_household.items():
+                    record_sync_changes(conn, 'pantry_stock', stock_row_ids, household_id=household_id)
+                for ingredient_id, household_id in households.items():
+                    open_list.mark(db.session, household_id, [ingredient_id])
+                
+                # Un lote por hogar e ingrediente, con la caducidad de cada ingrediente
+                LotService.add_lots([(ingredient_id, delta, None) for ingredient_id, delta in deltas.items()],
+                                    'procurement', received_at=now)
+                
+                order.status = 'received'
+                order.received_at = now
+                db.session.commit()
+            
+            return {
+                'lines': len(line_delivered),
+                'households': len(by_household),
+                'allocations': len(shares),
+                'delivered': sum(line_delivered.values()),
+            }
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al recibir pedido consolidado: {str(e)}")
+    
+    @staticmethod
+    def delete(order_id):
+        """Elimina un pedido abierto (sus faltantes vuelven a contar en el siguiente)"""
+        order = db.session.get(ProcurementOrder, order_id)
+        if order is None:
+            raise ValueError("Pedido no encontrado")
+        if order.status != 'open':
+            raise ValueError("No se puede eliminar un pedido ya recibido")
+        db.session.delete(order)
+        db.session.commit()
+
+
+class CalendarService:
+    """Servicio para gestión del calendario"""
+    
+    @staticmethod
+    def get_or_create_day(date):
+        """Obtiene o crea un día en el calendario"""
+        day = Day.query.filter_by(date=date).first()
+        if not day:
+            day = Day(date=date)
+            db.session.add(day)
+            
+            # Crear las 3 comidas vacías
+            for meal_type in Meal.MEAL_TYPES:
+                meal = Meal(day=day, meal_type=meal_type)
+                db.session.add(meal)
+            
+            db.session.commit()
+        return day
+    
+    @staticmethod
+    def get_week_days(start_date):
+        """Obtiene o crea 7 días consecutivos desde start_date"""
+        days = []
+        for i in range(7):
+            current_date = start_date + timedelta(days=i)
+            day = CalendarService.get_or_create_day(current_date)
+            days.append(day)
+        return days
+
+
+
+class ImportService:
+    """
+    Importación masiva de recetas y stock inicial desde CSV / JSON
+    
+    Formatos de fila (cabeceras CSV o claves JSON):
+    - recipes: dish, ingredient, quantity, unit (opcional), description (opcional)
+    - stock: ingredient, quantity, unit (opcional), expires_at (opcional, AAAA-MM-DD)
+    
+    Los nombres se resuelven contra un diccionario en memoria (nombre
+    normalizado -> id) cargado con una consulta al empezar, y las filas se
+    insertan por lotes de CHUNK_SIZE con inserts multi-fila dentro de una
+    única transacción. Los ingredientes y platos que no existen se crean; las
+    cantidades se convierten a la unidad base del ingrediente. Una fila
+    inválida no aborta la importación: se anota con su número de línea.
+    """
+    
+    CHUNK_SIZE = 1000  # Filas por lote de inserts
+    MAX_ERRORS = 500  # Errores que se devuelven con detalle (se cuentan todos)
+    FORMATS = ('csv', 'json', 'ndjson')
+    REQUIRED = {
+        'recipes': ('dish', 'ingredient', 'quantity'),
+        'stock': ('ingredient', 'quantity'),
+    }
+    
+    @staticmethod
+    def read_rows(stream, fmt):
+        """
+        Lee filas de un flujo de texto sin cargarlo entero (salvo JSON)
+        
+        Args:
+            stream: Fichero de texto abierto
+            fmt: 'csv', 'ndjson' (un objeto por línea) o 'json' (array de objetos)
+        
+        Yields:
+            tuple: (nº de línea, dict o None, mensaje de error o None)
+        """
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row, None
+        elif fmt == 'ndjson':
+            for line_number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line), None
+                except ValueError as e:
+                    yield line_number, None, f"JSON inválido: {e}"
+        elif fmt == 'json':
+            data = json.load(stream)
+            if not isinstance(data, list):
+                raise ValueError("El JSON debe ser una lista de objetos")
+            for index, row in enumerate(data, 1):
+                yield index, row, None
+        else:
+            raise ValueError(f"Formato no soportado: {fmt}")
+    
+    @staticmethod
+    def _parse_row(row, kind):
+        """Valida una fila y la devuelve con claves normalizadas"""
+        if not isinstance(row, dict):
+            raise ValueError("La fila no es un objeto")
+        values = {str(k).strip().lower(): (v.strip() if isinstance(v, str) else v)
+                  for k, v in row.items() if k is not None}
+        missing = [field for field in ImportService.REQUIRED[kind] if values.get(field) in (None, '')]
+        if missing:
+            raise ValueError(f"Faltan campos: {', '.join(missing)}")
+        try:
+            quantity = float(str(values['quantity']).replace(',', '.'))
+        except ValueError:
+            raise ValueError(f"Cantidad inválida: {values['quantity']}")
+        if not math.isfinite(quantity) or quantity < 0 or (kind == 'recipes' and quantity == 0):
+            raise ValueError(f"Cantidad fuera de rango: {values['quantity']}")
+        for field, column in (('ingredient', Ingredient.name), ('dish', Dish.name)):
+            if len(str(values.get(field) or '')) > column.type.length:
+                raise ValueError(f"Nombre demasiado largo en '{field}' (máximo {column.type.length})")
+        expires_at = None
+        if values.get('expires_at'):
+            try:
+                expires_at = date.fromisoformat(str(values['expires_at']))
+            except ValueError:
+                raise ValueError(f"Fecha de caducidad inválida: {values['expires_at']}")
+        return {
+            'dish': str(values.get('dish') or ''),
+            'description': values.get('description') or None,
+            'ingredient': str(values['ingredient']),
+            'quantity': quantity,
+            'unit': str(values.get('unit') or ''),
+            'expires_at': expires_at,
+        }
+    
+    @staticmethod
+    def import_rows(rows, kind, dry_run=False):
+        """
+        Importa filas (ver read_rows) en una sola transacción
+        
+        Args:
+            rows: Iterable de (nº de línea, dict, error)
+            kind: 'recipes' o 'stock'
+            dry_run: Si True, valida e inserta pero deshace al final
+        
+        Returns:
+            dict: {'rows', 'imported', 'ingredients_created', 'dishes_created',
+                   'dish_ingredients_created', 'stock_updated', 'errors': [{'line', 'error'}],
+                   'error_count', 'dry_run'}
+        """
+        if kind not in ImportService.REQUIRED:
+            raise ValueError(f"Tipo de importación no soportado: {kind}")
+        
+        result = {
+            'rows': 0, 'imported': 0, 'ingredients_created': 0, 'dishes_created': 0,
+            'dish_ingredients_created': 0, 'stock_updated': 0,
+            'errors': [], 'error_count': 0, 'dry_run': dry_run,
+        }
+        try:
+            db.session.flush()
+            conn = db.session.connection()
+            # Índices en memoria: una consulta por tabla para toda la importación
+            index = {
+                'ingredients': {
+                    search_index.normalize(name): (ingredient_id, unit)
+                    for ingredient_id, name, unit in db.session.execute(
+                        select(Ingredient.id, Ingredient.name, Ingredient.unit)
+                        .order_by(Ingredient.id.desc()))
+                },
+                'dishes': {},
+                'pairs': set(),
+                'stock': {},
+                'touched_dishes': set(),
+            }
+            if kind == 'recipes':
+                index['dishes'] = {
+                    search_index.normalize(name): dish_id
+                    for dish_id, name in db.session.execute(select(Dish.id, Dish.name).order_by(Dish.id.desc()))
+                }
+                index['pairs'] = set(db.session.execute(select(DishIngredient.dish_id, DishIngredient.ingredient_id)))
+            else:
+                index['stock'] = dict(db.session.execute(select(PantryStock.ingredient_id, PantryStock.id)).all())
+            
+            chunk = []
+            for line_number, row, error in rows:
+                result['rows'] += 1
+                if error is None:
+                    try:
+                        chunk.append((line_number, ImportService._parse_row(row, kind)))
+                    except ValueError as e:
+                        error = str(e)
+                if error is not None:
+                    ImportService._add_error(result, line_number, error)
+                if len(chunk) >= ImportService.CHUNK_SIZE:
+                    ImportService._import_chunk(conn, chunk, kind, index, result)
+                    chunk = []
+            if chunk:
+                ImportService._import_chunk(conn, chunk, kind, index, result)
+            # Inserts Core: la receta aplanada se recalcula aquí, no en el flush
+            if index['touched_dishes']:
+                recipes.refresh(conn, index['touched_dishes'])
+            result['errors'].sort(key=lambda error: error['line'])
+            
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+                search_index.invalidate()
+            return result
+        
+        except ValueError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al importar: {str(e)}")
+    
+    @staticmethod
+    def _add_error(result, line_number, message):
+        result['error_count'] += 1
+        if len(result['errors']) < ImportService.MAX_ERRORS:
+            result['errors'].append({'line': line_number, 'error': message})
+    
+    @staticmethod
+    def _insert_named(conn, table, rows, names):
+        """Inserta filas nuevas (del hogar activo) y devuelve {nombre normalizado: id} de las insertadas"""
+        conn.execute(table.insert(), rows)
+        return {
+            search_index.normalize(name): row_id
+            for row_id, name in conn.execute(
+                select(table.c.id, table.c.name)
+                .where(table.c.household_id == current_household_id(), table.c.name.in_(names)))
+        }
+    
+    @staticmethod
+    def _import_chunk(conn, chunk, kind, index, result):
+        """Resuelve nombres, crea lo que falta e inserta un lote de filas"""
+        now = datetime.utcnow()
+        ingredients = index['ingredients']
+        
+        # 1. Ingredientes nuevos (la unidad de su primera fila define la base)
+        new_ingredients = {}
+        for _, row in chunk:
+            key = search_index.normalize(row['ingredient'])
+            if key and key not in ingredients and key not in new_ingredients:
+                new_ingredients[key] = {'name': row['ingredient'], 'unit': units.base_unit(row['unit'] or 'unidades'),
+                                        'created_at': now}
+        if new_ingredients:
+            created = ImportService._insert_named(
+                conn, Ingredient.__table__, list(new_ingredients.values()),
+                [values['name'] for values in new_ingredients.values()])
+            for key, values in new_ingredients.items():
+                ingredients[key] = (created[key], values['unit'])
+            # Todo ingrediente tiene su fila de almacén
+            conn.execute(PantryStock.__table__.insert(), [
+                {'ingredient_id': created[key], 'stock_actual': 0.0, 'stock_planificado': 0.0, 'last_updated': now}
+                for key in new_ingredients
+            ])
+            stock_ids = dict(db.session.execute(
+                select(PantryStock.ingredient_id, PantryStock.id)
+                .where(PantryStock.ingredient_id.in_([created[key] for key in new_ingredients]))).all())
+            record_sync_changes(conn, 'pantry_stock', stock_ids.values())
+            index['stock'].update(stock_ids)
+            result['ingredients_created'] += len(new_ingredients)
+        
+        # 2. Cantidades en la unidad base del ingrediente
+        resolved = []
+        for line_number, row in chunk:
+            ingredient_id, base = ingredients[search_index.normalize(row['ingredient'])]
+            try:
+                quantity = units.convert(row['quantity'], row['unit'] or base, base)
+            except ValueError as e:
+                ImportService._add_error(result, line_number, str(e))
+                continue
+            resolved.append((line_number, row, ingredient_id, quantity))
+        
+        if kind == 'stock':
+            ImportService._import_stock(conn, resolved, index, result, now)
+        else:
+            ImportService._import_recipes(conn, resolved, index, result, now)
+    
+    @staticmethod
+    def _import_recipes(conn, resolved, index, result, now):
+        dishes = index['dishes']
+        new_dishes = {}
+        for _, row, _, _ in resolved:
+            key = search_index.normalize(row['dish'])
+            if key not in dishes and key not in new_dishes:
+                new_dishes[key] = {'name': row['dish'], 'description': row['description'], 'created_at': now}
+        if new_dishes:
+            created = ImportService._insert_named(
+                conn, Dish.__table__, list(new_dishes.values()),
+                [values['name'] for values in new_dishes.values()])
+            dishes.update({key: created[key] for key in new_dishes})
+            result['dishes_created'] += len(new_dishes)
+        
+        rows = []
+        for line_number, row, ingredient_id, quantity in resolved:
+            pair = (dishes[search_index.normalize(row['dish'])], ingredient_id)
+            if pair in index['pairs']:
+                ImportService._add_error(result, line_number,
+                                         f"'{row['ingredient']}' ya está en el plato '{row['dish']}'")
+                continue
+            index['pairs'].add(pair)
+            rows.append({'dish_id': pair[0], 'ingredient_id': ingredient_id, 'quantity': quantity})
+        if rows:
+            conn.execute(DishIngredient.__table__.insert(), rows)
+            index['touched_dishes'].update(row['dish_id'] for row in rows)
+            result['dish_ingredients_created'] += len(rows)
+            result['imported'] += len(rows)
+    
+    @staticmethod
+    def _import_stock(conn, resolved, index, result, now):
+        """El stock importado se suma al existente (real y planificado)"""
+        deltas = {}
+        for _, _, ingredient_id, quantity in resolved:
+            deltas[ingredient_id] = deltas.get(ingredient_id, 0.0) + quantity
+        if not deltas:
+            return
+        
+        missing = [ingredient_id for ingredient_id in deltas if ingredient_id not in index['stock']]
+        if missing:
+            conn.execute(PantryStock.__table__.insert(), [
+                {'ingredient_id': ingredient_id, 'stock_actual': 0.0, 'stock_planificado': 0.0, 'last_updated': now}
+                for ingredient_id in missing
+            ])
+            index['stock'].update(db.session.execute(
+                select(PantryStock.ingredient_id, PantryStock.id)
+                .where(PantryStock.ingredient_id.in_(missing))).all())
+        
+        table = PantryStock.__table__
+        conn.execute(
+            table.update()
+            .where(table.c.id == bindparam('stock_id'))
+            .values(stock_actual=table.c.stock_actual + bindparam('delta'),
+                    stock_planificado=table.c.stock_planificado + bindparam('delta'),
+                    last_updated=now),
+            [{'stock_id': index['stock'][ingredient_id], 'delta': delta} for ingredient_id, delta in deltas.items()]
+        )
+        record_sync_changes(conn, 'pantry_stock', [index['stock'][ingredient_id] for ingredient_id in deltas])
+        open_list.mark(db.session, current_household_id(), deltas)
+        LotService.add_lots([(ingredient_id, quantity, row['expires_at'])
+                             for _, row, ingredient_id, quantity in resolved], 'import', received_at=now)
+        result['stock_updated'] += len(deltas)
+        result['imported'] += len(resolved)
+
+
+class SyncService:
+    """Servicio de sincronización incremental (delta-sync) para clientes offline"""
+    
+    # Operaciones que un cliente puede subir tras trabajar sin conexión y
+    # argumentos que acepta cada una ('date' se traduce a day_id)
+    UPLOAD_OPERATIONS = {
+        'add_dish_to_meal': ('day_id', 'date', 'meal_type', 'dish_id', 'portions', 'batch_id', 'percentage', 'diners'),
+        'remove_dish_from_meal': ('meal_dish_id',),
+        'assign_special_to_meal': ('day_id', 'date', 'meal_type', 'special_type'),
+        'remove_meal': ('day_id', 'date', 'meal_type'),
+        'confirm_meal': ('meal_id',),
+        'unconfirm_meal': ('meal_id',),
+        'update_stock_actual': ('ingredient_id', 'quantity', 'operation'),
+    }
+    
+    @staticmethod
+    def current_version():
+        """Última versión registrada en el changelog (0 si está vacío)"""
+        return db.session.query(func.max(SyncChange.id)).scalar() or 0
+    
+    @staticmethod
+    def _serialize(row):
+        """Convierte una fila Core en dict JSON (fechas en ISO 8601)"""
+        return {
+            key: value.isoformat() if isinstance(value, (date, datetime)) else value
+            for key, value in row._mapping.items()
+        }
+    
+    @staticmethod
+    def get_changes(since=0, limit=5000):
+        """
+        Obtiene las filas cambiadas desde una versión dada
+        
+        Con since=0 devuelve una instantánea completa de las tablas
+        sincronizables. En otro caso solo las filas con cambios posteriores,
+        más tombstones para las eliminadas.
+        
+        Args:
+            since: Versión que ya tiene el cliente
+            limit: Máximo de entradas del changelog a procesar por llamada
+                (al menos 1, para que has_more siempre avance)
+        
+        Returns:
+            dict: {'version', 'has_more', 'full', 'changes': {tabla: [filas]},
+                   'deleted': {tabla: [ids]}}
+        """
+        limit = max(1, limit)
+        tables = {name: db.metadata.tables[name] for name in SyncChange.TRACKED_TABLES}
+        household_id = current_household_id()
+        
+        if not since:
+            version = SyncService.current_version()
+            return {
+                'version': version,
+                'has_more': False,
+                'full': True,
+                'changes': {
+                    name: [SyncService._serialize(row)
+                           for row in db.session.execute(
+                               select(table).where(table.c.household_id == household_id).order_by(table.c.id))]
+                    for name, table in tables.items()
+                },
+                'deleted': {},
+            }
+        
+        entries = db.session.execute(
+            select(SyncChange.id, SyncChange.table_name, SyncChange.row_id, SyncChange.operation)
+            .where(SyncChange.id > since)
+            .order_by(SyncChange.id)
+            .limit(limit)
+        ).all()
+        
+        # Solo cuenta la última operación de cada fila
+        latest = {}
+        for entry in entries:
+            latest[(entry.table_name, entry.row_id)] = entry.operation
+        
+        upserts, deleted = {}, {}
+        for (table_name, row_id), operation in latest.items():
+            target = upserts if operation == 'upsert' else deleted
+            target.setdefault(table_name, []).append(row_id)
+        
+        changes = {}
+        for table_name, row_ids in upserts.items():
+            table = tables[table_name]
+            rows = db.session.execute(
+                select(table).where(table.c.household_id == household_id, table.c.id.in_(row_ids)))
+            changes[table_name] = [SyncService._serialize(row) for row in rows]
+        
+        return {
+            'version': entries[-1].id if entries else since,
+            'has_more': len(entries) == limit,
+            'full': False,
+            'changes': changes,
+            'deleted': deleted,
+        }
+    
+    @staticmethod
+    def apply_uploaded_changes(operations):
+        """
+        Aplica en orden las escrituras hechas offline por un cliente
+        
+        Cada operación pasa por el servicio correspondiente, así que mantiene
+        las mismas reglas de stock que la interfaz web, y se confirma por
+        separado. Solo se aceptan los argumentos de UPLOAD_OPERATIONS. Un
+        fallo no detiene el lote: se informa por operación.
+        
+        Args:
+            operations: Lista de dicts {'op': nombre, 'args': {...}, 'client_id': opcional}
+        
+        Returns:
+            list: Resultado por operación {'client_id', 'status', 'error'}
+        """
+        results = []
+        for operation in operations:
+            result = {'client_id': None, 'status': 'ok', 'error': None}
+            try:
+                if not isinstance(operation, dict):
+                    raise ValueError("Cada operación debe ser un objeto {'op', 'args'}")
+                result['client_id'] = operation.get('client_id')
+                name = operation.get('op')
+                if name not in SyncService.UPLOAD_OPERATIONS:
+                    raise ValueError(f"Operación no soportada: {name}")
+                args = operation.get('args') or {}
+                if not isinstance(args, dict):
+                    raise ValueError("'args' debe ser un objeto")
+                unknown = set(args) - set(SyncService.UPLOAD_OPERATIONS[name])
+                if unknown:
+                    raise ValueError(f"Argumentos no permitidos en {name}: {', '.join(sorted(unknown))}")
+                args = dict(args)
+                
+                # Los clientes offline pueden referirse al día por fecha
+                if 'date' in args:
+                    day_date = datetime.strptime(args.pop('date'), '%Y-%m-%d').date()
+                    args['day_id'] = CalendarService.get_or_create_day(day_date).id
+                
+                if name == 'update_stock_actual':
+                    PantryService.update_stock_actual(**args, auto_commit=True)
+                else:
+                    getattr(MealService, name)(**args)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                result['status'] = 'error'
+                result['error'] = str(e)
+            results.append(result)
+        return results
@@ -0,0 +1,414 @@
+"""
+Snapshot binario y columnar de toda la base de datos
+
+Escribe todas las tablas de PlanBuyCook en un único fichero compacto y lo
+restaura con inserts masivos. Formato (little-endian):
+
+    MAGIC | bloques de datos ... | pie JSON | longitud del pie (uint64) | MAGIC
+
+Cada columna se guarda por trozos de CHUNK_ROWS filas como array tipado
+(int64, float64, int8, fechas como días y datetimes como microsegundos
+desde 1970). Las cadenas se codifican con diccionario: códigos int32 por
+fila y, al final de la tabla, el diccionario (longitudes + UTF-8). Los
+nulos van en un bloque de validez aparte solo si la columna tiene alguno.
+Cada bloque se comprime con zlib si así ocupa menos, y empieza alineado a
+8 bytes para que los bloques sin comprimir se lean sin copia desde mmap.
+
+El pie describe tablas, columnas y la posición de cada bloque, de modo que
+Snapshot puede leer una sola columna de un fichero mapeado en memoria sin
+tocar la base de datos (scripts de análisis del historial).
+
+Uso:
+    python snapshot.py dump backup.pbcs
+    python snapshot.py info backup.pbcs
+    python snapshot.py restore backup.pbcs --yes
+"""
+import argparse
+import json
+import mmap
+import struct
+import sys
+import time
+import zlib
+from array import array
+from datetime import date, datetime, timedelta
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, select
+import recipes
+import search_index
+from models import db, Household, DishFlatIngredient
+
+
+MAGIC = b'PBCSNAP1'
+VERSION = 1
+CHUNK_ROWS = 65536  # Filas por trozo de columna
+COMPRESSION_LEVEL = 6
+ALIGNMENT = 8
+
+EPOCH_DATE = date(1970, 1, 1)
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Tipo lógico -> código de array.array del bloque de valores
+TYPECODES = {
+    'int': 'q',
+    'float': 'd',
+    'bool': 'b',
+    'date': 'i',
+    'datetime': 'q',
+    'string': 'i',  # Código en el diccionario
+}
+
+
+def _logical_type(column):
+    column_type = column.type
+    if isinstance(column_type, Boolean):
+        return 'bool'
+    if isinstance(column_type, Integer):
+        return 'int'
+    if isinstance(column_type, (Float, Numeric)):
+        return 'float'
+    if isinstance(column_type, DateTime):
+        return 'datetime'
+    if isinstance(column_type, Date):
+        return 'date'
+    return 'string'
+
+
+def _to_bytes(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_buffer(typecode, buffer):
+    """Array tipado desde un buffer little-endian (sin copia si el orden coincide)"""
+    if sys.byteorder == 'little':
+        return memoryview(buffer).cast(typecode)
+    values = array(typecode, bytes(buffer))
+    values.byteswap()
+    return values
+
+
+# ==================== ESCRITURA ====================
+
+class _BlockWriter:
+    """Escribe bloques alineados y opcionalmente comprimidos"""
+    
+    def __init__(self, stream, compress):
+        self.stream = stream
+        self.compress = compress
+        self.offset = 0
+    
+    def write_raw(self, data):
+        self.stream.write(data)
+        self.offset += len(data)
+    
+    def block(self, data):
+        """Escribe un bloque y devuelve su descriptor [offset, longitud, codec]"""
+        padding = -self.offset % ALIGNMENT
+        if padding:
+            self.write_raw(b'\0' * padding)
+        codec = 'raw'
+        if self.compress and data:
+            packed = zlib.compress(data, COMPRESSION_LEVEL)
+            if len(packed) < len(data):
+                data, codec = packed, 'zlib'
+        offset = self.offset
+        self.write_raw(data)
+        return [offset, len(data), codec]
+
+
+def _encode(kind, value, dictionary):
+    if kind == 'string':
+        return dictionary.setdefault(value, len(dictionary))
+    if kind == 'date':
+        return (value - EPOCH_DATE).days
+    if kind == 'datetime':
+        return (value - EPOCH) // MICROSECOND
+    if kind == 'bool':
+        return 1 if value else 0
+    return value
+
+
+def _dump_table(writer, table):
+    """Escribe una tabla por trozos y devuelve su entrada del pie"""
+    columns = [
+        {'name': column.name, 'type': _logical_type(column), 'chunks': []}
+        for column in table.columns
+    ]
+    dictionaries = [{} if column['type'] == 'string' else None for column in columns]
+    
+    stmt = select(*table.columns).order_by(*table.primary_key.columns)
+    result = db.session.execute(stmt, execution_options={'yield_per': CHUNK_ROWS})
+    total = 0
+    for partition in result.partitions():
+        total += len(partition)
+        for position, column in enumerate(columns):
+            kind, dictionary = column['type'], dictionaries[position]
+            values = array(TYPECODES[kind])
+            validity = bytearray(len(partition))
+            for row_number, row in enumerate(partition):
+                value = row[position]
+                if value is None:
+                    values.append(0)
+                else:
+                    validity[row_number] = 1
+                    values.append(_encode(kind, value, dictionary))
+            column['chunks'].append({
+                'rows': len(partition),
+                'values': writer.block(_to_bytes(values)),
+                'validity': None if all(validity) else writer.block(bytes(validity)),
+            })
+    
+    for column, dictionary in zip(columns, dictionaries):
+        if dictionary is not None:
+            encoded = [str(value).encode('utf-8') for value in dictionary]
+            column['dictionary'] = {
+                'size': len(encoded),
+                'lengths': writer.block(_to_bytes(array('i', map(len, encoded)))),
+                'data': writer.block(b''.join(encoded)),
+            }
+    return {'name': table.name, 'rows': total, 'columns': columns}
+
+
+def dump(path, compress=True):
+    """
+    Escribe un snapshot de todas las tablas
+    
+    Args:
+        path: Fichero de salida
+        compress: Comprimir los bloques con zlib
+    
+    Returns:
+        dict: {'tables': {nombre: filas}, 'bytes': tamaño del fichero}
+    """
+    with open(path, 'wb') as stream:
+        writer = _BlockWriter(stream, compress)
+        writer.write_raw(MAGIC)
+        tables = [_dump_table(writer, table) for table in db.metadata.sorted_tables]
+        footer = json.dumps({
+            'version': VERSION,
+            'created_at': datetime.utcnow().isoformat(),
+            'tables': tables,
+        }, separators=(',', ':')).encode('utf-8')
+        writer.write_raw(footer)
+        writer.write_raw(struct.pack('<Q', len(footer)))
+        writer.write_raw(MAGIC)
+        return {'tables': {table['name']: table['rows'] for table in tables}, 'bytes': writer.offset}
+
+
+# ==================== LECTURA ====================
+
+class Snapshot:
+    """
+    Snapshot abierto con mmap: lectura por columnas sin base de datos
+    
+    Ejemplo:
+        with Snapshot('backup.pbcs') as snap:
+            fechas = snap.column('days', 'date')
+    """
+    
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        tail = len(MAGIC) + 8
+        if self._map[:len(MAGIC)] != MAGIC or self._map[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} no es un snapshot de PlanBuyCook")
+        footer_length = struct.unpack('<Q', self._map[-tail:-len(MAGIC)])[0]
+        footer = json.loads(self._map[-tail - footer_length:-tail])
+        if footer['version'] != VERSION:
+            self.close()
+            raise ValueError(f"Versión de snapshot no soportada: {footer['version']}")
+        self.created_at = footer['created_at']
+        self._tables = {table['name']: table for table in footer['tables']}
+        self._dictionaries = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # Quedan vistas de bloques sin comprimir vivas; se libera con ellas
+        self._file.close()
+    
+    @property
+    def tables(self):
+        """dict tabla -> nº de filas, en orden de dependencias"""
+        return {name: table['rows'] for name, table in self._tables.items()}
+    
+    def columns(self, table):
+        """Nombres de las columnas de una tabla"""
+        return [column['name'] for column in self._tables[table]['columns']]
+    
+    def _block(self, descriptor):
+        offset, length, codec = descriptor
+        data = memoryview(self._map)[offset:offset + length]
+        return zlib.decompress(data) if codec == 'zlib' else data
+    
+    def _column(self, table, name):
+        for column in self._tables[table]['columns']:
+            if column['name'] == name:
+                return column
+        raise KeyError(f"{table}.{name} no está en el snapshot")
+    
+    def _dictionary(self, table, column):
+        key = (table, column['name'])
+        if key not in self._dictionaries:
+            entry = column['dictionary']
+            lengths = _from_buffer('i', self._block(entry['lengths']))
+            data = bytes(self._block(entry['data']))
+            values, position = [], 0
+            for length in lengths:
+                values.append(data[position:position + length].decode('utf-8'))
+                position += length
+            self._dictionaries[key] = values
+        return self._dictionaries[key]
+    
+    def raw_chunks(self, table, name):
+        """
+        Trozos de una columna como arrays tipados (códigos de diccionario en
+        las cadenas), sin decodificar; los bloques sin comprimir no se copian
+        
+        Yields:
+            tuple: (valores, validez o None)
+        """
+        column = self._column(table, name)
+        for chunk in column['chunks']:
+            values = _from_buffer(TYPECODES[column['type']], self._block(chunk['values']))
+            validity = self._block(chunk['validity']) if chunk['validity'] else None
+            yield values, validity
+    
+    def _decoded_chunks(self, table, name):
+        column = self._column(table, name)
+        kind = column['type']
+        if kind == 'string':
+            decode = self._dictionary(table, column).__getitem__
+        elif kind == 'date':
+            decode = lambda days: EPOCH_DATE + timedelta(days=days)
+        elif kind == 'datetime':
+            decode = lambda micros: EPOCH + timedelta(microseconds=micros)
+        elif kind == 'bool':
+            decode = bool
+        else:
+            decode = None
+        for values, validity in self.raw_chunks(table, name):
+            if validity is not None:
+                yield [(decode(value) if decode else value) if valid else None
+                       for value, valid in zip(values, validity)]
+            elif decode:
+                yield [decode(value) for value in values]
+            else:
+                yield values.tolist()
+    
+    def column(self, table, name):
+        """Valores Python de una columna completa"""
+        values = []
+        for chunk in self._decoded_chunks(table, name):
+            values.extend(chunk)
+        return values
+    
+    def iter_chunks(self, table, columns=None):
+        """
+        Filas de una tabla por trozos
+        
+        Yields:
+            list[dict]: Hasta CHUNK_ROWS filas {columna: valor}
+        """
+        columns = columns or self.columns(table)
+        readers = [self._decoded_chunks(table, name) for name in columns]
+        for chunk in zip(*readers):
+            yield [dict(zip(columns, row)) for row in zip(*chunk)]
+
+
+# ==================== RESTAURACIÓN ====================
+
+def restore(path):
+    """
+    Sustituye el contenido de todas las tablas por el del snapshot
+    
+    Se vacían las tablas en orden inverso de dependencias y se cargan en
+    orden directo con inserts multi-fila, todo en una transacción. Las
+    columnas que ya no existen se ignoran; las nuevas toman su valor por
+    defecto.
+    
+    Returns:
+        dict: {'tables': {nombre: filas restauradas}, 'skipped': [tablas desconocidas]}
+    """
+    with Snapshot(path) as snap:
+        known = {table.name: table for table in db.metadata.sorted_tables}
+        restored = {}
+        try:
+            conn = db.session.connection()
+            for table in reversed(db.metadata.sorted_tables):
+                conn.execute(table.delete())
+            for table in db.metadata.sorted_tables:
+                if table.name not in snap.tables:
+                    continue
+                # Las columnas generadas (PantryStock.reorder_margin) las calcula la base de datos
+                columns = [name for name in snap.columns(table.name)
+                           if name in table.columns and table.columns[name].computed is None]
+                restored[table.name] = 0
+                for rows in snap.iter_chunks(table.name, columns):
+                    conn.execute(table.insert(), rows)
+                    restored[table.name] += len(rows)
+            # Snapshots anteriores a las sub-recetas: se recalcula la receta aplanada
+            if DishFlatIngredient.__tablename__ not in snap.tables:
+                for household_id in conn.execute(select(Household.id)).scalars():
+                    recipes.refresh(conn, household_id=household_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Error al restaurar snapshot: {str(e)}")
+        
+        search_index.invalidate_all()
+        return {'tables': restored, 'skipped': [name for name in snap.tables if name not in known]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot binario columnar de PlanBuyCook')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    dump_parser = subparsers.add_parser('dump', help='Escribe un snapshot')
+    dump_parser.add_argument('path')
+    dump_parser.add_argument('--no-compress', action='store_true', help='Bloques sin comprimir (lectura sin copia)')
+    info_parser = subparsers.add_parser('info', help='Muestra tablas y filas de un snapshot')
+    info_parser.add_argument('path')
+    restore_parser = subparsers.add_parser('restore', help='Sustituye la base de datos por el snapshot')
+    restore_parser.add_argument('path')
+    restore_parser.add_argument('--yes', action='store_true', help='No pedir confirmación')
+    args = parser.parse_args()
+    
+    if args.command == 'info':
+        with Snapshot(args.path) as snap:
+            print(f"📦 Snapshot del {snap.created_at}")
+            for name, rows in snap.tables.items():
+                print(f"   {name}: {rows} filas")
+        return
+    
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        if args.command == 'dump':
+            result = dump(args.path, compress=not args.no_compress)
+            print(f"✅ {sum(result['tables'].values())} filas en {result['bytes'] / 1e6:.1f} MB "
+                  f"({time.perf_counter() - started:.1f}s)")
+        else:
+            if not args.yes and input("⚠️  Se borrarán todos los datos actuales. ¿Continuar? [s/N] ").lower() != 's':
+                print("Cancelado")
+                return
+            result = restore(args.path)
+            for name in result['skipped']:
+                print(f"   ℹ️  Tabla {name} no existe en este esquema, se omite")
+            print(f"✅ {sum(result['tables'].values())} filas restauradas "
+                  f"({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Orden de recorrido de la tienda para las listas de compra
+
+Cada ingrediente tiene un pasillo (Ingredient.aisle) y cada tienda su orden
+de pasillos (StoreAisle; store_id NULL es el orden por defecto del hogar).
+ShoppingItem.sort_key guarda precalculados la posición del pasillo en la
+tienda del item y el nombre normalizado, de modo que la lista se lee ya
+ordenada con el índice (shopping_list_id, store_id, sort_key) y la plantilla
+no ordena nada.
+
+Posición de un pasillo en una tienda:
+- La de su orden, si la tienda lo tiene.
+- Si no, FALLBACK_OFFSET + la del orden por defecto (detrás de los pasillos
+  propios de la tienda, en el orden habitual del hogar).
+- Sin pasillo o fuera de ambos órdenes: UNLISTED (al final).
+
+Mantenimiento:
+- Antes de cada flush se calcula la clave de los items nuevos o con otro
+  ingrediente o tienda, con una consulta por hogar para todos ellos.
+- Tras cada flush, los cambios de orden (StoreAisle) y de pasillo o nombre
+  de un ingrediente recalculan los items afectados de las listas sin
+  completar (refresh), y solo esos.
+"""
+from collections import defaultdict
+from sqlalchemy import bindparam, event, or_, select
+from sqlalchemy.orm import Session
+from tenancy import current_household_id
+from search_index import normalize
+from models import db, Ingredient, StoreAisle, ShoppingList, ShoppingItem, record_sync_changes
+
+
+FALLBACK_OFFSET = 500  # Pasillos que la tienda no ordena: detrás de los suyos
+UNLISTED = 999  # Sin pasillo o pasillo en ningún orden
+NAME_LENGTH = 50  # Caracteres del nombre en la clave (sort_key es String(60))
+
+
+def sort_key(position, name):
+    """Clave de orden: '012 leche entera' (posición con ceros, nombre normalizado)"""
+    return f'{min(position, UNLISTED):03d} {normalize(name)[:NAME_LENGTH]}'
+
+
+def compute(connection, pairs, household_id=None):
+    """
+    Claves de orden de unos pares (ingrediente, tienda)
+    
+    Args:
+        connection: Conexión de la transacción en curso
+        pairs: Iterable de (ingredient_id, store_id); store_id None = sin tienda
+        household_id: Hogar de los pares (por defecto el activo)
+    
+    Returns:
+        dict: (ingredient_id, store_id) -> sort_key
+    """
+    household_id = household_id or current_household_id()
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    
+    ingredients = {
+        ingredient_id: (name, aisle)
+        for ingredient_id, name, aisle in connection.execute(
+            select(Ingredient.id, Ingredient.name, Ingredient.aisle)
+            .where(Ingredient.id.in_({ingredient_id for ingredient_id, _ in pairs}))
+        )
+    }
+    store_ids = {store_id for _, store_id in pairs if store_id is not None}
+    positions = {
+        (store_id, aisle): position
+        for store_id, aisle, position in connection.execute(
+            select(StoreAisle.store_id, StoreAisle.aisle, StoreAisle.position)
+            .where(StoreAisle.household_id == household_id,
+                   or_(StoreAisle.store_id.is_(None), StoreAisle.store_id.in_(store_ids)))
+        )
+    }
+    
+    keys = {}
+    for ingredient_id, store_id in pairs:
+        name, aisle = ingredients.get(ingredient_id, ('', None))
+        position = positions.get((store_id, aisle))
+        if position is None:
+            default = positions.get((None, aisle))
+            position = UNLISTED if default is None else FALLBACK_OFFSET + default
+        keys[(ingredient_id, store_id)] = sort_key(position if aisle else UNLISTED, name)
+    return keys
+
+
+def refresh(connection, ingredient_ids=None, store_ids=None, household_id=None):
+    """
+    Recalcula sort_key de los items de las listas sin completar
+    
+    Args:
+        connection: Conexión de la transacción en curso
+        ingredient_ids: Solo items de estos ingredientes (pasillo cambiado)
+        store_ids: Solo items de estas tiendas (orden cambiado); None dentro
+            de la lista es el orden por defecto, que afecta a todos los items
+        household_id: Hogar (por defecto el activo)
+    
+    Returns:
+        list: Ids de los items cuya clave ha cambiado
+    """
+    household_id = household_id or current_household_id()
+    stmt = (
+        select(ShoppingItem.id, ShoppingItem.ingredient_id, ShoppingItem.store_id, ShoppingItem.sort_key)
+        .join(ShoppingList, ShoppingList.id == ShoppingItem.shopping_list_id)
+        .where(ShoppingList.household_id == household_id, ShoppingList.completed.is_(False))
+    )
+    if ingredient_ids is not None:
+        stmt = stmt.where(ShoppingItem.ingredient_id.in_(ingredient_ids))
+    if store_ids is not None and None not in store_ids:
+        stmt = stmt.where(ShoppingItem.store_id.in_(store_ids))
+    items = connection.execute(stmt).all()
+    
+    keys = compute(connection, ((item.ingredient_id, item.store_id) for item in items), household_id)
+    changes = [
+        {'item_id': item.id, 'sort_key': keys[(item.ingredient_id, item.store_id)]}
+        for item in items
+        if item.sort_key != keys[(item.ingredient_id, item.store_id)]
+    ]
+    if changes:
+        table = ShoppingItem.__table__
+        connection.execute(
+            table.update().where(table.c.id == bindparam('item_id')).values(sort_key=bindparam('sort_key')),
+            changes
+        )
+        record_sync_changes(connection, 'shopping_items', [change['item_id'] for change in changes],
+                            household_id=household_id)
+    return [change['item_id'] for change in changes]
+
+
+def _needs_key(session, obj):
+    if obj in session.new:
+        return True
+    state = db.inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in ('ingredient_id', 'store_id'))
+
+
+@event.listens_for(Session, 'before_flush')
+def _assign_sort_keys(session, flush_context, instances):
+    """Calcula la clave de orden de los items nuevos o movidos de tienda"""
+    pending = defaultdict(list)
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, ShoppingItem) and obj.ingredient_id is not None and _needs_key(session, obj):
+            pending[obj.household_id or current_household_id()].append(obj)
+    if not pending:
+        return
+    connection = session.connection()
+    with session.no_autoflush:
+        for household_id, items in pending.items():
+            keys = compute(connection, ((item.ingredient_id, item.store_id) for item in items), household_id)
+            for item in items:
+                item.sort_key = keys[(item.ingredient_id, item.store_id)]
+
+
+def _changed_layouts(session):
+    """Ingredientes y tiendas (por hogar) cuyas claves invalida este flush"""
+    ingredients, stores = defaultdict(set), defaultdict(set)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, StoreAisle):
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            stores[obj.household_id].add(obj.store_id)
+            history = db.inspect(obj).attrs.store_id.history
+            stores[obj.household_id].update(store_id for store_id in history.deleted or ())
+        elif isinstance(obj, Ingredient) and obj in session.dirty:
+            state = db.inspect(obj)
+            if state.attrs.aisle.history.has_changes() or state.attrs.name.history.has_changes():
+                ingredients[obj.household_id].add(obj.id)
+    return ingredients, stores
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_sort_keys(session, flush_context):
+    """Lleva a las listas abiertas los cambios de orden y de pasillo del flush"""
+    ingredients, stores = _changed_layouts(session)
+    if not ingredients and not stores:
+        return
+    connection = session.connection()
+    changed = set()
+    for household_id, store_ids in stores.items():
+        changed.update(refresh(connection, store_ids=store_ids, household_id=household_id))
+    for household_id, ingredient_ids in ingredients.items():
+        changed.update(refresh(connection, ingredient_ids=ingredient_ids, household_id=household_id))
+    # Los items cargados en la sesión releen la clave nueva
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, ShoppingItem) and obj.id in changed:
+            session.expire(obj, ['sort_key'])
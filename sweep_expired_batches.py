@@ -0,0 +1,53 @@
+"""
+Barrido de batches caducados
+
+Da por perdido lo que queda de cada batch cuya fecha de caducidad ya pasó:
+registra el desperdicio, devuelve al stock planificado la parte no usada y
+deja el batch a 0% para que las consultas de disponibilidad lo ignoren.
+
+Recorre todos los hogares. Pensado para ejecutarse periódicamente (cron o systemd timer):
+    */30 * * * * cd /var/www/planbuycook && venv/bin/python sweep_expired_batches.py
+
+Uso:
+    python sweep_expired_batches.py              # Un barrido y termina
+    python sweep_expired_batches.py --loop 600   # Barrido cada 600 segundos
+"""
+import sys
+import time
+from app import create_app
+from models import db, Household
+from services import BatchExpiryService
+import tenancy
+
+
+def sweep():
+    total = 0
+    for household_id, name in db.session.execute(db.select(Household.id, Household.name).order_by(Household.id)):
+        with tenancy.use(household_id):
+            result = BatchExpiryService.sweep_expired()
+        if result['batches']:
+            total += result['batches']
+            print(f"🗑️  {name}: {result['batches']} batches caducados "
+                  f"({result['wasted_percentage']:.0f}% de plato perdido)")
+            if result['affected_meal_ids']:
+                print(f"⚠️  Comidas pendientes que usaban esos batches: {result['affected_meal_ids']}")
+    if not total:
+        print("✓ No hay batches caducados")
+
+
+def main():
+    app = create_app()
+    interval = None
+    if '--loop' in sys.argv:
+        interval = int(sys.argv[sys.argv.index('--loop') + 1])
+    
+    with app.app_context():
+        while True:
+            sweep()
+            if interval is None:
+                break
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    main()
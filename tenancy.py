@@ -0,0 +1,57 @@
+"""
+Hogar activo (multi-hogar / tenancy)
+
+Todos los datos de PlanBuyCook pertenecen a un hogar (households). El hogar
+activo se resuelve así:
+1. Un bloque `with use(household_id)` (scripts, tareas periódicas)
+2. g.household_id, fijado al principio de cada petición web
+3. DEFAULT_HOUSEHOLD_ID (hogar creado por defecto)
+
+models.py usa current_household_id() para rellenar household_id en las
+altas y para filtrar por hogar todas las consultas ORM. Dentro de
+`with unscoped()` no se filtra (procesos que cruzan hogares a propósito).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, has_app_context
+
+
+DEFAULT_HOUSEHOLD_ID = 1
+
+_household = ContextVar('household_id', default=None)
+_unscoped = ContextVar('tenancy_unscoped', default=False)
+
+
+def current_household_id():
+    """Id del hogar activo"""
+    household_id = _household.get()
+    if household_id is not None:
+        return household_id
+    if has_app_context() and g.get('household_id') is not None:
+        return g.household_id
+    return DEFAULT_HOUSEHOLD_ID
+
+
+def is_unscoped():
+    """True si las consultas no deben filtrarse por hogar"""
+    return _unscoped.get()
+
+
+@contextmanager
+def use(household_id):
+    """Ejecuta el bloque como el hogar indicado"""
+    token = _household.set(household_id)
+    try:
+        yield household_id
+    finally:
+        _household.reset(token)
+
+
+@contextmanager
+def unscoped():
+    """Desactiva el filtro por hogar en el bloque (las altas siguen usando el hogar activo)"""
+    token = _unscoped.set(True)
+    try:
+        yield
+    finally:
+        _unscoped.reset(token)
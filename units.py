@@ -0,0 +1,159 @@
+"""
+Registro de unidades de medida y conversiones entre ellas
+
+Cada unidad pertenece a una dimensión (peso, volumen, unidades) con una
+unidad base (g, ml, unidades). Las cantidades se guardan siempre en la
+unidad base del ingrediente: así los agregados (lista de compra,
+proyección, planificador) suman números sin tocar cadenas por fila.
+
+La tabla de conversión se precalcula al importar el módulo para todos los
+pares de la misma dimensión. Las unidades desconocidas (texto libre de
+datos antiguos) se tratan como su propia base y solo convierten a sí mismas.
+"""
+from collections import namedtuple
+
+
+Unit = namedtuple('Unit', ['code', 'dimension', 'factor', 'label'])
+
+MASS = 'mass'
+VOLUME = 'volume'
+COUNT = 'count'
+
+BASE_UNITS = {
+    MASS: 'g',
+    VOLUME: 'ml',
+    COUNT: 'unidades',
+}
+
+UNITS = {unit.code: unit for unit in (
+    Unit('mg', MASS, 0.001, 'Miligramos'),
+    Unit('g', MASS, 1.0, 'Gramos'),
+    Unit('kg', MASS, 1000.0, 'Kilogramos'),
+    Unit('ml', VOLUME, 1.0, 'Mililitros'),
+    Unit('cl', VOLUME, 10.0, 'Centilitros'),
+    Unit('dl', VOLUME, 100.0, 'Decilitros'),
+    Unit('l', VOLUME, 1000.0, 'Litros'),
+    Unit('cucharaditas', VOLUME, 5.0, 'Cucharaditas'),
+    Unit('cucharadas', VOLUME, 15.0, 'Cucharadas'),
+    Unit('tazas', VOLUME, 240.0, 'Tazas'),
+    Unit('unidades', COUNT, 1.0, 'Unidades'),
+    Unit('docenas', COUNT, 12.0, 'Docenas'),
+)}
+
+# Formas habituales de escribir cada unidad
+ALIASES = {
+    'gr': 'g', 'grs': 'g', 'gramo': 'g', 'gramos': 'g',
+    'kgs': 'kg', 'kilo': 'kg', 'kilos': 'kg', 'kilogramo': 'kg', 'kilogramos': 'kg',
+    'miligramo': 'mg', 'miligramos': 'mg',
+    'mililitro': 'ml', 'mililitros': 'ml',
+    'lt': 'l', 'lts': 'l', 'litro': 'l', 'litros': 'l',
+    'cucharadita': 'cucharaditas', 'cdta': 'cucharaditas', 'cdtas': 'cucharaditas',
+    'cucharada': 'cucharadas', 'cda': 'cucharadas', 'cdas': 'cucharadas',
+    'taza': 'tazas',
+    'unidad': 'unidades', 'ud': 'unidades', 'uds': 'unidades', 'u': 'unidades',
+    'pieza': 'unidades', 'piezas': 'unidades',
+    'docena': 'docenas',
+}
+
+# (origen, destino) -> factor multiplicador, solo dentro de la misma dimensión
+CONVERSIONS = {
+    (source.code, target.code): source.factor / target.factor
+    for source in UNITS.values()
+    for target in UNITS.values()
+    if source.dimension == target.dimension
+}
+
+# Unidad mayor para mostrar cantidades grandes: base -> (unidad, umbral)
+DISPLAY_UNITS = {
+    'g': ('kg', 1000.0),
+    'ml': ('l', 1000.0),
+}
+
+
+def canonical(unit):
+    """Código canónico de una unidad ('Kilos' -> 'kg'); None si es desconocida"""
+    key = (unit or '').strip().lower()
+    if key in UNITS:
+        return key
+    return ALIASES.get(key)
+
+
+def dimension(unit):
+    """Dimensión de una unidad o None si es desconocida"""
+    code = canonical(unit)
+    return UNITS[code].dimension if code else None
+
+
+def base_unit(unit):
+    """Unidad base de la dimensión ('kg' -> 'g'); las desconocidas son su propia base"""
+    code = canonical(unit)
+    if code is None:
+        return (unit or '').strip()
+    return BASE_UNITS[UNITS[code].dimension]
+
+
+def convert(quantity, from_unit, to_unit):
+    """
+    Convierte una cantidad entre unidades de la misma dimensión
+    
+    Raises:
+        ValueError: Si las unidades no son convertibles entre sí
+    """
+    if quantity is None:
+        return None
+    source, target = canonical(from_unit), canonical(to_unit)
+    if source is None or target is None:
+        if (from_unit or '').strip().lower() == (to_unit or '').strip().lower():
+            return quantity
+        raise ValueError(f"No se puede convertir de '{from_unit}' a '{to_unit}'")
+    factor = CONVERSIONS.get((source, target))
+    if factor is None:
+        raise ValueError(f"No se puede convertir de '{from_unit}' a '{to_unit}' (dimensiones distintas)")
+    return quantity * factor
+
+
+def to_base(quantity, unit):
+    """
+    Normaliza una cantidad a la unidad base de su dimensión
+    
+    Returns:
+        tuple: (cantidad en unidad base, unidad base)
+    """
+    base = base_unit(unit)
+    return convert(quantity, unit, base), base
+
+
+def compatible_units(unit):
+    """Unidades a las que se puede convertir, empezando por la base"""
+    code = canonical(unit)
+    if code is None:
+        return [(unit or '').strip()]
+    dim = UNITS[code].dimension
+    base = BASE_UNITS[dim]
+    return [base] + [u.code for u in UNITS.values() if u.dimension == dim and u.code != base]
+
+
+def compatible_units_by_base():
+    """dict unidad base -> unidades compatibles (para los selectores de los formularios)"""
+    return {base: compatible_units(base) for base in BASE_UNITS.values()}
+
+
+def format_quantity(quantity, unit):
+    """
+    Texto legible de una cantidad en unidad base: 1500 g -> '1,5 kg'
+    
+    Args:
+        quantity: Cantidad en la unidad base
+        unit: Unidad base del ingrediente
+    """
+    if quantity is None:
+        return '-'
+    display_unit = unit
+    larger = DISPLAY_UNITS.get(canonical(unit))
+    if larger and abs(quantity) >= larger[1]:
+        display_unit = larger[0]
+        quantity = convert(quantity, unit, display_unit)
+    text = f'{quantity:.2f}'.rstrip('0').rstrip('.').replace('.', ',')
+    if text in ('-0', ''):
+        text = '0'
+    return f'{text} {display_unit}'